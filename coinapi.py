@@ -1,4 +1,6 @@
 from fastapi import FastAPI, Response, Header, Query, Request
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from starlette.middleware.gzip import GZipMiddleware
 from fastapi.concurrency import run_in_threadpool
 from contextlib import asynccontextmanager
 
@@ -16,14 +18,33 @@ import random
 import redis
 import pickle
 import json
+import orjson
 import uuid
+import hmac
+import secrets
+import socket
+import ipaddress
+from urllib.parse import urlsplit
+import threading
 import aiomysql
 import math
+from decimal import Decimal
 from aiomysql.cursors import DictCursor
 from cachetools import TTLCache
 from discord_webhook import AsyncDiscordWebhook
 
 from config import load_config
+import cryptonote
+import metrics
+import tracing
+import profiling
+import querylog
+
+try:
+    # optional, adds br next to gzip
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
 
 app = FastAPI(
     title="CoinAPI",
@@ -33,26 +54,276 @@ app = FastAPI(
         "url": "http://chat.wrkz.work/",
         "email": "team@bot.tips",
     },
-    docs_url="/manual"
+    docs_url="/manual",
+    default_response_class=ORJSONResponse
 )
 config = load_config()
 pool = None
 api_ttlcache = TTLCache(maxsize=1024, ttl=10.0)
+# api_users rows by key; 0 disables, keep short unless cache_events is on to drop suspended keys
+api_key_cache = TTLCache(maxsize=4096, ttl=max(config['coinapi'].get('api_key_cache_ttl', 0), 1))
+
+metrics_registry = metrics.Registry()
+http_latency = metrics_registry.histogram(
+    "coinapi_http_request_duration_seconds", "HTTP request latency by route template, to the first response byte.",
+    ("method", "route", "status")
+)
+db_pool_wait = metrics_registry.histogram(
+    "coinapi_db_pool_wait_seconds", "Time spent waiting for a MySQL connection.", ("pool",)
+)
+rpc_latency = metrics_registry.histogram(
+    "coinapi_rpc_duration_seconds", "Wallet and daemon RPC latency.", ("coin", "method")
+)
+rpc_errors = metrics_registry.counter(
+    "coinapi_rpc_errors_total", "Failed wallet and daemon RPC calls.", ("coin", "method", "reason")
+)
+scanner_round = metrics_registry.histogram(
+    "coinapi_scanner_round_seconds", "Duration of one deposit scan of a coin.", ("family", "coin"),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+)
+scanner_last_round = {}
+scanner_height = metrics_registry.gauge(
+    "coinapi_scanner_height", "Chain height seen by the last deposit scan.", ("coin",)
+)
+pending_unlock = metrics_registry.gauge(
+    "coinapi_pending_unlock_deposits", "Deposits waiting for confirmations, as of the last unlock round.", ("coin",)
+)
+log_dropped = metrics_registry.counter(
+    "coinapi_log_dropped_total", "Discord log messages dropped because the queue was full."
+)
+log_queue = asyncio.Queue(maxsize=config['log'].get('queue_size', 1000))
+traces_dropped = metrics_registry.counter(
+    "coinapi_traces_dropped_total", "Slow request traces dropped because the export queue was full."
+)
+slow_query_config = config.get('slow_query', {})
+query_log = querylog.QueryLog(
+    slow_ms=slow_query_config.get('slow_ms', 200), keep_slow=slow_query_config.get('keep', 100)
+)
+db_query_latency = metrics_registry.histogram(
+    "coinapi_db_query_seconds", "MySQL statement latency by the helper running it.", ("fn",)
+)
+db_slow_queries = metrics_registry.counter(
+    "coinapi_db_slow_queries_total", "MySQL statements over [slow_query] slow_ms.", ("fn",)
+)
+metrics_registry.gauge(
+    "coinapi_db_slow_full_scans", "Slow statements whose captured EXPLAIN reads a whole table.",
+    collect=lambda: {(): query_log.full_scans()}
+)
+tracing_config = config.get('tracing', {})
+trace_queue = asyncio.Queue(maxsize=tracing_config.get('queue_size', 1000))
+
+def db_pool_state():
+    state = {}
+    for name, db_pool in [("api", pool), ("runner", runner.pool if "runner" in globals() else None)]:
+        if db_pool is not None:
+            state[(name, "size")] = db_pool.size
+            state[(name, "free")] = db_pool.freesize
+            state[(name, "max")] = db_pool.maxsize
+    return state
+
+metrics_registry.gauge(
+    "coinapi_db_pool_connections", "MySQL pool connections; in use is size - free.", ("pool", "state"), collect=db_pool_state
+)
+metrics_registry.gauge(
+    "coinapi_scanner_lag_seconds", "Seconds since the last completed deposit scan of a coin.", ("family", "coin"),
+    collect=lambda: {k: time.time() - v for k, v in scanner_last_round.items()}
+)
+metrics_registry.gauge(
+    "coinapi_log_queue_depth", "Discord log messages waiting to be sent.", collect=lambda: {(): log_queue.qsize()}
+)
+
+@asynccontextmanager
+async def pool_acquire(db_pool, name: str="api"):
+    start = time.perf_counter()
+    async with db_pool.acquire() as conn:
+        db_pool_wait.observe(name, value=time.perf_counter() - start)
+        tracing.add_span("db acquire", start, pool=name)
+        yield conn
+
+class InstrumentedExecute:
+    # every statement is timed into query_log and metrics by the helper running it
+    # (e.g. get_balance_coin_address), and is a span when the request is traced
+    async def execute(self, query, args=None):
+        # executemany runs its rows (or one multi-row INSERT) through execute, the helper is the first frame outside aiomysql
+        frame = sys._getframe(1)
+        while frame.f_back is not None and frame.f_globals.get('__name__', "").startswith("aiomysql"):
+            frame = frame.f_back
+        fn = frame.f_code.co_name
+        start = time.perf_counter()
+        error = None
+        try:
+            return await super().execute(query, args)
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            # bookkeeping never fails the statement itself
+            try:
+                elapsed = time.perf_counter() - start
+                if isinstance(query, (bytes, bytearray)):
+                    query = query.decode("utf-8", "replace")
+                sql = querylog.normalize_sql(query)
+                db_query_latency.observe(fn, value=elapsed)
+                tracing.add_span("db " + fn, start, error, sql=sql[:200])
+                if query_log.record(sql, fn, elapsed, error) is True:
+                    db_slow_queries.inc(fn)
+                    if slow_query_config.get('explain', True) is True and \
+                        query_log.wants_explain(sql, slow_query_config.get('explain_interval', 300)):
+                        asyncio.create_task(capture_explain(sql, query, args))
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
+
+class InstrumentedDictCursor(InstrumentedExecute, DictCursor):
+    pass
+
+async def capture_explain(sql: str, query: str, args):
+    # own connection, the slow one may be inside a transaction
+    global pool
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor(DictCursor) as cur:
+                await cur.execute("EXPLAIN " + query, args)
+                query_log.set_explain(sql, [
+                    {k: v if v is None or isinstance(v, (int, float, str)) else str(v) for k, v in i.items()}
+                    for i in await cur.fetchall()
+                ])
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+
+def record_scan_round(family: str, coin_name: str, start: float, height: int):
+    # start from time.perf_counter(), only completed scans count for the lag
+    scanner_round.observe(family, coin_name, value=time.perf_counter() - start)
+    scanner_last_round[(family, coin_name)] = time.time()
+    scanner_height.set(coin_name, value=height)
+
+compress_min_size = config['coinapi'].get('compress_min_size', 1024)
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=compress_min_size, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=compress_min_size)
+
+@app.middleware("http")
+async def observe_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    trace, trace_token = None, None
+    if tracing_config.get('enable', False) is True:
+        trace, trace_token = tracing.start_trace(
+            request.method + " " + request.url.path, tracing_config.get('sample_rate', 1.0)
+        )
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        if trace is not None:
+            response.headers["X-Trace-Id"] = trace.trace_id
+        return response
+    finally:
+        # route template, not the path, so /list_transactions/XMR/<address> stays one series
+        route = request.scope.get("route")
+        route_path = route.path if route is not None else "unmatched"
+        http_latency.observe(request.method, route_path, status, value=time.perf_counter() - start)
+        if trace is not None:
+            tracing.end_trace(trace_token)
+            finish_trace(trace, request, route_path, status)
+
+def finish_trace(trace: tracing.Trace, request: Request, route_path: str, status: int):
+    # only requests over [tracing] slow_ms are kept, runner.export_traces() writes them
+    duration = trace.finish(**{
+        "http.method": request.method, "http.route": route_path, "http.target": request.url.path,
+        "http.status_code": status
+    })
+    trace.name = request.method + " " + route_path
+    if duration * 1000 < tracing_config.get('slow_ms', 1000):
+        return
+    try:
+        trace_queue.put_nowait(trace)
+    except asyncio.QueueFull:
+        traces_dropped.inc()
+
+def dump_json(data) -> str:
+    # one orjson pass; the same text goes to api_logs and to the client
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode()
+
+def api_response(body: str):
+    # a pre-serialized body skips FastAPI's jsonable_encoder and a second encoding
+    return Response(content=body, media_type="application/json")
+
+def to_columnar(records: List[Dict]):
+    # field names sent once: {"columns": [...], "rows": [[...], ...]}
+    if len(records) == 0:
+        return {"columns": [], "rows": []}
+    columns = list(records[0].keys())
+    return {"columns": columns, "rows": [[i[c] for c in columns] for i in records]}
+
+def append_file(path: str, text: str):
+    with open(path, "a") as f:
+        f.write(text)
 
 def round_amount(amount: float, places: int):
     return math.floor(amount *10**places)/10**places
 
+def sql_amount(amount) -> Decimal:
+    # exact literal for the DECIMAL amount columns: str() keeps the digits of a float as the caller sent them,
+    # and a Decimal read back from those columns passes through unchanged
+    return Decimal(str(amount))
+
+address_locks = {}
+
+@asynccontextmanager
+async def address_lock(coin_name: str, address: str, timeout: float=300.0):
+    # serialize work on one (coin, address); with coinapi.redis_lock also across workers
+    key = "{}_{}".format(coin_name, address)
+    entry = address_locks.setdefault(key, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            redis_lock = None
+            locked = True
+            if config['coinapi'].get('redis_lock', False) is True:
+                try:
+                    redis_lock = app.r.lock(
+                        config['coinapi']['kv_prefix'] + "lock_" + key, timeout=timeout, thread_local=False
+                    )
+                    locked = await run_in_threadpool(redis_lock.acquire, blocking=True, blocking_timeout=timeout)
+                except Exception:
+                    traceback.print_exc(file=sys.stdout)
+                    locked = False
+            try:
+                yield locked
+            finally:
+                if redis_lock is not None and locked is True:
+                    try:
+                        redis_lock.release()
+                    except Exception:
+                        traceback.print_exc(file=sys.stdout)
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            address_locks.pop(key, None)
+
+def has_transfer_loop(graph: Dict, from_address: str, to_address: str):
+    # graph: {from_address: set(to_address)}; the new edge closes a loop if from_address is reachable from to_address
+    stack = [to_address]
+    seen = set()
+    while len(stack) > 0:
+        node = stack.pop()
+        if node == from_address:
+            return True
+        if node in seen:
+            continue
+        seen.add(node)
+        stack.extend(graph.get(node, ()))
+    return False
+
 async def log_to_discord(content: str, webhook: str=None) -> None:
+    # queued, runner.discord_log_worker() sends; callers no longer wait on Discord
     try:
         if webhook is None:
-            url = config['log']['discord_webhook_default']
-        else:
-            url = webhook
-        webhook = AsyncDiscordWebhook(
-            url=url,
-            content=content[:1000],
-        )
-        await webhook.execute()
+            webhook = config['log']['discord_webhook_default']
+        log_queue.put_nowait((webhook, content[:1000]))
+    except asyncio.QueueFull:
+        log_dropped.inc()
     except Exception as e:
         traceback.print_exc(file=sys.stdout)
 
@@ -63,7 +334,7 @@ async def open_connection():
             pool = await aiomysql.create_pool(
                 host=config['mysql']['host'], port=3306, minsize=4, maxsize=8,
                 user=config['mysql']['user'], password=config['mysql']['password'],
-                db=config['mysql']['db'], cursorclass=DictCursor, autocommit=True
+                db=config['mysql']['db'], cursorclass=InstrumentedDictCursor, autocommit=True
             )
     except:
         print("ERROR: Unexpected error: Could not connect to MySql instance.")
@@ -73,7 +344,7 @@ async def get_coin_setting():
     global pool
     try:
         await open_connection()
-        async with pool.acquire() as conn:
+        async with pool_acquire(pool) as conn:
             async with conn.cursor() as cur:
                 coin_list = {}
                 sql = """
@@ -94,9 +365,9 @@ async def get_coin_deposits():
     global pool
     try:
         await open_connection()
-        async with pool.acquire() as conn:
+        async with pool_acquire(pool) as conn:
             async with conn.cursor() as cur:
-                coin_addresses = []
+                coin_addresses = set()
                 coin_list_key = {}
                 sql = """
                 SELECT * FROM `deposit_addresses` 
@@ -106,25 +377,35 @@ async def get_coin_deposits():
                 if result and len(result) > 0:
                     for each in result:
                         coin_list_key["{}_{}".format(each['coin_name'], each['address'])] = each
-                        coin_addresses.append(each['address'])
+                        coin_addresses.add(each['address'])
                     return {"by_key": coin_list_key, "addresses": coin_addresses}
     except Exception:
         traceback.print_exc(file=sys.stdout)
     return None
 
+def api_by_key_sql(key: str):
+    sql = """
+    SELECT * FROM `api_users` 
+    WHERE `api_key_hash`=UNHEX(SHA2(%s, 256)) AND `api_key`=%s LIMIT 1;
+    """
+    return sql, [key, key]
+
+@tracing.traced("auth")
 async def get_api_by_key(key: str):
     global pool
+    use_cache = config['coinapi'].get('api_key_cache_ttl', 0) > 0
+    if use_cache and key in api_key_cache:
+        return api_key_cache[key]
     try:
         await open_connection()
-        async with pool.acquire() as conn:
+        async with pool_acquire(pool) as conn:
             async with conn.cursor() as cur:
-                sql = """
-                SELECT * FROM `api_users` 
-                WHERE `api_key`=%s
-                """
-                await cur.execute(sql, key)
+                sql, data_rows = api_by_key_sql(key)
+                await cur.execute(sql, tuple(data_rows))
                 result = await cur.fetchone()
                 if result:
+                    if use_cache:
+                        api_key_cache[key] = result
                     return result
     except Exception:
         traceback.print_exc(file=sys.stdout)
@@ -134,7 +415,7 @@ async def update_top_block(coin_name: str, height: int):
     global pool
     try:
         await open_connection()
-        async with pool.acquire() as conn:
+        async with pool_acquire(pool) as conn:
             async with conn.cursor() as cur:
                 sql = """
                 UPDATE `coin_settings` SET `chain_height`=%s, `chain_height_set_time`=%s
@@ -152,7 +433,7 @@ async def insert_address(
     global pool
     try:
         await open_connection()
-        async with pool.acquire() as conn:
+        async with pool_acquire(pool) as conn:
             async with conn.cursor() as cur:
                 sql = """
                 INSERT INTO `deposit_addresses` (`api_id`, `coin_name`, `created_date`, `address`, `address_extra`, `private_key`, `tag`, `second_tag`)
@@ -165,19 +446,101 @@ async def insert_address(
         traceback.print_exc(file=sys.stdout)
     return None
 
-async def get_balance_coin_address(
-    api_id: int, coin_name: str, address: str
+async def insert_addresses(
+    records
 ):
+    # records: list of (api_id, coin_name, created_date, address, address_extra, private_key, tag, second_tag);
+    # a tag stored meanwhile by a concurrent call is skipped, not failing the batch, callers re-read the tags
     global pool
     try:
         await open_connection()
-        async with pool.acquire() as conn:
+        async with pool_acquire(pool) as conn:
             async with conn.cursor() as cur:
                 sql = """
-                SELECT * FROM `deposit_addresses` 
-                WHERE `api_id`=%s AND `coin_name`=%s AND `address`=%s LIMIT 1;
+                INSERT INTO `deposit_addresses` (`api_id`, `coin_name`, `created_date`, `address`, `address_extra`, `private_key`, `tag`, `second_tag`)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE `id`=`id`
+                """
+                await cur.executemany(sql, records)
+                await conn.commit()
+                return True
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return False
+
+def claim_pool_address_sql(
+    api_id: int, coin_name: str, tag: str, second_tag: str = None
+):
+    # api_id=0 rows are the unassigned pool, LAST_INSERT_ID(id) hands back the claimed row
+    sql = """
+    UPDATE `deposit_addresses`
+    SET `api_id`=%s, `tag`=%s, `second_tag`=%s, `created_date`=%s, `id`=LAST_INSERT_ID(`id`)
+    WHERE `api_id`=0 AND `coin_name`=%s
+    ORDER BY `id` ASC LIMIT 1
+    """
+    return sql, [api_id, tag, second_tag, int(time.time()), coin_name]
+
+async def claim_pool_address(
+    api_id: int, coin_name: str, tag: str, second_tag: str = None
+):
+    global pool
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                sql, data_rows = claim_pool_address_sql(api_id, coin_name, tag, second_tag)
+                await cur.execute(sql, tuple(data_rows))
+                await conn.commit()
+                if cur.rowcount == 1:
+                    sql = """
+                    SELECT * FROM `deposit_addresses` 
+                    WHERE `id`=%s LIMIT 1;
+                    """
+                    await cur.execute(sql, (cur.lastrowid,))
+                    result = await cur.fetchone()
+                    if result:
+                        return result
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return None
+
+async def count_pool_addresses(coin_name: str):
+    global pool
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                sql = """
+                SELECT COUNT(*) AS `numb` FROM `deposit_addresses` 
+                WHERE `api_id`=0 AND `coin_name`=%s
                 """
-                await cur.execute(sql, (api_id, coin_name, address))
+                await cur.execute(sql, (coin_name,))
+                result = await cur.fetchone()
+                if result:
+                    return result['numb']
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return None
+
+def balance_coin_address_sql(
+    api_id: int, coin_name: str, address: str
+):
+    sql = """
+    SELECT * FROM `deposit_addresses` 
+    WHERE `api_id`=%s AND `coin_name`=%s AND `address_hash`=UNHEX(MD5(%s)) AND `address`=%s LIMIT 1;
+    """
+    return sql, [api_id, coin_name, address, address]
+
+async def get_balance_coin_address(
+    api_id: int, coin_name: str, address: str
+):
+    global pool
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                sql, data_rows = balance_coin_address_sql(api_id, coin_name, address)
+                await cur.execute(sql, tuple(data_rows))
                 result = await cur.fetchone()
                 if result:
                     return result
@@ -185,30 +548,118 @@ async def get_balance_coin_address(
         traceback.print_exc(file=sys.stdout)
     return None
 
+def lock_addresses_sql(
+    coin_name: str, addresses: List[str]
+):
+    # addresses sorted, rows locked in address_hash order
+    sql = """
+    SELECT `id`, `api_id`, `coin_name`, `address`, `total_deposited`, `total_received`,
+    `total_sent`, `total_withdrew`, `total_reserved` FROM `deposit_addresses` 
+    WHERE `coin_name`=%s AND `address_hash` IN (""" + ", ".join(["UNHEX(MD5(%s))"] * len(addresses)) + """)
+    ORDER BY `address_hash` FOR UPDATE
+    """
+    return sql, [coin_name] + addresses
+
 async def transfer_records(
-    records
+    api_id: int, records
 ):
     global pool
     try:
         await open_connection()
-        async with pool.acquire() as conn:
+        async with pool_acquire(pool) as conn:
             async with conn.cursor() as cur:
-                sql = """
-                INSERT INTO `transfer_records` (`api_id`, `from_address`, `to_address`, `amount`, `coin_name`, `purpose`, `timestamp`, `ref_uuid`)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                """
-                await cur.executemany(sql, records)
-                await conn.commit()
-                return True
+                await conn.begin()
+                try:
+                    # lock every address of the batch, always in the same order to avoid deadlock
+                    by_coin = {}
+                    for each in records:
+                        by_coin.setdefault(each[4], set()).update([each[1], each[2]])
+                    locked = {}
+                    for coin_name in sorted(by_coin.keys()):
+                        addresses = sorted(by_coin[coin_name])
+                        sql, data_rows = lock_addresses_sql(coin_name, addresses)
+                        await cur.execute(sql, tuple(data_rows))
+                        for each in await cur.fetchall():
+                            if each['address'] in by_coin[coin_name]:
+                                locked["{}_{}".format(each['coin_name'], each['address'])] = each
+                    balances = {
+                        k: v['total_deposited'] + v['total_received'] - v['total_sent'] - v['total_withdrew'] - float(v['total_reserved']) for k, v in locked.items()
+                    }
+
+                    errors = []
+                    for (_, from_address, to_address, amount, coin_name, _, _, _) in records:
+                        from_key = "{}_{}".format(coin_name, from_address)
+                        to_key = "{}_{}".format(coin_name, to_address)
+                        if from_key not in locked:
+                            errors.append("{}, address {}.. not in our database.".format(coin_name, from_address[0:30]))
+                        elif locked[from_key]['api_id'] != api_id:
+                            errors.append("{}, address {}.. not in our API.".format(coin_name, from_address[0:30]))
+                        elif to_key not in locked:
+                            errors.append("{}, address {}.. not in our database.".format(coin_name, to_address[0:30]))
+                        elif locked[to_key]['api_id'] == 0:
+                            # an unassigned pool address: its balance would go to whichever API claims it next
+                            errors.append("{}, address {}.. not assigned to any API.".format(coin_name, to_address[0:30]))
+                        elif balances[from_key] - amount < 0:
+                            errors.append("{}, address {}.. not sufficient balance.".format(coin_name, from_address[0:30]))
+                        else:
+                            balances[from_key] -= amount
+                            balances[to_key] += amount
+                            errors.append(None)
+
+                    if any(errors):
+                        await conn.rollback()
+                        return errors
+                    # net the batch per address: one UPDATE per distinct address instead of two per transfer row
+                    deltas = {}
+                    for (_, from_address, to_address, amount, coin_name, _, _, _) in records:
+                        sender = deltas.setdefault(locked["{}_{}".format(coin_name, from_address)]['id'], [0.0, 0, 0.0, 0])
+                        sender[2] += amount
+                        sender[3] += 1
+                        receiver = deltas.setdefault(locked["{}_{}".format(coin_name, to_address)]['id'], [0.0, 0, 0.0, 0])
+                        receiver[0] += amount
+                        receiver[1] += 1
+                    sql = """
+                    UPDATE `deposit_addresses`
+                    SET `total_received`=`total_received`+%s, `numb_received`=`numb_received`+%s,
+                    `total_sent`=`total_sent`+%s, `numb_sent`=`numb_sent`+%s
+                    WHERE `id`=%s LIMIT 1;
+                    """
+                    await cur.executemany(sql, [tuple(v) + (k,) for k, v in sorted(deltas.items())])
+                    # every transfer row is still recorded for history, with the receiving api for /changes;
+                    # stamped now that the locks are held, so time follows tr_id closely
+                    now = int(time.time())
+                    sql = """
+                    INSERT INTO `transfer_records` (`api_id`, `from_address`, `to_address`, `amount`, `coin_name`, `purpose`, `timestamp`, `ref_uuid`, `to_api_id`)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    """
+                    await cur.executemany(sql, [
+                        i[:6] + (now,) + i[7:] + (locked["{}_{}".format(i[4], i[2])]['api_id'],) for i in records
+                    ])
+                    # one event per batch for the sender and for each receiving api
+                    by_api = {}
+                    for (_, from_address, to_address, amount, coin_name, purpose, _, ref_uuid) in records:
+                        each = {"coin_name": coin_name, "from_address": from_address, "to_address": to_address, "amount": amount, "purpose": purpose}
+                        for receiver in set([api_id, locked["{}_{}".format(coin_name, to_address)]['api_id']]) - set([0]):
+                            by_api.setdefault(receiver, []).append(each)
+                    for receiver, transfers in by_api.items():
+                        await record_api_event(cur, receiver, "transfer", {"ref_uuid": records[0][7], "transfers": transfers})
+                    await conn.commit()
+                    for receiver in by_api.keys():
+                        wake_api_events(receiver)
+                    return errors
+                except Exception:
+                    await conn.rollback()
+                    raise
     except Exception:
         traceback.print_exc(file=sys.stdout)
-    return False
+    return None
 
+@tracing.traced("log")
 async def insert_api_log(api_id: int, method: str, data: str, result: str):
     global pool
     try:
         await open_connection()
-        async with pool.acquire() as conn:
+        async with pool_acquire(pool) as conn:
             async with conn.cursor() as cur:
                 sql = """
                 INSERT INTO `api_logs` (`api_id`, `method`, `data`, `result`, `time`)
@@ -221,11 +672,12 @@ async def insert_api_log(api_id: int, method: str, data: str, result: str):
         traceback.print_exc(file=sys.stdout)
     return False
 
+@tracing.traced("log")
 async def insert_api_failed_log(api_id: int, method: str, data: str, result: str):
     global pool
     try:
         await open_connection()
-        async with pool.acquire() as conn:
+        async with pool_acquire(pool) as conn:
             async with conn.cursor() as cur:
                 sql = """
                 INSERT INTO `api_logs_failed` (`api_id`, `method`, `data`, `result`, `time`)
@@ -244,7 +696,7 @@ async def find_tx_coin(
     global pool
     try:
         await open_connection()
-        async with pool.acquire() as conn:
+        async with pool_acquire(pool) as conn:
             async with conn.cursor() as cur:
                 sql = """
                 SELECT * FROM `deposits` 
@@ -264,7 +716,7 @@ async def note_tx_coin(
     global pool
     try:
         await open_connection()
-        async with pool.acquire() as conn:
+        async with pool_acquire(pool) as conn:
             async with conn.cursor() as cur:
                 sql = """
                 UPDATE `deposits`
@@ -286,7 +738,7 @@ async def update_second_tag(
         if second_tag is None:
             return False
         await open_connection()
-        async with pool.acquire() as conn:
+        async with pool_acquire(pool) as conn:
             async with conn.cursor() as cur:
                 sql = """
                 UPDATE `deposit_addresses`
@@ -300,19 +752,27 @@ async def update_second_tag(
         traceback.print_exc(file=sys.stdout)
     return False
 
+def address_coin_tag_sql(
+    coin_name: str, tag: str, api_id: int
+):
+    # tag_hash is MD5(LOWER(tag)) and `tag`= compares with the table collation,
+    # so tags match case-insensitively like the unique key (api_id, coin_name, tag)
+    sql = """
+    SELECT * FROM `deposit_addresses` 
+    WHERE `api_id`=%s AND `coin_name`=%s AND `tag_hash`=UNHEX(MD5(LOWER(%s))) AND `tag`=%s LIMIT 1;
+    """
+    return sql, [api_id, coin_name, tag, tag]
+
 async def find_address_coin_tag(
     coin_name: str, tag: str, api_id: int
 ):
     global pool
     try:
         await open_connection()
-        async with pool.acquire() as conn:
+        async with pool_acquire(pool) as conn:
             async with conn.cursor() as cur:
-                sql = """
-                SELECT * FROM `deposit_addresses` 
-                WHERE `api_id`=%s AND `coin_name`=%s AND `tag`=%s LIMIT 1;
-                """
-                await cur.execute(sql, (api_id, coin_name, tag))
+                sql, data_rows = address_coin_tag_sql(coin_name, tag, api_id)
+                await cur.execute(sql, tuple(data_rows))
                 result = await cur.fetchone()
                 if result:
                     return result
@@ -320,20 +780,73 @@ async def find_address_coin_tag(
         traceback.print_exc(file=sys.stdout)
     return None
 
+def addresses_coin_tags_sql(
+    api_id: int, coin_tags
+):
+    sql = """
+    SELECT * FROM `deposit_addresses` 
+    WHERE `api_id`=%s AND (`coin_name`, `tag_hash`) IN (""" + ", ".join(["(%s, UNHEX(MD5(LOWER(%s))))"] * len(coin_tags)) + """)
+    """
+    return sql, [api_id] + [v for i in coin_tags for v in i]
+
+def tag_key(coin_name: str, tag: str):
+    # tags compare case-insensitively, as the unique key (api_id, coin_name, tag) does
+    return (coin_name, tag.lower() if tag is not None else None)
+
+async def find_addresses_coin_tags(
+    api_id: int, coin_tags
+):
+    # coin_tags: list of (coin_name, tag), resolved with one query
+    global pool
+    try:
+        if len(coin_tags) == 0:
+            return []
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                sql, data_rows = addresses_coin_tags_sql(api_id, coin_tags)
+                await cur.execute(sql, tuple(data_rows))
+                result = await cur.fetchall()
+                if result:
+                    wanted = set([tag_key(*i) for i in coin_tags])
+                    return [i for i in result if tag_key(i['coin_name'], i['tag']) in wanted]
+    except Exception as e:
+        traceback.print_exc(file=sys.stdout)
+    return []
+
+def addresses_coin_sql(
+    coin_name: str, api_id: int, tag_prefix: str = None, after: int = None
+):
+    # keyset over id, oldest address first
+    sql_where = ""
+    data_rows = [api_id, coin_name]
+    if tag_prefix is not None:
+        sql_where += " AND `tag` LIKE %s"
+        data_rows.append(tag_prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+    if after is not None:
+        sql_where += " AND `id`>%s"
+        data_rows.append(after)
+    sql = """
+    SELECT `id`, `coin_name`, `created_date`, `address`, `address_extra`, `tag`, `total_deposited`, `numb_deposit`, 
+    `total_received`, `numb_received`, `total_sent`, `numb_sent`, `total_withdrew`, `numb_withdrew` FROM `deposit_addresses` 
+    WHERE `api_id`=%s AND `coin_name`=%s 
+    """ + sql_where + """
+    ORDER BY `id` ASC
+    """
+    return sql, data_rows
+
 async def get_addresses_coin_api(
-    coin_name: str, api_id: int
+    coin_name: str, api_id: int, tag_prefix: str = None, limit: int = 1000, after: int = None
 ):
     global pool
     try:
         await open_connection()
-        async with pool.acquire() as conn:
+        async with pool_acquire(pool) as conn:
             async with conn.cursor() as cur:
-                sql = """
-                SELECT `coin_name`, `created_date`, `address`, `address_extra`, `tag`, `total_deposited`, `numb_deposit`, 
-                `total_received`, `numb_received`, `total_sent`, `numb_sent`, `total_withdrew`, `numb_withdrew` FROM `deposit_addresses` 
-                WHERE `api_id`=%s AND `coin_name`=%s
-                """
-                await cur.execute(sql, (api_id, coin_name))
+                sql, data_rows = addresses_coin_sql(coin_name, api_id, tag_prefix, after)
+                sql += " LIMIT %s"
+                data_rows.append(limit)
+                await cur.execute(sql, tuple(data_rows))
                 result = await cur.fetchall()
                 if result:
                     return result
@@ -341,27 +854,69 @@ async def get_addresses_coin_api(
         traceback.print_exc(file=sys.stdout)
     return []
 
+async def stream_addresses_coin_api(
+    coin_name: str, api_id: int, tag_prefix: str = None, after: int = None, chunk: int = 500
+):
+    # keyset pages over id, memory stays at one chunk and no connection is held while the client reads
+    global pool
+    while True:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                sql, data_rows = addresses_coin_sql(coin_name, api_id, tag_prefix, after)
+                await cur.execute(sql + " LIMIT %s", tuple(data_rows + [chunk]))
+                rows = await cur.fetchall()
+        if not rows:
+            break
+        yield rows
+        if len(rows) < chunk:
+            break
+        after = rows[-1]['id']
+
+def parse_cursor(cursor: str):
+    # "<time_insert>_<id>" -> (time_insert, id), None if malformed
+    try:
+        time_part, id_part = cursor.split("_")
+        return int(time_part), int(id_part)
+    except Exception:
+        return None
+
+def txes_address_coin_sql(
+    coin_name: str, api_id: int, address: str = None, before: tuple = None, since: tuple = None
+):
+    # keyset over (time_insert, id): newest first, or oldest first when reading forward with since
+    sql_where = ""
+    data_rows = [api_id, coin_name]
+    if address is not None:
+        sql_where += " AND `deposits`.`address_hash`=UNHEX(MD5(%s)) AND `deposits`.`address`=%s"
+        data_rows += [address, address]
+    order = "DESC"
+    if before is not None:
+        sql_where += " AND (`deposits`.`time_insert`<%s OR (`deposits`.`time_insert`=%s AND `deposits`.`id`<%s))"
+        data_rows += [before[0], before[0], before[1]]
+    elif since is not None:
+        sql_where += " AND (`deposits`.`time_insert`>%s OR (`deposits`.`time_insert`=%s AND `deposits`.`id`>%s))"
+        data_rows += [since[0], since[0], since[1]]
+        order = "ASC"
+    sql = """
+    SELECT `deposits`.*, `deposit_addresses`.`tag`, `deposit_addresses`.`second_tag` FROM `deposits` 
+    INNER JOIN  `deposit_addresses` ON `deposit_addresses`.`id`=`deposits`.`depost_id` 
+    WHERE `deposits`.`api_id`=%s AND `deposits`.`coin_name`=%s 
+    """ + sql_where + """
+    ORDER BY `deposits`.`time_insert` """ + order + """, `deposits`.`id` """ + order + """
+    """
+    return sql, data_rows
+
 async def get_txes_address_coin_api(
-    coin_name: str, api_id: int, address: str = None, limit: int = 1000
+    coin_name: str, api_id: int, address: str = None, limit: int = 1000, before: tuple = None, since: tuple = None
 ):
     global pool
     try:
         await open_connection()
-        async with pool.acquire() as conn:
+        async with pool_acquire(pool) as conn:
             async with conn.cursor() as cur:
-                sql_addr = ""
-                data_rows = [api_id, coin_name]
-                if address is not None:
-                    sql_addr = " AND `deposits`.`address`=%s"
-                    data_rows.append(address)
-                sql = """
-                SELECT `deposits`.*, `deposit_addresses`.`tag`, `deposit_addresses`.`second_tag` FROM `deposits` 
-                INNER JOIN  `deposit_addresses` ON `deposit_addresses`.`id`=`deposits`.`depost_id` 
-                WHERE `deposits`.`api_id`=%s AND `deposits`.`coin_name`=%s 
-                """ +sql_addr+ """
-                ORDER BY `deposits`.`time_insert` DESC
-                LIMIT %s
-                """
+                sql, data_rows = txes_address_coin_sql(coin_name, api_id, address, before, since)
+                sql += " LIMIT %s"
                 data_rows.append(limit)
                 await cur.execute(sql, tuple(data_rows))
                 result = await cur.fetchall()
@@ -371,91 +926,850 @@ async def get_txes_address_coin_api(
         traceback.print_exc(file=sys.stdout)
     return []
 
-async def insert_withdraw_success(
-    api_id: int, coin_name: str, from_address: str, amount: float, fee_and_tax: float, from_deposit_id: int,
-    to_address: str, txid: str, tx_key: str, remark: str, ref_uuid: str
+async def stream_txes_address_coin_api(
+    coin_name: str, api_id: int, address: str = None, before: tuple = None, since: tuple = None, chunk: int = 500
 ):
+    # keyset pages of chunk rows, the connection goes back to the pool between pages so a slow reader holds none
     global pool
-    try:
+    while True:
         await open_connection()
-        async with pool.acquire() as conn:
+        async with pool_acquire(pool) as conn:
             async with conn.cursor() as cur:
-                sql = """
-                INSERT INTO `withdraws` (`api_id`, `coin_name`, `from_address`, `amount`, `fee_and_tax`, `from_deposit_id`,
-                `to_address`, `txid`, `tx_key`, `timestamp`, `remark`, `ref_uuid`)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """
-                await cur.execute(sql, (
-                    api_id, coin_name, from_address, amount, fee_and_tax, from_deposit_id, to_address,
-                    txid, tx_key, int(time.time()), remark, ref_uuid
-                ))
-                await conn.commit()
-                return True
-    except Exception:
-        traceback.print_exc(file=sys.stdout)
-    return False
-# End of database
+                sql, data_rows = txes_address_coin_sql(coin_name, api_id, address, before, since)
+                await cur.execute(sql + " LIMIT %s", tuple(data_rows + [chunk]))
+                rows = await cur.fetchall()
+        if not rows:
+            break
+        yield rows
+        if len(rows) < chunk:
+            break
+        if since is not None:
+            since = (rows[-1]['time_insert'], rows[-1]['id'])
+        else:
+            before = (rows[-1]['time_insert'], rows[-1]['id'])
 
-async def xmr_make_integrate(
-    url: str, main_address: str
+async def reserve_withdraw(
+    api_id: int, coin_name: str, from_address: str, amount: float, fee_and_tax: float, round_places: int,
+    job_id: str = None, to_address: str = None, remark: str = None
 ):
+    global pool
     try:
-        headers = {
-            'Content-Type': 'application/json'
-        }
-        json_data = {
-            "jsonrpc": "2.0",
-            "id":"0",
-            "method":"make_integrated_address",
-            "params":{
-                "standard_address": main_address
-            }
-        }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=json_data, headers=headers, timeout=15) as response:
-                if response.status == 200:
-                    res_data = await response.read()
-                    return json.loads(res_data.decode('utf-8'))
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                await conn.begin()
+                try:
+                    sql = """
+                    SELECT * FROM `deposit_addresses` 
+                    WHERE `api_id`=%s AND `coin_name`=%s AND `address_hash`=UNHEX(MD5(%s)) AND `address`=%s LIMIT 1 FOR UPDATE
+                    """
+                    await cur.execute(sql, (api_id, coin_name, from_address, from_address))
+                    result = await cur.fetchone()
+                    if result is None:
+                        await conn.rollback()
+                        return None
+                    balance = round_amount(
+                        result['total_deposited'] + result['total_received'] - result['total_sent'] - result['total_withdrew'] - float(result['total_reserved']),
+                        round_places
+                    )
+                    if amount + fee_and_tax > balance:
+                        await conn.rollback()
+                        return {"reserved": False, "balance": balance, "deposit_id": result['id']}
+                    sql = """
+                    UPDATE `deposit_addresses`
+                    SET `total_reserved`=`total_reserved`+%s+%s
+                    WHERE `id`=%s LIMIT 1;
+                    """
+                    await cur.execute(sql, (sql_amount(amount), sql_amount(fee_and_tax), result['id']))
+                    if job_id is not None:
+                        sql = """
+                        INSERT INTO `withdraw_jobs` (`job_id`, `api_id`, `coin_name`, `from_address`, `from_deposit_id`, `to_address`,
+                        `amount`, `fee_and_tax`, `remark`, `status`, `created`)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        """
+                        await cur.execute(sql, (
+                            job_id, api_id, coin_name, from_address, result['id'], to_address,
+                            sql_amount(amount), sql_amount(fee_and_tax), remark, "PENDING", int(time.time())
+                        ))
+                    await conn.commit()
+                    return {"reserved": True, "balance": balance, "deposit_id": result['id']}
+                except Exception:
+                    await conn.rollback()
+                    raise
     except Exception:
         traceback.print_exc(file=sys.stdout)
     return None
 
-async def call_doge(url: str, method_name: str, coin: str, payload: str = None) -> Dict:
-    timeout = 150
-    coin_name = coin.upper()
-    if payload is None:
-        data = '{"jsonrpc": "1.0", "id":"' + str(
-            uuid.uuid4()) + '", "method": "' + method_name + '", "params": [] }'
-    else:
-        data = '{"jsonrpc": "1.0", "id":"' + str(
-            uuid.uuid4()) + '", "method": "' + method_name + '", "params": [' + payload + '] }'
+async def complete_withdraw(
+    api_id: int, coin_name: str, from_address: str, amount: float, fee_and_tax: float, from_deposit_id: int,
+    to_address: str, txid: str, tx_key: str, remark: str, ref_uuid: str, job_id: str = None
+):
+    global pool
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, data=data, timeout=timeout) as response:
-                if response.status == 200:
-                    res_data = await response.read()
-                    res_data = res_data.decode('utf-8')
-                    decoded_data = json.loads(res_data)
-                    return decoded_data['result']
-                else:
-                    print(f'Call {coin_name} returns {str(response.status)} with method {method_name}')
-                    print(data)
-    except (aiohttp.client_exceptions.ServerDisconnectedError, aiohttp.client_exceptions.ClientOSError):
-        print("call_doge: got disconnected for coin: {}".format(coin_name))
-    except asyncio.TimeoutError:
-        print('TIMEOUT: method_name: {} - COIN: {} - timeout {}'.format(method_name, coin.upper(), timeout))
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                await conn.begin()
+                try:
+                    sql = """
+                    INSERT INTO `withdraws` (`api_id`, `coin_name`, `from_address`, `amount`, `fee_and_tax`, `from_deposit_id`,
+                    `to_address`, `txid`, `tx_key`, `timestamp`, `remark`, `ref_uuid`)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    """
+                    await cur.execute(sql, (
+                        api_id, coin_name, from_address, float(amount), float(fee_and_tax), from_deposit_id, to_address,
+                        txid, tx_key, int(time.time()), remark, ref_uuid
+                    ))
+                    sql = """
+                    UPDATE `deposit_addresses`
+                    SET `total_reserved`=`total_reserved`-%s-%s
+                    WHERE `id`=%s LIMIT 1;
+                    """
+                    await cur.execute(sql, (sql_amount(amount), sql_amount(fee_and_tax), from_deposit_id))
+                    if job_id is not None:
+                        sql = """
+                        UPDATE `withdraw_jobs`
+                        SET `status`=%s, `txid`=%s, `ref_uuid`=%s, `updated`=%s
+                        WHERE `job_id`=%s LIMIT 1;
+                        """
+                        await cur.execute(sql, ("SENT", txid, ref_uuid, int(time.time()), job_id))
+                    await record_api_event(cur, api_id, "withdraw_sent", {
+                        "coin_name": coin_name, "from_address": from_address, "to_address": to_address, "amount": float(amount),
+                        "fee": float(fee_and_tax), "txid": txid, "ref_uuid": ref_uuid, "job_id": job_id, "remark": remark
+                    })
+                    await conn.commit()
+                    wake_api_events(api_id)
+                    return True
+                except Exception:
+                    await conn.rollback()
+                    raise
     except Exception:
         traceback.print_exc(file=sys.stdout)
+    return False
 
-async def send_external_doge(
-    url: str, coment_from: str, amount: float, to_address: str, coin: str, has_pos: int = 0
+async def release_withdraw(
+    from_deposit_id: int, amount: float, fee_and_tax: float, job_id: str = None, message: str = None
 ):
-    coin_name = coin.upper()
+    global pool
     try:
-        comment_to = to_address
-        payload = f'"{to_address}", {amount}, "{coment_from}", "{comment_to}", false'
-        if has_pos == 1:
-            payload = f'"{to_address}", {amount}, "{coment_from}", "{comment_to}"'
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                await conn.begin()
+                try:
+                    sql = """
+                    UPDATE `deposit_addresses`
+                    SET `total_reserved`=`total_reserved`-%s-%s
+                    WHERE `id`=%s LIMIT 1;
+                    """
+                    await cur.execute(sql, (sql_amount(amount), sql_amount(fee_and_tax), from_deposit_id))
+                    if job_id is not None:
+                        sql = """
+                        UPDATE `withdraw_jobs`
+                        SET `status`=%s, `message`=%s, `updated`=%s
+                        WHERE `job_id`=%s LIMIT 1;
+                        """
+                        await cur.execute(sql, ("FAILED", message, int(time.time()), job_id))
+                    await conn.commit()
+                    return True
+                except Exception:
+                    await conn.rollback()
+                    raise
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return False
+
+async def claim_withdraw_job(job_id: str):
+    global pool
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                # only one worker (in any process) can move a job out of PENDING
+                sql = """
+                UPDATE `withdraw_jobs`
+                SET `status`=%s, `updated`=%s
+                WHERE `job_id`=%s AND `status`=%s LIMIT 1;
+                """
+                await cur.execute(sql, ("SENDING", int(time.time()), job_id, "PENDING"))
+                await conn.commit()
+                if cur.rowcount == 1:
+                    sql = """
+                    SELECT * FROM `withdraw_jobs` 
+                    WHERE `job_id`=%s LIMIT 1;
+                    """
+                    await cur.execute(sql, (job_id,))
+                    result = await cur.fetchone()
+                    if result:
+                        return result
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return None
+
+async def claim_withdraw_batch(coin_name: str, batch_id: str, limit: int):
+    global pool
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                sql = """
+                UPDATE `withdraw_jobs`
+                SET `status`=%s, `batch_id`=%s, `updated`=%s
+                WHERE `coin_name`=%s AND `status`=%s
+                ORDER BY `id` ASC LIMIT %s
+                """
+                await cur.execute(sql, ("SENDING", batch_id, int(time.time()), coin_name, "PENDING", limit))
+                await conn.commit()
+                if cur.rowcount > 0:
+                    sql = """
+                    SELECT * FROM `withdraw_jobs` 
+                    WHERE `batch_id`=%s
+                    ORDER BY `id` ASC
+                    """
+                    await cur.execute(sql, (batch_id,))
+                    result = await cur.fetchall()
+                    if result:
+                        return result
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return []
+
+async def get_withdraw_job(job_id: str, api_id: int):
+    global pool
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                sql = """
+                SELECT * FROM `withdraw_jobs` 
+                WHERE `job_id`=%s AND `api_id`=%s LIMIT 1;
+                """
+                await cur.execute(sql, (job_id, api_id))
+                result = await cur.fetchone()
+                if result:
+                    return result
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return None
+
+async def get_withdraw_jobs_by_status(status: str, older_than: int = 0):
+    global pool
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                sql = """
+                SELECT * FROM `withdraw_jobs` 
+                WHERE `status`=%s AND `created`<=%s
+                ORDER BY `id` ASC
+                """
+                await cur.execute(sql, (status, int(time.time()) - older_than))
+                result = await cur.fetchall()
+                if result:
+                    return result
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return []
+
+WEBHOOK_EVENTS = ["deposit_pending", "deposit_credited", "withdraw_sent", "transfer"]
+
+async def record_api_event(cur, api_id: int, event_type: str, data: Dict):
+    # run on the writer's cursor inside its transaction, so an event is stored exactly when its change commits;
+    # call wake_api_events(api_id) after the commit; api_id 0 is the unassigned pool, nobody reads it
+    if api_id == 0:
+        return
+    now = int(time.time())
+    payload = dump_json({"type": event_type, "data": data, "time": now})
+    sql = """
+    INSERT INTO `api_events` (`api_id`, `event_type`, `payload`, `created`) 
+    VALUES (%s, %s, %s, %s)
+    """
+    await cur.execute(sql, (api_id, event_type, payload, now))
+    sql = """
+    INSERT INTO `webhook_outbox` (`webhook_id`, `api_id`, `event_type`, `payload`, `next_attempt`, `created`) 
+    SELECT `id`, `api_id`, %s, %s, %s, %s FROM `api_webhooks` 
+    WHERE `api_id`=%s AND `is_active`=1 AND FIND_IN_SET(%s, `events`)
+    """
+    await cur.execute(sql, (event_type, payload, now, now, api_id, event_type))
+
+async def get_api_events(api_id: int, after_id: int, event_types: List[str] = None, limit: int = 100):
+    # (events, pending): events stop at the first one newer than [events] settle seconds, since a lower id
+    # may still be committing and the cursor must not pass it; pending tells the caller to look again soon
+    global pool
+    settled = int(time.time()) - config.get('events', {}).get('settle', 2)
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                sql_where = ""
+                data_rows = [api_id, after_id]
+                if event_types:
+                    sql_where = " AND `event_type` IN (" + ", ".join(["%s"] * len(event_types)) + ")"
+                    data_rows += event_types
+                sql = """
+                SELECT `id`, `event_type`, `payload`, `created` FROM `api_events` 
+                WHERE `api_id`=%s AND `id`>%s""" + sql_where + """
+                ORDER BY `id` ASC LIMIT %s
+                """
+                await cur.execute(sql, tuple(data_rows + [limit]))
+                events = []
+                for each in await cur.fetchall():
+                    if each['created'] > settled:
+                        return events, True
+                    events.append(each)
+                return events, False
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return [], False
+
+async def get_last_api_event_id(api_id: int):
+    global pool
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                sql = """
+                SELECT MAX(`id`) AS `last_id` FROM `api_events` 
+                WHERE `api_id`=%s
+                """
+                await cur.execute(sql, (api_id,))
+                result = await cur.fetchone()
+                if result and result['last_id'] is not None:
+                    return result['last_id']
+                return 0
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return None
+
+def parse_changes_cursor(cursor: str):
+    # "<address created>.<address id>-<deposit id>-<credit event id>-<transfer id>-<withdraw id>", None if malformed;
+    # an older cursor with a plain address id restarts the addresses section
+    try:
+        parts = cursor.split("-")
+        if len(parts) == 5:
+            address = tuple([int(i) for i in parts[0].split(".")])
+            if len(address) == 1:
+                address = (0, 0)
+            if len(address) == 2:
+                return [address] + [int(i) for i in parts[1:]]
+    except Exception:
+        pass
+    return None
+
+# column each /changes section is settled by
+CHANGES_TIME_COLUMNS = {
+    "addresses": "created_date", "deposits": "time_insert", "credits": "created", "transfers": "timestamp", "withdraws": "timestamp"
+}
+
+def changes_sql(api_id: int, after: List, limit: int):
+    # {section: (sql, data_rows)}, oldest first from each section's cursor; addresses follow
+    # (created_date, id) since a claimed pool address keeps its old id but gets a new created_date
+    return {
+        "addresses": ("""
+        SELECT `id`, `coin_name`, `address`, `tag`, `created_date` FROM `deposit_addresses` 
+        WHERE `api_id`=%s AND (`created_date`>%s OR (`created_date`=%s AND `id`>%s)) 
+        ORDER BY `created_date` ASC, `id` ASC LIMIT %s
+        """, [api_id, after[0][0], after[0][0], after[0][1], limit]),
+        "deposits": ("""
+        SELECT `id`, `coin_name`, `txid`, `address`, `amount`, `height`, `time_insert`, `can_credit` FROM `deposits` 
+        WHERE `api_id`=%s AND `id`>%s ORDER BY `id` ASC LIMIT %s
+        """, [api_id, after[1], limit]),
+        "credits": ("""
+        SELECT `id`, `payload`, `created` FROM `api_events` 
+        WHERE `api_id`=%s AND `id`>%s AND `event_type`=%s ORDER BY `id` ASC LIMIT %s
+        """, [api_id, after[2], "deposit_credited", limit]),
+        "transfers": ("""
+        (SELECT * FROM `transfer_records` WHERE `api_id`=%s AND `tr_id`>%s ORDER BY `tr_id` ASC LIMIT %s)
+        UNION
+        (SELECT * FROM `transfer_records` WHERE `to_api_id`=%s AND `tr_id`>%s ORDER BY `tr_id` ASC LIMIT %s)
+        ORDER BY `tr_id` ASC LIMIT %s
+        """, [api_id, after[3], limit, api_id, after[3], limit, limit]),
+        "withdraws": ("""
+        SELECT * FROM `withdraws` 
+        WHERE `api_id`=%s AND `id`>%s ORDER BY `id` ASC LIMIT %s
+        """, [api_id, after[4], limit]),
+    }
+
+async def get_changes(api_id: int, after: List, limit: int, settled: int):
+    # each section stops at its first row newer than settled: rows after it can carry an older time and
+    # lower ids may still be committing, so the cursor must not move past it (the client gets it next call)
+    global pool
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                changes = {}
+                for section, (sql, data_rows) in changes_sql(api_id, after, limit).items():
+                    await cur.execute(sql, tuple(data_rows))
+                    rows = []
+                    for each in await cur.fetchall():
+                        if each[CHANGES_TIME_COLUMNS[section]] > settled:
+                            break
+                        rows.append(each)
+                    changes[section] = rows
+                return changes
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return None
+
+def transfers_coin_sql(
+    coin_name: str, api_id: int, address: str = None, ref_uuid: str = None, limit: int = 500, before: int = None
+):
+    # newest first; sent rows are found by (api_id, coin_name, tr_id), received ones by (to_api_id, coin_name, tr_id)
+    sql_before = " AND `tr_id`<%s" if before is not None else ""
+    data_before = [before] if before is not None else []
+    if ref_uuid is not None:
+        sql_where = " AND (`from_address`=%s OR `to_address`=%s)" if address is not None else ""
+        sql = """
+        SELECT * FROM `transfer_records` 
+        WHERE `ref_uuid`=%s AND `coin_name`=%s AND (`api_id`=%s OR `to_api_id`=%s)""" + sql_where + sql_before + """
+        ORDER BY `tr_id` DESC LIMIT %s
+        """
+        data_rows = [ref_uuid, coin_name, api_id, api_id] + ([address, address] if address is not None else []) + data_before + [limit]
+    elif address is not None:
+        sql = """
+        (SELECT * FROM `transfer_records` WHERE `from_address`=%s AND `coin_name`=%s AND `api_id`=%s""" + sql_before + """ 
+        ORDER BY `tr_id` DESC LIMIT %s)
+        UNION
+        (SELECT * FROM `transfer_records` WHERE `to_address`=%s AND `coin_name`=%s AND `to_api_id`=%s""" + sql_before + """ 
+        ORDER BY `tr_id` DESC LIMIT %s)
+        ORDER BY `tr_id` DESC LIMIT %s
+        """
+        data_rows = [address, coin_name, api_id] + data_before + [limit, address, coin_name, api_id] + data_before + [limit, limit]
+    else:
+        sql = """
+        (SELECT * FROM `transfer_records` WHERE `api_id`=%s AND `coin_name`=%s""" + sql_before + """ 
+        ORDER BY `tr_id` DESC LIMIT %s)
+        UNION
+        (SELECT * FROM `transfer_records` WHERE `to_api_id`=%s AND `coin_name`=%s""" + sql_before + """ 
+        ORDER BY `tr_id` DESC LIMIT %s)
+        ORDER BY `tr_id` DESC LIMIT %s
+        """
+        data_rows = [api_id, coin_name] + data_before + [limit, api_id, coin_name] + data_before + [limit, limit]
+    return sql, data_rows
+
+async def get_transfers_coin_api(
+    coin_name: str, api_id: int, address: str = None, ref_uuid: str = None, limit: int = 500, before: int = None
+):
+    global pool
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                sql, data_rows = transfers_coin_sql(coin_name, api_id, address, ref_uuid, limit, before)
+                await cur.execute(sql, tuple(data_rows))
+                result = await cur.fetchall()
+                if result:
+                    return result
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return []
+
+def withdraws_coin_sql(
+    coin_name: str, api_id: int, address: str = None, ref_uuid: str = None, limit: int = 500, before: int = None
+):
+    # newest first over (api_id, coin_name[, from_address], id)
+    sql_where = ""
+    data_rows = [api_id, coin_name]
+    if address is not None:
+        sql_where += " AND `from_address`=%s"
+        data_rows.append(address)
+    if ref_uuid is not None:
+        sql_where += " AND `ref_uuid`=%s"
+        data_rows.append(ref_uuid)
+    if before is not None:
+        sql_where += " AND `id`<%s"
+        data_rows.append(before)
+    sql = """
+    SELECT * FROM `withdraws` 
+    WHERE `api_id`=%s AND `coin_name`=%s""" + sql_where + """
+    ORDER BY `id` DESC LIMIT %s
+    """
+    return sql, data_rows + [limit]
+
+async def get_withdraws_coin_api(
+    coin_name: str, api_id: int, address: str = None, ref_uuid: str = None, limit: int = 500, before: int = None
+):
+    global pool
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                sql, data_rows = withdraws_coin_sql(coin_name, api_id, address, ref_uuid, limit, before)
+                await cur.execute(sql, tuple(data_rows))
+                result = await cur.fetchall()
+                if result:
+                    return result
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return []
+
+async def purge_api_events(before: int, limit: int = 10000):
+    global pool
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                sql = """
+                DELETE FROM `api_events` 
+                WHERE `created`<%s LIMIT %s
+                """
+                await cur.execute(sql, (before, limit))
+                await conn.commit()
+                return cur.rowcount
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return 0
+
+def deposit_event_data(deposit_id: int, coin_name: str, txid: str, address: str, amount: float, height: int, confirmations: int):
+    return {
+        "deposit_id": deposit_id,
+        "coin_name": coin_name,
+        "txid": txid,
+        "address": address,
+        "amount": amount,
+        "height": height,
+        "confirmations": confirmations
+    }
+
+def is_public_ip(ip: str) -> bool:
+    # private, loopback, link-local, reserved... are all not global; an IPv4-mapped IPv6 is judged by its IPv4
+    address = ipaddress.ip_address(ip.split("%")[0])
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    return address.is_global
+
+async def is_public_host(host: str, port: int) -> bool:
+    # every address the host resolves to must be public, webhooks must not reach our own network
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror:
+        return False
+    return len(infos) > 0 and all([is_public_ip(i[4][0]) for i in infos])
+
+async def is_public_webhook_url(url: str) -> bool:
+    try:
+        parts = urlsplit(url)
+        if parts.hostname is None:
+            return False
+        return await is_public_host(parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+    except ValueError:
+        return False
+
+class PublicResolver(aiohttp.abc.AbstractResolver):
+    # used for deliveries: a registered host may resolve elsewhere later, private addresses are dropped on every connect
+    def __init__(self):
+        self.resolver = aiohttp.DefaultResolver()
+
+    async def resolve(self, host: str, port: int = 0, family: int = socket.AF_INET):
+        hosts = [i for i in await self.resolver.resolve(host, port, family) if is_public_ip(i['host'])]
+        if len(hosts) == 0:
+            raise OSError("{} has no public address".format(host))
+        return hosts
+
+    async def close(self):
+        await self.resolver.close()
+
+async def insert_webhook(api_id: int, url: str, secret: str, events: List[str]):
+    global pool
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                sql = """
+                INSERT INTO `api_webhooks` (`api_id`, `url`, `secret`, `events`, `created`) 
+                VALUES (%s, %s, %s, %s, %s)
+                """
+                await cur.execute(sql, (api_id, url, secret, ",".join(events), int(time.time())))
+                await conn.commit()
+                return cur.lastrowid
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return None
+
+async def get_webhooks(api_id: int):
+    global pool
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                sql = """
+                SELECT * FROM `api_webhooks` 
+                WHERE `api_id`=%s AND `is_active`=1
+                ORDER BY `id` ASC
+                """
+                await cur.execute(sql, (api_id,))
+                result = await cur.fetchall()
+                if result:
+                    return result
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return []
+
+async def disable_webhook(webhook_id: int, api_id: int):
+    global pool
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                sql = """
+                UPDATE `api_webhooks` SET `is_active`=0 
+                WHERE `id`=%s AND `api_id`=%s AND `is_active`=1 LIMIT 1
+                """
+                await cur.execute(sql, (webhook_id, api_id))
+                if cur.rowcount == 0:
+                    return False
+                sql = """
+                UPDATE `webhook_outbox` SET `status`='FAILED', `last_error`=%s 
+                WHERE `webhook_id`=%s AND `status`='PENDING'
+                """
+                await cur.execute(sql, ("webhook removed", webhook_id))
+                await conn.commit()
+                return True
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return False
+
+async def get_due_webhooks(limit: int):
+    # webhooks with due events, the longest waiting first
+    global pool
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                sql = """
+                SELECT `webhook_id` FROM `webhook_outbox` 
+                WHERE `status`='PENDING' AND `next_attempt`<=%s 
+                GROUP BY `webhook_id` ORDER BY MIN(`next_attempt`) ASC LIMIT %s
+                """
+                await cur.execute(sql, (int(time.time()), limit))
+                result = await cur.fetchall()
+                if result:
+                    return [i['webhook_id'] for i in result]
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return []
+
+async def get_due_webhook_events(webhook_id: int, limit: int):
+    # per webhook, so one receiver's backlog never fills the batch of the others
+    global pool
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                sql = """
+                SELECT `webhook_outbox`.`id`, `webhook_outbox`.`webhook_id`, `webhook_outbox`.`payload`, 
+                `api_webhooks`.`url`, `api_webhooks`.`secret` FROM `webhook_outbox` 
+                INNER JOIN `api_webhooks` ON `api_webhooks`.`id`=`webhook_outbox`.`webhook_id` 
+                WHERE `webhook_outbox`.`webhook_id`=%s AND `webhook_outbox`.`status`='PENDING' AND `webhook_outbox`.`next_attempt`<=%s 
+                ORDER BY `webhook_outbox`.`next_attempt` ASC, `webhook_outbox`.`id` ASC LIMIT %s
+                """
+                await cur.execute(sql, (webhook_id, int(time.time()), limit))
+                result = await cur.fetchall()
+                if result:
+                    return result
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return []
+
+async def mark_webhook_events(ids: List[int], error: str = None, max_attempts: int = 10, backoff: int = 10, max_backoff: int = 3600):
+    # error None: delivered; otherwise retried after backoff * 2^attempts, FAILED after max_attempts
+    global pool
+    try:
+        await open_connection()
+        async with pool_acquire(pool) as conn:
+            async with conn.cursor() as cur:
+                in_ids = ", ".join(["%s"] * len(ids))
+                if error is None:
+                    sql = """
+                    UPDATE `webhook_outbox` SET `status`='SENT', `sent_time`=%s, `attempts`=`attempts`+1 
+                    WHERE `id` IN (""" + in_ids + """)
+                    """
+                    await cur.execute(sql, tuple([int(time.time())] + ids))
+                else:
+                    # columns are assigned left to right, attempts is still the old value before its own update
+                    sql = """
+                    UPDATE `webhook_outbox` SET `status`=IF(`attempts`+1>=%s, 'FAILED', 'PENDING'), 
+                    `next_attempt`=%s+LEAST(%s*POW(2, `attempts`), %s), `last_error`=%s, `attempts`=`attempts`+1 
+                    WHERE `id` IN (""" + in_ids + """)
+                    """
+                    await cur.execute(sql, tuple([max_attempts, int(time.time()), backoff, max_backoff, error[:512]] + ids))
+                await conn.commit()
+                return True
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return False
+# End of database
+
+async def xmr_make_integrate(
+    url: str, main_address: str, payment_id: str = None
+):
+    try:
+        headers = {
+            'Content-Type': 'application/json'
+        }
+        json_data = {
+            "jsonrpc": "2.0",
+            "id":"0",
+            "method":"make_integrated_address",
+            "params":{
+                "standard_address": main_address
+            }
+        }
+        if payment_id is not None:
+            json_data['params']['payment_id'] = payment_id
+        async with aiohttp.ClientSession() as session:
+            async with session.post(url, json=json_data, headers=headers, timeout=15) as response:
+                if response.status == 200:
+                    res_data = await response.read()
+                    return json.loads(res_data.decode('utf-8'))
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return None
+
+async def generate_coin_address(coin_name: str):
+    # new address from the coin wallet: {"address", "extra", "priv_key"}
+    try:
+        if coin_name in config['coinapi']['list_bcn_xmr'] and coin_name in runner.local_integrated:
+            # encoded in-process, checked against the wallet by check_local_integrated() at startup
+            make_addr = cryptonote.make_integrated_address(
+                runner.coin_list[coin_name]['main_address'], runner.local_integrated[coin_name]
+            )
+            return {
+                "address": make_addr['integrated_address'],
+                "extra": make_addr['payment_id'],
+                "priv_key": None
+            }
+        elif coin_name in config['coinapi']['list_bcn_xmr']:
+            make_addr = await xmr_make_integrate(
+                runner.coin_list[coin_name]['wallet_address'],
+                runner.coin_list[coin_name]['main_address']
+            )
+            if make_addr and 'result' in make_addr:
+                return {
+                    "address": make_addr['result']['integrated_address'],
+                    "extra": make_addr['result']['payment_id'],
+                    "priv_key": None
+                }
+        elif coin_name in config['coinapi']['list_btc']:
+            url = runner.coin_list[coin_name]['daemon_address']
+            address_call = await call_doge(url, 'getnewaddress', coin_name, payload='')
+            if address_call:
+                key_call = await call_doge(url, 'dumpprivkey', coin_name, payload=f'"{address_call}"')
+                if key_call:
+                    return {"address": address_call, "extra": None, "priv_key": key_call}
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return None
+
+async def check_local_integrated():
+    # enable local integrated address for a coin only if it matches what its wallet generates
+    runner.local_integrated = {}
+    for coin_name, prefix in config.get('integrated_address', {}).items():
+        try:
+            if coin_name not in config['coinapi']['list_bcn_xmr'] or runner.coin_list.get(coin_name) is None:
+                continue
+            local_addr = cryptonote.make_integrated_address(runner.coin_list[coin_name]['main_address'], prefix)
+            wallet_addr = await xmr_make_integrate(
+                runner.coin_list[coin_name]['wallet_address'],
+                runner.coin_list[coin_name]['main_address'],
+                local_addr['payment_id']
+            )
+            if wallet_addr and 'result' in wallet_addr and wallet_addr['result']['integrated_address'] == local_addr['integrated_address']:
+                runner.local_integrated[coin_name] = prefix
+                print_color(f"{coin_name}: local integrated address enabled", color="green")
+            else:
+                print_color(f"{coin_name}: local integrated address does not match wallet, using wallet-rpc", color="red")
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+
+def cache_address(address_row: Dict):
+    runner.addresses.add(address_row['address'])
+    runner.by_key["{}_{}".format(address_row['coin_name'], address_row['address'])] = address_row
+
+# deposit_addresses fields other processes need for ownership checks (no private key)
+ADDRESS_EVENT_FIELDS = ["id", "api_id", "coin_name", "address", "address_extra", "tag", "second_tag"]
+
+def publish_event(event_type: str, data: Dict):
+    # cache change event for the other processes, see BackgroundRunner.cache_events()
+    if config['coinapi'].get('cache_events', False) is not True:
+        return
+    try:
+        app.r.publish(
+            config['coinapi']['kv_prefix'] + "events",
+            dump_json({"type": event_type, "origin": runner.instance_id, "data": data})
+        )
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+
+# /events waiters per api_id, woken when an event of that api commits in this or (with cache_events) another process
+api_event_waiters = {}
+
+def wake_api_events(api_id: int, publish: bool = True):
+    for waiter in api_event_waiters.get(api_id, ()):
+        waiter.set()
+    if publish is True:
+        publish_event("api_event", {"api_id": api_id})
+
+@asynccontextmanager
+async def api_event_waiter(api_id: int):
+    waiter = asyncio.Event()
+    api_event_waiters.setdefault(api_id, set()).add(waiter)
+    try:
+        yield waiter
+    finally:
+        api_event_waiters[api_id].discard(waiter)
+        if len(api_event_waiters[api_id]) == 0:
+            api_event_waiters.pop(api_id, None)
+
+def notify_address(address_row: Dict):
+    cache_address(address_row)
+    publish_event("address_created", {i: address_row.get(i) for i in ADDRESS_EVENT_FIELDS})
+
+async def call_doge(url: str, method_name: str, coin: str, payload: str = None) -> Dict:
+    timeout = 150
+    coin_name = coin.upper()
+    if payload is None:
+        data = '{"jsonrpc": "1.0", "id":"' + str(
+            uuid.uuid4()) + '", "method": "' + method_name + '", "params": [] }'
+    else:
+        data = '{"jsonrpc": "1.0", "id":"' + str(
+            uuid.uuid4()) + '", "method": "' + method_name + '", "params": [' + payload + '] }'
+    start = time.perf_counter()
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(url, data=data, timeout=timeout) as response:
+                if response.status == 200:
+                    res_data = await response.read()
+                    res_data = res_data.decode('utf-8')
+                    decoded_data = json.loads(res_data)
+                    return decoded_data['result']
+                else:
+                    rpc_errors.inc(coin_name, method_name, "status_{}".format(response.status))
+                    print(f'Call {coin_name} returns {str(response.status)} with method {method_name}')
+                    print(data)
+    except (aiohttp.client_exceptions.ServerDisconnectedError, aiohttp.client_exceptions.ClientOSError):
+        rpc_errors.inc(coin_name, method_name, "disconnected")
+        print("call_doge: got disconnected for coin: {}".format(coin_name))
+    except asyncio.TimeoutError:
+        rpc_errors.inc(coin_name, method_name, "timeout")
+        print('TIMEOUT: method_name: {} - COIN: {} - timeout {}'.format(method_name, coin.upper(), timeout))
+    except Exception:
+        rpc_errors.inc(coin_name, method_name, "error")
+        traceback.print_exc(file=sys.stdout)
+    finally:
+        rpc_latency.observe(coin_name, method_name, value=time.perf_counter() - start)
+        tracing.add_span("rpc", start, coin=coin_name, method=method_name)
+
+async def send_external_doge(
+    url: str, coment_from: str, amount: float, to_address: str, coin: str, has_pos: int = 0
+):
+    coin_name = coin.upper()
+    try:
+        comment_to = to_address
+        payload = f'"{to_address}", {amount}, "{coment_from}", "{comment_to}", false'
+        if has_pos == 1:
+            payload = f'"{to_address}", {amount}, "{coment_from}", "{comment_to}"'
         tx_hash = await call_doge(url, 'sendtoaddress', coin_name, payload=payload)
         if tx_hash:
             return tx_hash
@@ -463,11 +1777,40 @@ async def send_external_doge(
         traceback.print_exc(file=sys.stdout)
     return None
 
+async def send_external_doge_many(
+    url: str, comment: str, destinations: List, coin: str
+):
+    # destinations: list of (to_address, amount), sent with one sendmany
+    coin_name = coin.upper()
+    try:
+        amounts = {}
+        for (to_address, amount) in destinations:
+            # sendmany takes each address once; summed as Decimal so 0.1 + 0.2 is sent as 0.3, not 0.30000000000000004
+            amounts[to_address] = amounts.get(to_address, Decimal(0)) + Decimal(str(amount))
+        payload = f'"", {json.dumps({k: float(v) for k, v in amounts.items()})}, 1, "{comment}"'
+        tx_hash = await call_doge(url, 'sendmany', coin_name, payload=payload)
+        if tx_hash:
+            return tx_hash
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    return None
+
 async def send_external_xmr(
     runner_app, type_coin: str, from_address: str, amount: float, to_address: str,
     coin: str, coin_decimal: int, tx_fee: float, is_fee_per_byte: int,
     get_mixin: int, wallet_api_url: str, wallet_api_header: str
 ):
+    return await send_external_xmr_many(
+        runner_app, type_coin, from_address, [(to_address, amount)], coin, coin_decimal, tx_fee,
+        is_fee_per_byte, get_mixin, wallet_api_url, wallet_api_header
+    )
+
+async def send_external_xmr_many(
+    runner_app, type_coin: str, from_address: str, destinations: List,
+    coin: str, coin_decimal: int, tx_fee: float, is_fee_per_byte: int,
+    get_mixin: int, wallet_api_url: str, wallet_api_header: str
+):
+    # destinations: list of (to_address, amount), sent in one transaction
     coin_name = coin.upper()
     time_out = 150
     if coin_name == "DEGO":
@@ -476,7 +1819,7 @@ async def send_external_xmr(
         if type_coin == "XMR":
             acc_index = 0
             payload = {
-                "destinations": [{'amount': int(amount * 10 ** coin_decimal), 'address': to_address}],
+                "destinations": [{'amount': int(i[1] * 10 ** coin_decimal), 'address': i[0]} for i in destinations],
                 "account_index": acc_index,
                 "subaddr_indices": [],
                 "priority": 1,
@@ -487,7 +1830,7 @@ async def send_external_xmr(
             }
             if coin_name == "UPX":
                 payload = {
-                    "destinations": [{'amount': int(amount * 10 ** coin_decimal), 'address': to_address}],
+                    "destinations": [{'amount': int(i[1] * 10 ** coin_decimal), 'address': i[0]} for i in destinations],
                     "account_index": acc_index,
                     "subaddr_indices": [],
                     "ring_size": 11,
@@ -506,9 +1849,9 @@ async def send_external_xmr(
                 payload = {
                     'addresses': [from_address],
                     'transfers': [{
-                        "amount": int(amount * 10 ** coin_decimal),
-                        "address": to_address
-                    }],
+                        "amount": int(i[1] * 10 ** coin_decimal),
+                        "address": i[0]
+                    } for i in destinations],
                     'fee': int(tx_fee * 10 ** coin_decimal),
                     'anonymity': get_mixin
                 }
@@ -516,9 +1859,9 @@ async def send_external_xmr(
                 payload = {
                     'addresses': [from_address],
                     'transfers': [{
-                        "amount": int(amount * 10 ** coin_decimal),
-                        "address": to_address
-                    }],
+                        "amount": int(i[1] * 10 ** coin_decimal),
+                        "address": i[0]
+                    } for i in destinations],
                     'anonymity': get_mixin
                 }
 
@@ -531,7 +1874,7 @@ async def send_external_xmr(
         elif type_coin == "TRTL-API":
             if is_fee_per_byte != 1:
                 json_data = {
-                    "destinations": [{"address": to_address, "amount": int(amount * 10 ** coin_decimal)}],
+                    "destinations": [{"address": i[0], "amount": int(i[1] * 10 ** coin_decimal)} for i in destinations],
                     "mixin": get_mixin,
                     "fee": int(tx_fee * 10 ** coin_decimal),
                     "sourceAddresses": [
@@ -542,7 +1885,7 @@ async def send_external_xmr(
                 }
             else:
                 json_data = {
-                    "destinations": [{"address": to_address, "amount": int(amount * 10 ** coin_decimal)}],
+                    "destinations": [{"address": i[0], "amount": int(i[1] * 10 ** coin_decimal)} for i in destinations],
                     "mixin": get_mixin,
                     "sourceAddresses": [
                         from_address
@@ -572,6 +1915,70 @@ async def send_external_xmr(
         traceback.print_exc(file=sys.stdout)
     return None
 
+@tracing.traced("wallet send")
+async def send_withdraw(
+    coin_name: str, from_address: str, amount: float, to_address: str
+):
+    # returns {"hash", "key"} or None
+    coin_setting = runner.coin_list[coin_name]
+    if coin_name in config['coinapi']['list_bcn_xmr']:
+        return await send_external_xmr(
+            runner, coin_setting['type'], coin_setting['main_address'], amount, to_address, coin_name,
+            coin_setting['decimal'], coin_setting['fee_withdraw'], coin_setting['is_fee_per_byte'], coin_setting['mixin'],
+            coin_setting['wallet_address'], coin_setting['header']
+        )
+    elif coin_name in config['coinapi']['list_btc']:
+        tx_hash = await send_external_doge(
+            coin_setting['daemon_address'], from_address, amount, to_address, coin_name, coin_setting['has_pos']
+        )
+        if tx_hash:
+            return {"hash": tx_hash, "key": None}
+    return None
+
+@tracing.traced("wallet send")
+async def send_withdraw_many(
+    coin_name: str, destinations: List, comment: str
+):
+    # destinations: list of (to_address, amount); returns {"hash", "key"} or None
+    coin_setting = runner.coin_list[coin_name]
+    if coin_name in config['coinapi']['list_bcn_xmr']:
+        return await send_external_xmr_many(
+            runner, coin_setting['type'], coin_setting['main_address'], destinations, coin_name,
+            coin_setting['decimal'], coin_setting['fee_withdraw'], coin_setting['is_fee_per_byte'], coin_setting['mixin'],
+            coin_setting['wallet_address'], coin_setting['header']
+        )
+    elif coin_name in config['coinapi']['list_btc']:
+        tx_hash = await send_external_doge_many(
+            coin_setting['daemon_address'], comment, destinations, coin_name
+        )
+        if tx_hash:
+            return {"hash": tx_hash, "key": None}
+    return None
+
+def userwallet_by_extra_sql(paymentid: str, coin_name: str, coin_family: str):
+    # (None, None) for a family without deposit lookups
+    if coin_family in ["TRTL-API", "TRTL-SERVICE", "BCN", "XMR"]:
+        sql = """
+        SELECT * FROM `deposit_addresses` 
+        WHERE `address_extra`=%s AND `coin_name`=%s LIMIT 1;
+        """
+        return sql, [paymentid, coin_name]
+    elif coin_family in ["BTC", "NANO"]:
+        # if doge family, address is paymentid
+        sql = """
+        SELECT * FROM `deposit_addresses` 
+        WHERE `coin_name`=%s AND `address_hash`=UNHEX(MD5(%s)) AND `address`=%s LIMIT 1;
+        """
+        return sql, [coin_name, paymentid, paymentid]
+    return None, None
+
+def pending_deposits_sql():
+    sql = """
+    SELECT * FROM `deposits` 
+    WHERE `can_credit`=%s
+    """
+    return sql, ["NO"]
+
 def print_color(prt, color: str):
     if color == "red":
         print(f"\033[91m{prt}\033[00m")
@@ -594,11 +2001,35 @@ def print_color(prt, color: str):
 
 
 # start of background
+# renew or drop the leader lease only while this process still owns it
+RENEW_LEASE_LUA = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_LEASE_LUA = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
 class BackgroundRunner:
     def __init__(self, app_main):
         self.app_main = app_main
         self.pool = pool
         self.config = config
+        self.coin_list = {}
+        self.addresses = set()
+        self.by_key = {}
+        self.local_integrated = {}
+        # without leader_election every process runs the scanners, as a single worker does
+        self.is_leader = config['coinapi'].get('leader_election', False) is not True
+        self.leader_key = None
+        self.instance_id = "{}_{}_{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        # coins scanned by this process, None for all (see run_scanner)
+        self.scan_coins = None
 
     async def open_connection(self):
         try:
@@ -606,7 +2037,7 @@ class BackgroundRunner:
                 self.pool = await aiomysql.create_pool(
                     host=config['mysql']['host'], port=3306, minsize=4, maxsize=8,
                     user=config['mysql']['user'], password=config['mysql']['password'],
-                    db=config['mysql']['db'], cursorclass=DictCursor, autocommit=True
+                    db=config['mysql']['db'], cursorclass=InstrumentedDictCursor, autocommit=True
                 )
         except:
             print("ERROR: Unexpected error: Could not connect to MySql instance.")
@@ -616,23 +2047,12 @@ class BackgroundRunner:
         coin_name = coin.upper()
         try:
             await self.open_connection()
-            async with self.pool.acquire() as conn:
+            async with pool_acquire(self.pool, "runner") as conn:
                 async with conn.cursor() as cur:
                     result = None
-                    if coin_family in ["TRTL-API", "TRTL-SERVICE", "BCN", "XMR"]:
-                        sql = """
-                        SELECT * FROM `deposit_addresses` 
-                        WHERE `address_extra`=%s AND `coin_name`=%s LIMIT 1;
-                        """
-                        await cur.execute(sql, (paymentid, coin_name))
-                        result = await cur.fetchone()
-                    elif coin_family in ["BTC", "NANO"]:
-                        # if doge family, address is paymentid
-                        sql = """
-                        SELECT * FROM `deposit_addresses` 
-                        WHERE `address`=%s AND `coin_name`=%s LIMIT 1;
-                        """
-                        await cur.execute(sql, (paymentid, coin_name))
+                    sql, data_rows = userwallet_by_extra_sql(paymentid, coin_name, coin_family)
+                    if sql is not None:
+                        await cur.execute(sql, tuple(data_rows))
                         result = await cur.fetchone()
                     return result
         except Exception as e:
@@ -764,6 +2184,7 @@ class BackgroundRunner:
             timeout = 180
         elif method_name == "createAddress" or method_name == "getSpendKeys":
             timeout = 60
+        start = time.perf_counter()
         try:
             if coin_type == "XMR":
                 try:
@@ -783,11 +2204,15 @@ class BackgroundRunner:
                                 if 'result' in decoded_data:
                                     return decoded_data['result']
                                 else:
+                                    rpc_errors.inc(coin_name, method_name, "no_result")
                                     return None
+                            rpc_errors.inc(coin_name, method_name, "status_{}".format(response.status))
                 except asyncio.TimeoutError:
+                    rpc_errors.inc(coin_name, method_name, "timeout")
                     print('TIMEOUT: {} coin_name {} - timeout {}'.format(method_name, coin_name, timeout))
                     return None
                 except Exception:
+                    rpc_errors.inc(coin_name, method_name, "error")
                     traceback.print_exc(file=sys.stdout)
                     return None
             elif coin_type in ["TRTL-SERVICE", "BCN"]:
@@ -801,24 +2226,37 @@ class BackgroundRunner:
                                 decoded_data = json.loads(res_data)
                                 if 'result' in decoded_data:
                                     return decoded_data['result']
+                                rpc_errors.inc(coin_name, method_name, "no_result")
+                            else:
+                                rpc_errors.inc(coin_name, method_name, "status_{}".format(response.status))
                             return None
                 except asyncio.TimeoutError:
+                    rpc_errors.inc(coin_name, method_name, "timeout")
                     print('TIMEOUT: {} coin_name {} - timeout {}'.format(method_name, coin_name, timeout))
                     return None
                 except Exception:
+                    rpc_errors.inc(coin_name, method_name, "error")
                     traceback.print_exc(file=sys.stdout)
                     return None
         except asyncio.TimeoutError:
             print('TIMEOUT: method_name: {} - coin_family: {} - timeout {}'.format(method_name, coin_type, timeout))
         except Exception:
             traceback.print_exc(file=sys.stdout)
+        finally:
+            rpc_latency.observe(coin_name, method_name, value=time.perf_counter() - start)
+            tracing.add_span("rpc", start, coin=coin_name, method=method_name)
 
     async def update_balance_xmr(self, timer: float=10.0):
         while True:
+            if self.is_leader is False:
+                await asyncio.sleep(timer)
+                continue
             try:
                 if len(config['coinapi']['list_bcn_xmr']) > 0:
                     tasks = []
                     for coin_name in config['coinapi']['list_bcn_xmr']:
+                        if self.scan_coins is not None and coin_name not in self.scan_coins:
+                            continue
                         if runner.coin_list.get(coin_name) is not None:
                             tasks.append(self.update_balance_tasks_xmr(coin_name, False))
                     completed = 0
@@ -832,6 +2270,7 @@ class BackgroundRunner:
 
     # To use with update_balance_xmr()
     async def update_balance_tasks_xmr(self, coin_name: str, debug: bool):
+        round_start = time.perf_counter()
         if debug is True:
             print_color(f"{datetime.now():%Y-%m-%d %H:%M:%S} Check balance {coin_name}", color="yellow")
         gettopblock = await self.gettopblock(self.coin_list[coin_name]['daemon_address'], self.coin_list[coin_name]['type'], coin_name, time_out=60)
@@ -872,7 +2311,7 @@ class BackgroundRunner:
         if get_transfers and len(get_transfers) >= 1 and 'in' in get_transfers:
             try:
                 await self.open_connection()
-                async with self.pool.acquire() as conn:
+                async with pool_acquire(self.pool, "runner") as conn:
                     async with conn.cursor() as cur:
                         sql = """ SELECT * FROM `deposits` WHERE `coin_name`=%s """
                         await cur.execute(sql, (coin_name,))
@@ -898,19 +2337,30 @@ class BackgroundRunner:
                                         app_id = None
                                         if user_paymentId:
                                             app_id = user_paymentId['api_id']
-                                        if app_id is None:
-                                            # Skipped for None
+                                        if app_id is None or app_id == 0:
+                                            # Skipped for None or unassigned pool address
                                             continue
                                         sql = """
                                         INSERT IGNORE INTO `deposits` 
                                         (`coin_name`, `api_id`, `depost_id`, `txid`, `blockhash`, `address`, `extra`, `height`, `amount`, `confirmations`, `time_insert`) 
                                         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                                         """
-                                        await cur.execute(sql, (
-                                            coin_name, app_id, user_paymentId['id'], tx['txid'], None, user_paymentId['address'], tx['payment_id'], tx['height'],
-                                            float(tx['amount'] / 10 ** coin_decimal), height - tx['height'], int(time.time())
-                                        ))
-                                        await conn.commit()
+                                        await conn.begin()
+                                        try:
+                                            await cur.execute(sql, (
+                                                coin_name, app_id, user_paymentId['id'], tx['txid'], None, user_paymentId['address'], tx['payment_id'], tx['height'],
+                                                float(tx['amount'] / 10 ** coin_decimal), height - tx['height'], int(time.time())
+                                            ))
+                                            if cur.rowcount == 1:
+                                                await record_api_event(cur, app_id, "deposit_pending", deposit_event_data(
+                                                    cur.lastrowid, coin_name, tx['txid'], user_paymentId['address'],
+                                                    float(tx['amount'] / 10 ** coin_decimal), tx['height'], height - tx['height']
+                                                ))
+                                            await conn.commit()
+                                            wake_api_events(app_id)
+                                        except Exception:
+                                            await conn.rollback()
+                                            raise
                                         try:
                                             await log_to_discord(
                                                 "API: {} / ⏳ PENDING DEPOSIT {} {} to {}. Height: {}".format(app_id, float(tx['amount'] / 10 ** coin_decimal), coin_name, user_paymentId['address'], tx['height']),
@@ -922,16 +2372,22 @@ class BackgroundRunner:
                                     traceback.print_exc(file=sys.stdout)
             except Exception:
                 traceback.print_exc(file=sys.stdout)
+        record_scan_round("xmr", coin_name, round_start, height)
         if debug is True:
             print_color(f"{datetime.now():%Y-%m-%d %H:%M:%S} End check balance {coin_name}", color="green")
         return True
 
     async def update_balance_btc(self, timer: float=10.0):
         while True:
+            if self.is_leader is False:
+                await asyncio.sleep(timer)
+                continue
             if len(config['coinapi']['list_btc']) > 0:
                 try:
                     tasks = []
                     for coin_name in config['coinapi']['list_btc']:
+                        if self.scan_coins is not None and coin_name not in self.scan_coins:
+                            continue
                         tasks.append(self.update_balance_tasks_btc(coin_name, False))
                     completed = 0
                     for task in asyncio.as_completed(tasks):
@@ -944,6 +2400,7 @@ class BackgroundRunner:
 
     # to use with update_balance_btc()
     async def update_balance_tasks_btc(self, coin_name: str, debug: bool):
+        round_start = time.perf_counter()
         if debug is True:
             print_color(f"{datetime.now():%Y-%m-%d %H:%M:%S} Check balance {coin_name}", color="yellow")
         url = self.coin_list[coin_name]['daemon_address']
@@ -977,7 +2434,7 @@ class BackgroundRunner:
         if get_transfers and len(get_transfers) >= 1:
             try:
                 await self.open_connection()
-                async with self.pool.acquire() as conn:
+                async with pool_acquire(self.pool, "runner") as conn:
                     async with conn.cursor() as cur:
                         sql = """
                         SELECT * FROM `deposits` 
@@ -1008,8 +2465,8 @@ class BackgroundRunner:
                                         app_id = None
                                         if user_paymentId:
                                             app_id = user_paymentId['api_id']
-                                        if app_id is None:
-                                            # Skipped for None
+                                        if app_id is None or app_id == 0:
+                                            # Skipped for None or unassigned pool address
                                             continue
                                         if tx['category'] == 'receive':
                                             sql = """
@@ -1017,11 +2474,22 @@ class BackgroundRunner:
                                             (`coin_name`, `api_id`, `depost_id`, `txid`, `blockhash`, `address`, `amount`, `confirmations`, `time_insert`) 
                                             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
                                             """
-                                            await cur.execute(sql, (
-                                                coin_name, app_id, user_paymentId['id'], tx['txid'], tx['blockhash'], tx['address'],
-                                                float(tx['amount']), tx['confirmations'], int(time.time())
-                                            ))
-                                            await conn.commit()
+                                            await conn.begin()
+                                            try:
+                                                await cur.execute(sql, (
+                                                    coin_name, app_id, user_paymentId['id'], tx['txid'], tx['blockhash'], tx['address'],
+                                                    float(tx['amount']), tx['confirmations'], int(time.time())
+                                                ))
+                                                if cur.rowcount == 1:
+                                                    await record_api_event(cur, app_id, "deposit_pending", deposit_event_data(
+                                                        cur.lastrowid, coin_name, tx['txid'], tx['address'],
+                                                        float(tx['amount']), tx.get('blockheight'), tx['confirmations']
+                                                    ))
+                                                await conn.commit()
+                                                wake_api_events(app_id)
+                                            except Exception:
+                                                await conn.rollback()
+                                                raise
                                             try:
                                                 await log_to_discord(
                                                     "API: {} / ⏳ PENDING DEPOSIT {} {} to {}. Tx: {}".format(app_id, float(tx['amount']), coin_name, tx['address'], tx['txid']),
@@ -1033,52 +2501,398 @@ class BackgroundRunner:
                                     traceback.print_exc(file=sys.stdout)
             except Exception:
                 traceback.print_exc(file=sys.stdout)
+        record_scan_round("btc", coin_name, round_start, height)
         if debug is True:
             print_color(f"{datetime.now():%Y-%m-%d %H:%M:%S} End check balance {coin_name}", color="green")
 
     async def unlock_deposit(self, timer: float=10.0):
         while True:
-            try:
-                await self.open_connection()
-                async with self.pool.acquire() as conn:
-                    async with conn.cursor() as cur:
-                        sql = """
-                        SELECT * FROM `deposits` 
-                        WHERE `can_credit`=%s
-                        """
-                        await cur.execute(sql, ("NO"))
-                        result = await cur.fetchall()
-                        if result:
-                            for ea in result:
-                                try:
-                                    coin_name = ea['coin_name']
-                                    get_confirm_depth = self.coin_list[coin_name]['confirmation_depth']
-                                    height = get_cache_kv(
-                                        self.app_main,
-                                        "block",
-                                        self.config['coinapi']['kv_prefix'] + coin_name,
-                                    )
-                                    if ea['confirmations'] >= get_confirm_depth or (ea['height'] is not None and height - ea['height'] >= get_confirm_depth):
-                                        sql_update = """
-                                        UPDATE `deposits`
-                                        SET `can_credit`=%s
-                                        WHERE `id`=%s
-                                        """
+            if self.is_leader is False:
+                await asyncio.sleep(timer)
+                continue
+            await self.unlock_deposit_round()
+            await asyncio.sleep(timer)
+
+    async def unlock_deposit_round(self):
+        # one pass of unlock_deposit(), also driven directly by tools/chain_sim.py
+        try:
+            await self.open_connection()
+            async with pool_acquire(self.pool, "runner") as conn:
+                async with conn.cursor() as cur:
+                    sql, data_rows = pending_deposits_sql()
+                    await cur.execute(sql, tuple(data_rows))
+                    result = await cur.fetchall()
+                    pending = {i: 0 for i in self.coin_list}
+                    for ea in result or []:
+                        pending[ea['coin_name']] = pending.get(ea['coin_name'], 0) + 1
+                    for coin_name, count in pending.items():
+                        pending_unlock.set(coin_name, value=count)
+                    if result:
+                        for ea in result:
+                            try:
+                                coin_name = ea['coin_name']
+                                get_confirm_depth = self.coin_list[coin_name]['confirmation_depth']
+                                height = get_cache_kv(
+                                    self.app_main,
+                                    "block",
+                                    self.config['coinapi']['kv_prefix'] + coin_name,
+                                )
+                                if ea['confirmations'] >= get_confirm_depth or (ea['height'] is not None and height - ea['height'] >= get_confirm_depth):
+                                    sql_update = """
+                                    UPDATE `deposits`
+                                    SET `can_credit`=%s
+                                    WHERE `id`=%s
+                                    """
+                                    await conn.begin()
+                                    try:
                                         await cur.execute(sql_update, ("YES", ea['id']))
+                                        await record_api_event(cur, ea['api_id'], "deposit_credited", deposit_event_data(
+                                            ea['id'], coin_name, ea['txid'], ea['address'], ea['amount'], ea['height'], ea['confirmations']
+                                        ))
                                         await conn.commit()
-                                        try:
-                                            await log_to_discord(
-                                                "API: {} / ✅ UNLOCKED {} {} to {}. Tx: {}".format(ea['api_id'], ea['amount'], ea['coin_name'], ea['address'], ea['txid']),
-                                                config['log']['discord_webhook_default']
-                                            )
-                                        except Exception:
-                                            traceback.print_exc(file=sys.stdout) 
-                                except Exception:
-                                    traceback.print_exc(file=sys.stdout)
+                                        wake_api_events(ea['api_id'])
+                                    except Exception:
+                                        await conn.rollback()
+                                        raise
+                                    try:
+                                        await log_to_discord(
+                                            "API: {} / ✅ UNLOCKED {} {} to {}. Tx: {}".format(ea['api_id'], ea['amount'], ea['coin_name'], ea['address'], ea['txid']),
+                                            config['log']['discord_webhook_default']
+                                        )
+                                    except Exception:
+                                        traceback.print_exc(file=sys.stdout) 
+                            except Exception:
+                                traceback.print_exc(file=sys.stdout)
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+
+
+    def queue_withdraw_job(self, job_id: str, coin_name: str):
+        # coins with a batching window are left PENDING for send_withdraw_batches()
+        if self.coin_list.get(coin_name) is not None and self.coin_list[coin_name].get('withdraw_batch_window', 0) > 0:
+            return
+        self.withdraw_queue.put_nowait(job_id)
+
+    async def send_withdraw_batches(self, timer: float=1.0):
+        last_batch = {}
+        while True:
+            if self.is_leader is False:
+                await asyncio.sleep(timer)
+                continue
+            try:
+                for coin_name, coin_setting in self.coin_list.items():
+                    window = coin_setting.get('withdraw_batch_window', 0)
+                    if window <= 0 or int(time.time()) - last_batch.get(coin_name, 0) < window:
+                        continue
+                    last_batch[coin_name] = int(time.time())
+                    batch_id = str(uuid.uuid4())
+                    jobs = await claim_withdraw_batch(coin_name, batch_id, coin_setting.get('withdraw_batch_max', 16))
+                    if len(jobs) == 0:
+                        continue
+                    sending_tx = await send_withdraw_many(
+                        coin_name, [(i['to_address'], float(i['amount'])) for i in jobs], "batch {}".format(batch_id)
+                    )
+                    for job in jobs:
+                        if sending_tx is None:
+                            await release_withdraw(
+                                job['from_deposit_id'], job['amount'], job['fee_and_tax'], job['job_id'],
+                                "{}, failed to send batch {}.".format(coin_name, batch_id)
+                            )
+                        else:
+                            # every withdraw of the batch records the same txid
+                            completed = await complete_withdraw(
+                                job['api_id'], coin_name, job['from_address'], job['amount'], job['fee_and_tax'], job['from_deposit_id'],
+                                job['to_address'], sending_tx['hash'], sending_tx['key'], job['remark'], str(uuid.uuid4()), job['job_id']
+                            )
+                            if completed is False:
+                                print_color(f"{datetime.now():%Y-%m-%d %H:%M:%S} Job {job['job_id']} sent {sending_tx['hash']} but failed to record!", color="red")
+                    try:
+                        if sending_tx is None:
+                            await log_to_discord(
+                                "🔴 FAILED TO WITHDRAW BATCH {} of {} withdraw(s) {}.".format(batch_id, len(jobs), coin_name),
+                                config['log']['discord_webhook_default']
+                            )
+                        else:
+                            await log_to_discord(
+                                "✈️ WITHDRAW BATCH {} withdraw(s) {} {}. Tx: {}".format(len(jobs), float(sum([i['amount'] for i in jobs])), coin_name, sending_tx['hash']),
+                                config['log']['discord_webhook_default']
+                            )
+                    except Exception:
+                        traceback.print_exc(file=sys.stdout)
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
+            await asyncio.sleep(timer)
+
+    async def withdraw_worker(self):
+        while True:
+            job_id = await self.withdraw_queue.get()
+            try:
+                job = await claim_withdraw_job(job_id)
+                if job is None:
+                    # already taken by another worker or process
+                    continue
+                coin_name = job['coin_name']
+                # the amount the caller asked for (the DECIMAL column keeps it exact); the reservation is released
+                # with the stored values, which are exactly what reserve_withdraw() added
+                amount = float(job['amount'])
+                sending_tx = None
+                if self.coin_list.get(coin_name) is not None:
+                    sending_tx = await send_withdraw(coin_name, job['from_address'], amount, job['to_address'])
+                if sending_tx is None:
+                    await release_withdraw(
+                        job['from_deposit_id'], job['amount'], job['fee_and_tax'], job_id,
+                        "{}, failed to send {} {} to {}.".format(coin_name, amount, coin_name, job['to_address'])
+                    )
+                    try:
+                        await log_to_discord(
+                            "API: {} / 🔴 FAILED TO WITHDRAW {} {} to {}. Job: {}".format(job['api_id'], amount, coin_name, job['to_address'], job_id),
+                            config['log']['discord_webhook_default']
+                        )
+                    except Exception:
+                        traceback.print_exc(file=sys.stdout)
+                else:
+                    ref_uuid = str(uuid.uuid4())
+                    completed = await complete_withdraw(
+                        job['api_id'], coin_name, job['from_address'], job['amount'], job['fee_and_tax'], job['from_deposit_id'],
+                        job['to_address'], sending_tx['hash'], sending_tx['key'], job['remark'], ref_uuid, job_id
+                    )
+                    if completed is False:
+                        print_color(f"{datetime.now():%Y-%m-%d %H:%M:%S} Job {job_id} sent {sending_tx['hash']} but failed to record!", color="red")
+                    try:
+                        await log_to_discord(
+                            "API: {} / ✈️ WITHDRAW {} {} to {}. Tx: {}, Job: {}".format(job['api_id'], amount, coin_name, job['to_address'], sending_tx['hash'], job_id),
+                            config['log']['discord_webhook_default']
+                        )
+                    except Exception:
+                        traceback.print_exc(file=sys.stdout)
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
+
+    async def requeue_withdraw_jobs(self, timer: float=30.0):
+        # pick up jobs left PENDING by a restart or queued by another process
+        while True:
+            try:
+                for each in await get_withdraw_jobs_by_status("PENDING", int(timer)):
+                    self.queue_withdraw_job(each['job_id'], each['coin_name'])
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
+            await asyncio.sleep(timer)
+
+    async def refill_address_pool(self, timer: float=10.0):
+        # keep pre-created unassigned addresses (api_id=0) above low_water for each pooled coin
+        pool_config = self.config.get('address_pool', {})
+        while True:
+            if self.is_leader is False:
+                await asyncio.sleep(timer)
+                continue
+            for coin_name in pool_config.get('coins', []):
+                try:
+                    if self.coin_list.get(coin_name) is None or self.coin_list[coin_name]['enable_create'] != 1:
+                        continue
+                    numb = await count_pool_addresses(coin_name)
+                    if numb is None or numb >= pool_config.get('low_water', 20):
+                        continue
+                    added = 0
+                    for _ in range(pool_config.get('target', 100) - numb):
+                        make_addr = await generate_coin_address(coin_name)
+                        if make_addr is None:
+                            break
+                        inserting = await insert_address(
+                            0, coin_name, make_addr['address'], make_addr['extra'], make_addr['priv_key'], None
+                        )
+                        if inserting is None:
+                            break
+                        notify_address({
+                            "id": inserting, "api_id": 0, "coin_name": coin_name, "address": make_addr['address'],
+                            "address_extra": make_addr['extra'], "tag": None, "second_tag": None
+                        })
+                        added += 1
+                    print_color(f"{datetime.now():%Y-%m-%d %H:%M:%S} Address pool {coin_name}: added {added} to {numb}", color="cyan")
+                except Exception:
+                    traceback.print_exc(file=sys.stdout)
+            await asyncio.sleep(timer)
+
+    async def deliver_webhooks(self, timer: float=2.0):
+        # send due webhook_outbox rows, one signed POST per webhook with up to batch_size events
+        webhook_config = self.config.get('webhook', {})
+        batch_size = webhook_config.get('batch_size', 50)
+
+        async def deliver(session, webhook_id: int):
+            events = await get_due_webhook_events(webhook_id, batch_size)
+            if len(events) > 0:
+                await self.post_webhook(session, events, webhook_config)
+
+        while True:
+            if self.is_leader is False:
+                await asyncio.sleep(timer)
+                continue
+            try:
+                webhook_ids = await get_due_webhooks(webhook_config.get('webhooks_per_round', 100))
+                if len(webhook_ids) > 0:
+                    connector = None
+                    if webhook_config.get('allow_private', False) is not True:
+                        connector = aiohttp.TCPConnector(resolver=PublicResolver())
+                    async with aiohttp.ClientSession(connector=connector) as session:
+                        await asyncio.gather(*[deliver(session, i) for i in webhook_ids])
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
+            await asyncio.sleep(timer)
+
+    async def post_webhook(self, session, events: List[Dict], webhook_config: Dict):
+        # receivers check hex HMAC-SHA256 of "<timestamp>.<body>" with their secret
+        body = dump_json({"events": [dict(orjson.loads(i['payload']), id=i['id']) for i in events]})
+        timestamp = str(int(time.time()))
+        signature = hmac.new(events[0]['secret'].encode(), (timestamp + "." + body).encode(), sha256).hexdigest()
+        error = None
+        try:
+            async with session.post(
+                events[0]['url'], data=body, timeout=webhook_config.get('timeout', 10),
+                headers={
+                    "Content-Type": "application/json",
+                    "X-CoinAPI-Timestamp": timestamp,
+                    "X-CoinAPI-Signature": "sha256=" + signature
+                }
+            ) as response:
+                if response.status < 200 or response.status >= 300:
+                    error = "HTTP {}".format(response.status)
+        except Exception as e:
+            error = "{}: {}".format(type(e).__name__, e)
+        await mark_webhook_events(
+            [i['id'] for i in events], error, webhook_config.get('max_attempts', 10),
+            webhook_config.get('backoff', 10), webhook_config.get('max_backoff', 3600)
+        )
+
+    async def purge_api_events(self, timer: float=3600.0):
+        # /events can only resume within [events] keep_days
+        keep_days = self.config.get('events', {}).get('keep_days', 7)
+        while True:
+            if self.is_leader is True:
+                try:
+                    before = int(time.time()) - keep_days * 86400
+                    while await purge_api_events(before) > 0:
+                        await asyncio.sleep(0.5)
+                except Exception:
+                    traceback.print_exc(file=sys.stdout)
+            await asyncio.sleep(timer)
+
+    async def discord_log_worker(self):
+        # drains log_queue; a slow or failing Discord only grows coinapi_log_queue_depth
+        while True:
+            (url, content) = await log_queue.get()
+            try:
+                webhook = AsyncDiscordWebhook(
+                    url=url,
+                    content=content,
+                )
+                await webhook.execute()
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
+
+    async def export_traces(self, batch_size: int=100):
+        # slow request traces to [tracing] otlp_endpoint (OTLP/HTTP JSON) or else appended to [tracing] path as JSONL
+        while True:
+            traces = [await trace_queue.get()]
+            while len(traces) < batch_size and not trace_queue.empty():
+                traces.append(trace_queue.get_nowait())
+            try:
+                otlp_endpoint = tracing_config.get('otlp_endpoint', "")
+                if otlp_endpoint:
+                    body = dump_json(tracing.to_otlp(traces, tracing_config.get('service_name', "coinapi")))
+                    async with aiohttp.ClientSession() as session:
+                        async with session.post(
+                            otlp_endpoint, data=body, headers={"Content-Type": "application/json"}, timeout=10
+                        ) as response:
+                            if response.status >= 300:
+                                print("export_traces: {} returns {}".format(otlp_endpoint, response.status))
+                else:
+                    lines = "".join([dump_json(i.to_dict()) + "\n" for i in traces])
+                    await run_in_threadpool(append_file, tracing_config.get('path', "slow_requests.jsonl"), lines)
             except Exception:
                 traceback.print_exc(file=sys.stdout)
-            await asyncio.sleep(timer)
 
+    async def leader_election(self, lease: float=15.0, role: str="leader"):
+        # one process holds a redis lease and runs scanners, unlocker, address pool and batches;
+        # the others serve HTTP only and take over once the lease expires
+        self.leader_key = self.config['coinapi']['kv_prefix'] + role
+        key = self.leader_key
+        lease_ms = int(lease * 1000)
+        renew = self.app_main.r.register_script(RENEW_LEASE_LUA)
+        while True:
+            try:
+                # the redis client blocks, keep its round trips off the event loop
+                if self.is_leader is True:
+                    if await run_in_threadpool(renew, keys=[key], args=[self.instance_id, lease_ms]) != 1:
+                        self.is_leader = False
+                        print_color(f"{datetime.now():%Y-%m-%d %H:%M:%S} {self.instance_id} lost leadership", color="red")
+                elif await run_in_threadpool(self.app_main.r.set, key, self.instance_id, nx=True, px=lease_ms):
+                    self.is_leader = True
+                    print_color(f"{datetime.now():%Y-%m-%d %H:%M:%S} {self.instance_id} is leader", color="green")
+            except Exception:
+                # redis unreachable: step down, the lease runs out on its own
+                if self.is_leader is True:
+                    self.is_leader = False
+                    print_color(f"{datetime.now():%Y-%m-%d %H:%M:%S} {self.instance_id} stepped down", color="red")
+                traceback.print_exc(file=sys.stdout)
+            await asyncio.sleep(lease / 3)
+
+    def release_leadership(self):
+        if self.leader_key is None or self.is_leader is False:
+            return
+        self.is_leader = False
+        try:
+            self.app_main.r.register_script(RELEASE_LEASE_LUA)(
+                keys=[self.leader_key], args=[self.instance_id]
+            )
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+
+    async def cache_events(self):
+        # apply changes published by other processes to this process' caches
+        channel = self.config['coinapi']['kv_prefix'] + "events"
+        resync = False
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.app_main.r.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(channel)
+                if resync is True:
+                    # events published while disconnected are lost, reload from the DB
+                    collect_address = await get_coin_deposits()
+                    if collect_address:
+                        self.addresses = collect_address['addresses']
+                        self.by_key = collect_address['by_key']
+                    self.coin_list = await get_coin_setting()
+                    api_key_cache.clear()
+                resync = True
+                while True:
+                    message = await run_in_threadpool(pubsub.get_message, timeout=1.0)
+                    if message is None or message['type'] != "message":
+                        continue
+                    event = orjson.loads(message['data'])
+                    if event['origin'] == self.instance_id:
+                        continue
+                    await self.apply_event(event['type'], event['data'])
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+            await asyncio.sleep(5.0)
+
+    async def apply_event(self, event_type: str, data: Dict):
+        if event_type == "address_created":
+            cache_address(data)
+        elif event_type == "settings_changed":
+            self.coin_list = await get_coin_setting()
+            api_ttlcache.clear()
+        elif event_type == "api_event":
+            wake_api_events(data['api_id'], publish=False)
+        elif event_type == "key_changed":
+            for key in [k for k, v in api_key_cache.items() if v['id'] == data['api_id']]:
+                api_key_cache.pop(key, None)
 
     async def bg_reload_coin_settings(self, timer: float=15.0):
         while True:
@@ -1127,10 +2941,82 @@ async def app_startup():
         runner.addresses = collect_address['addresses']
         runner.by_key = collect_address['by_key']
         print("Loading {} address(es).".format(len(runner.addresses)))
-    asyncio.create_task(runner.update_balance_btc(timer=10.0))
-    asyncio.create_task(runner.update_balance_xmr(timer=10.0))
-    asyncio.create_task(runner.unlock_deposit(timer=10.0))
+    await check_local_integrated()
+    asyncio.create_task(runner.discord_log_worker())
+    if tracing_config.get('enable', False) is True:
+        asyncio.create_task(runner.export_traces())
+    if config['coinapi'].get('leader_election', False) is True:
+        asyncio.create_task(runner.leader_election(lease=config['coinapi'].get('leader_lease', 15.0)))
+    if config['coinapi'].get('cache_events', False) is True:
+        asyncio.create_task(runner.cache_events())
+    if config['coinapi'].get('scanner_processes', False) is not True:
+        # otherwise scanner.py runs them in their own processes
+        asyncio.create_task(runner.update_balance_btc(timer=10.0))
+        asyncio.create_task(runner.update_balance_xmr(timer=10.0))
+        asyncio.create_task(runner.unlock_deposit(timer=10.0))
     asyncio.create_task(runner.bg_reload_coin_settings(timer=10.0))
+    asyncio.create_task(runner.refill_address_pool(timer=10.0))
+    runner.withdraw_queue = asyncio.Queue()
+    for each in await get_withdraw_jobs_by_status("PENDING"):
+        runner.queue_withdraw_job(each['job_id'], each['coin_name'])
+    sending_jobs = await get_withdraw_jobs_by_status("SENDING")
+    if len(sending_jobs) > 0:
+        # outcome unknown (stopped during wallet send), needs manual check
+        print_color("{} withdraw job(s) left in SENDING: {}".format(len(sending_jobs), ", ".join([i['job_id'] for i in sending_jobs])), color="red")
+    for _ in range(config['coinapi'].get('withdraw_workers', 2)):
+        asyncio.create_task(runner.withdraw_worker())
+    asyncio.create_task(runner.requeue_withdraw_jobs(timer=30.0))
+    asyncio.create_task(runner.send_withdraw_batches(timer=1.0))
+    if config.get('webhook', {}).get('enable', False) is True:
+        asyncio.create_task(runner.deliver_webhooks(timer=2.0))
+    asyncio.create_task(runner.purge_api_events(timer=3600.0))
+
+async def run_scanner(family: str, coins: List[str] = None, metrics_port: int = None):
+    # scanner.py process: deposit scan of one family (xmr, btc) or the unlocker, talks to the API only via DB and redis
+    runner.coin_list = await get_coin_setting()
+    runner.scan_coins = set(coins) if coins else None
+    tasks = [runner.bg_reload_coin_settings(timer=10.0), runner.discord_log_worker()]
+    if metrics_port is not None:
+        tasks.append(serve_metrics(metrics_port))
+    if config['coinapi'].get('leader_election', False) is True:
+        role = "leader_" + family + ("_" + "_".join(sorted(coins)) if coins else "")
+        tasks.append(runner.leader_election(lease=config['coinapi'].get('leader_lease', 15.0), role=role))
+    if family == "xmr":
+        tasks.append(runner.update_balance_xmr(timer=10.0))
+    elif family == "btc":
+        tasks.append(runner.update_balance_btc(timer=10.0))
+    elif family == "unlock":
+        tasks.append(runner.unlock_deposit(timer=10.0))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        await run_in_threadpool(runner.release_leadership)
+
+async def serve_metrics(port: int):
+    # plain HTTP /metrics for scanner.py processes, which have no FastAPI app of their own
+    async def handle(reader, writer):
+        try:
+            await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=10.0)
+            body = metrics_registry.render().encode()
+            writer.write(
+                "HTTP/1.1 200 OK\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(
+                    metrics.CONTENT_TYPE, len(body)
+                ).encode() + body
+            )
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, config.get('metrics', {}).get('listen', "127.0.0.1"), port)
+    async with server:
+        await server.serve_forever()
+
+@app.on_event('shutdown')
+async def app_shutdown():
+    # hand the lease over right away instead of waiting for it to expire
+    await run_in_threadpool(runner.release_leadership)
 # End of background
 
 @app.get("/status/{coin_name}")
@@ -1198,6 +3084,159 @@ async def status(
         "time": int(time.time())
     }
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(
+    request: Request
+):
+    metrics_config = config.get('metrics', {})
+    allow_ips = metrics_config.get('allow_ips', ["127.0.0.1"])
+    if metrics_config.get('enable', False) is not True or (
+        len(allow_ips) > 0 and (request.client is None or request.client.host not in allow_ips)
+    ):
+        return Response(status_code=404)
+    return Response(content=metrics_registry.render(), media_type=metrics.CONTENT_TYPE)
+
+profile_lock = asyncio.Lock()
+memory_tracker = profiling.MemoryTracker()
+
+def is_admin(request: Request):
+    admin_key = config.get('admin', {}).get('key', "")
+    return len(admin_key) > 0 and hmac.compare_digest(
+        request.headers.get('Authorization', "").encode(), admin_key.encode()
+    )
+
+@app.get("/admin/profile", include_in_schema=False)
+async def admin_profile(
+    request: Request, seconds: float=10.0, mode: str="sample", interval: float=0.01
+):
+    """
+    Profile the event loop of this process for some seconds (admin key only)
+
+    mode: sample, collapsed stacks sampled every interval seconds (flamegraph.pl, speedscope);
+    cprofile, a pstats file of every call (python -m pstats)
+    """
+    if not is_admin(request):
+        return {
+            "success": False,
+            "data": None,
+            "message": "Wrong admin key!",
+            "time": int(time.time())
+        }
+    if seconds <= 0 or seconds > config['admin'].get('max_profile_seconds', 60) or mode not in ["sample", "cprofile"]:
+        return {
+            "success": False,
+            "data": None,
+            "message": "Invalid seconds or mode!",
+            "time": int(time.time())
+        }
+    if profile_lock.locked():
+        return {
+            "success": False,
+            "data": None,
+            "message": "A profile is already running!",
+            "time": int(time.time())
+        }
+    async with profile_lock:
+        if mode == "sample":
+            stacks = await run_in_threadpool(
+                profiling.sample_stacks, threading.get_ident(), seconds, max(interval, 0.001)
+            )
+            return Response(content=profiling.collapsed(stacks), media_type="text/plain")
+        profiler = profiling.start_cprofile()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stats = profiling.pstats_dump(profiler)
+        return Response(
+            content=stats, media_type="application/octet-stream",
+            headers={"Content-Disposition": 'attachment; filename="coinapi_{}.pstats"'.format(os.getpid())}
+        )
+
+@app.get("/admin/queries", include_in_schema=False)
+async def admin_queries(
+    request: Request, sort: str="total", limit: int=50, reset: bool=False
+):
+    """
+    MySQL statements of this process by normalized SQL, slowest calls and their EXPLAIN (admin key only)
+
+    sort: total, avg, max, count or slow; reset: clear after reading
+    """
+    if not is_admin(request):
+        return {
+            "success": False,
+            "data": None,
+            "message": "Wrong admin key!",
+            "time": int(time.time())
+        }
+    if sort not in ["total", "avg", "max", "count", "slow"]:
+        return {
+            "success": False,
+            "data": None,
+            "message": "Invalid sort!",
+            "time": int(time.time())
+        }
+    result = query_log.report(sort, max(1, min(limit, 1000)))
+    if reset is True:
+        query_log.reset()
+    return {
+        "success": True,
+        "data": result,
+        "message": None,
+        "time": int(time.time())
+    }
+
+@app.get("/admin/memory", include_in_schema=False)
+async def admin_memory(
+    request: Request, action: str="snapshot", limit: int=20, frames: int=1, group_by: str="lineno"
+):
+    """
+    tracemalloc of this process (admin key only)
+
+    action: start (tracing costs memory and CPU until stop), snapshot (top allocations and
+    the diff against the previous snapshot), stop
+    """
+    if not is_admin(request):
+        return {
+            "success": False,
+            "data": None,
+            "message": "Wrong admin key!",
+            "time": int(time.time())
+        }
+    if action not in ["start", "snapshot", "stop"] or group_by not in ["lineno", "filename", "traceback"]:
+        return {
+            "success": False,
+            "data": None,
+            "message": "Invalid action or group_by!",
+            "time": int(time.time())
+        }
+    if action == "start":
+        memory_tracker.start(max(1, min(frames, 25)))
+        result = None
+    elif action == "stop":
+        memory_tracker.stop()
+        result = None
+    else:
+        result = await run_in_threadpool(memory_tracker.take, max(1, min(limit, 200)), group_by)
+        if result is None:
+            return {
+                "success": False,
+                "data": None,
+                "message": "tracemalloc is not started!",
+                "time": int(time.time())
+            }
+        # in-process caches that grow with addresses and keys
+        result['sizes'] = {
+            "addresses": len(runner.addresses), "by_key": len(runner.by_key),
+            "local_integrated": len(runner.local_integrated), "address_locks": len(address_locks),
+            "api_key_cache": len(api_key_cache), "api_event_waiters": len(api_event_waiters)
+        }
+    return {
+        "success": True,
+        "data": result,
+        "message": None,
+        "time": int(time.time())
+    }
+
 class newaddress_data(BaseModel):
     coin: str
     tag: str
@@ -1263,11 +3302,12 @@ async def create_new_coin_address(
                     "message": f"Your API is limited to these coins: {get_api['allowed_coin']}! If you need, please request additional access.",
                     "time": int(time.time())
                 }
+                failed_body = dump_json(failed_result)
                 try:
-                    await insert_api_failed_log(get_api['id'], method_call, str(item), json.dumps(failed_result))
+                    await insert_api_failed_log(get_api['id'], method_call, str(item), failed_body)
                 except Exception:
                     traceback.print_exc(file=sys.stdout) 
-                return failed_result
+                return api_response(failed_body)
 
             # check if enable_create != 1
             if runner.coin_list[coin_name]['enable_create'] != 1:
@@ -1277,11 +3317,12 @@ async def create_new_coin_address(
                     "message": f"Currently, {coin_name} not enable for new address generation. Try again later!",
                     "time": int(time.time())
                 }
+                failed_body = dump_json(failed_result)
                 try:
-                    await insert_api_failed_log(get_api['id'], method_call, str(item), json.dumps(failed_result))
+                    await insert_api_failed_log(get_api['id'], method_call, str(item), failed_body)
                 except Exception:
                     traceback.print_exc(file=sys.stdout) 
-                return failed_result
+                return api_response(failed_body)
             
             if item.tag and len(item.tag) >= 100:
                 failed_result = {
@@ -1290,11 +3331,12 @@ async def create_new_coin_address(
                     "message": f"tag '{item.tag}' is too long.",
                     "time": int(time.time())
                 }
+                failed_body = dump_json(failed_result)
                 try:
-                    await insert_api_failed_log(get_api['id'], method_call, str(item), json.dumps(failed_result))
+                    await insert_api_failed_log(get_api['id'], method_call, str(item), failed_body)
                 except Exception:
                     traceback.print_exc(file=sys.stdout) 
-                return failed_result
+                return api_response(failed_body)
             else:
                 tag = item.tag.strip()
                 # if tag of that coin and api_id exist
@@ -1314,17 +3356,18 @@ async def create_new_coin_address(
                         await update_second_tag(
                             coin_name, find_tag['id'], item.second_tag.strip()
                         )
+                    result_body = dump_json(result_data)
                     try:
-                        await insert_api_log(get_api['id'], method_call, str(item), json.dumps(result_data))
+                        await insert_api_log(get_api['id'], method_call, str(item), result_body)
                     except Exception:
                         traceback.print_exc(file=sys.stdout) 
-                    return result_data
+                    return api_response(result_body)
 
-        if coin_name in config['coinapi']['list_bcn_xmr']:
-            make_addr = await xmr_make_integrate(
-                runner.coin_list[coin_name]['wallet_address'],
-                runner.coin_list[coin_name]['main_address']
-            )
+        # take a pre-created address from the pool first, the wallet is only called when the pool is empty
+        second_tag = item.second_tag.strip() if item.second_tag is not None else None
+        new_address = await claim_pool_address(get_api['id'], coin_name, tag, second_tag)
+        if new_address is None:
+            make_addr = await generate_coin_address(coin_name)
             if make_addr is None:
                 failed_result = {
                     "success": False,
@@ -1332,82 +3375,194 @@ async def create_new_coin_address(
                     "message": "internal error.",
                     "time": int(time.time())
                 }
+                failed_body = dump_json(failed_result)
+                try:
+                    await insert_api_failed_log(get_api['id'], method_call, str(item), failed_body)
+                except Exception:
+                    traceback.print_exc(file=sys.stdout) 
+                return api_response(failed_body)
+            inserting = await insert_address(
+                get_api['id'], coin_name, make_addr['address'], make_addr['extra'], make_addr['priv_key'], tag, second_tag
+            )
+            if inserting is None:
+                failed_result = {
+                    "success": False,
+                    "data": None,
+                    "message": "internal error during inserting to DB.",
+                    "time": int(time.time())
+                }
+                failed_body = dump_json(failed_result)
                 try:
-                    await insert_api_failed_log(get_api['id'], method_call, str(item), json.dumps(failed_result))
+                    await insert_api_failed_log(get_api['id'], method_call, str(item), failed_body)
                 except Exception:
                     traceback.print_exc(file=sys.stdout) 
-                return failed_result
+                return api_response(failed_body)
+            new_address = {
+                "id": inserting, "api_id": get_api['id'], "coin_name": coin_name, "address": make_addr['address'],
+                "address_extra": make_addr['extra'], "tag": tag, "second_tag": second_tag
+            }
+        notify_address(new_address)
+        data_call = json.dumps({"coin": coin_name, "tag": item.tag})
+        result_data = {
+            "success": True,
+            "data": new_address['address'],
+            "message": None,
+            "time": int(time.time())
+        }
+        result_body = dump_json(result_data)
+        await insert_api_log(get_api['id'], method_call, data_call, result_body)
+        return api_response(result_body)
+
+@app.post("/newaddresses")
+async def create_new_coin_addresses(
+    request: Request, items: List[newaddress_data], Authorization: Union[str, None] = Header(default=None)
+):
+    """
+    Create many coin addresses at once, up to max_batch_records of your API
+
+    items: list of {coin, tag, second_tag}. Existing tags return their address.
+    """
+    method_call = "/newaddresses"
+    if runner.coin_list is None or len(runner.coin_list) == 0:
+        return {
+            "success": False,
+            "data": None,
+            "message": "internal error.",
+            "time": int(time.time())
+        }
+    if len(items) == 0:
+        return {
+            "success": False,
+            "data": None,
+            "message": "list of address can't be empty.",
+            "time": int(time.time())
+        }
+    if 'Authorization' not in request.headers:
+        return {
+            "success": False,
+            "data": None,
+            "message": "You need Authorization key in header!",
+            "time": int(time.time())
+        }
+    # get who own that key
+    get_api = await get_api_by_key(request.headers['Authorization'])
+    if get_api is None:
+        return {
+            "success": False,
+            "data": None,
+            "message": "Wrong API key!",
+            "time": int(time.time())
+        }
+    elif get_api['is_suspended'] != 0:
+        return {
+            "success": False,
+            "data": None,
+            "message": "We suspended your API key, please contact us!",
+            "time": int(time.time())
+        }
+
+    error_list = []
+    if len(items) > get_api['max_batch_records']:
+        error_list.append("too many addresses, maximum {} per call.".format(get_api['max_batch_records']))
+    allowed_coin = get_api['allowed_coin'].replace(" ","").split(",")
+    requested = {}
+    for ea in items:
+        coin_name = ea.coin.upper()
+        if coin_name not in runner.coin_list.keys():
+            error_list.append("{} is not in the supported list!".format(coin_name))
+        elif coin_name not in allowed_coin:
+            error_list.append(f"Your API is limited to these coins: {get_api['allowed_coin']}! If you need, please request additional access.")
+        elif runner.coin_list[coin_name]['enable_create'] != 1:
+            error_list.append(f"Currently, {coin_name} not enable for new address generation. Try again later!")
+        elif ea.tag is None:
+            error_list.append(f"{coin_name}, tag is required.")
+        elif len(ea.tag) >= 100:
+            error_list.append(f"tag '{ea.tag}' is too long.")
+        else:
+            # keyed case-insensitively like the unique key, "Bob" and "bob" are one tag
+            tag = ea.tag.strip()
+            requested[tag_key(coin_name, tag)] = (coin_name, tag, ea.second_tag.strip() if ea.second_tag is not None else None)
+    if len(error_list) > 0:
+        failed_result = {
+            "success": False,
+            "data": error_list,
+            "message": "there is one or more error(s)!",
+            "time": int(time.time())
+        }
+        failed_body = dump_json(failed_result)
+        try:
+            await insert_api_failed_log(get_api['id'], method_call, str(items), failed_body)
+        except Exception:
+            traceback.print_exc(file=sys.stdout) 
+        return api_response(failed_body)
+
+    found = {}
+    for each in await find_addresses_coin_tags(get_api['id'], [(i[0], i[1]) for i in requested.values()]):
+        key = tag_key(each['coin_name'], each['tag'])
+        found[key] = each
+        if key in requested and requested[key][2] is not None and each['second_tag'] is None:
+            await update_second_tag(each['coin_name'], each['id'], requested[key][2])
+    existing = set(found.keys())
+
+    # pool first, then generate the rest concurrently and insert them in one go
+    missing = []
+    for key, (coin_name, tag, second_tag) in requested.items():
+        if key in found:
+            continue
+        claimed = await claim_pool_address(get_api['id'], coin_name, tag, second_tag)
+        if claimed is not None:
+            found[key] = claimed
+            notify_address(claimed)
+        else:
+            missing.append((coin_name, tag, second_tag))
+    if len(missing) > 0:
+        semaphore = asyncio.Semaphore(8)
+        async def generate(coin_name: str):
+            async with semaphore:
+                return await generate_coin_address(coin_name)
+        generated = await asyncio.gather(*[generate(i[0]) for i in missing])
+        records = []
+        for (coin_name, tag, second_tag), make_addr in zip(missing, generated):
+            if make_addr is None:
+                error_list.append("{}, failed to create address for tag '{}'.".format(coin_name, tag))
+                continue
+            records.append((
+                get_api['id'], coin_name, int(time.time()), make_addr['address'], make_addr['extra'], make_addr['priv_key'], tag, second_tag
+            ))
+        if len(records) > 0:
+            if await insert_addresses(records) is False:
+                error_list.append("internal error during inserting to DB.")
             else:
-                inserting = await insert_address(
-                    get_api['id'], coin_name, make_addr['result']['integrated_address'],
-                    make_addr['result']['payment_id'], None, tag
-                )
-                if inserting is not None:
-                    collect_address = await get_coin_deposits()
-                    if collect_address:
-                        runner.addresses = collect_address['addresses']
-                        runner.by_key = collect_address['by_key']
-                        print("Reloading {} address(es).".format(len(runner.addresses)))
-                    data_call = json.dumps({"coin": coin_name, "tag": item.tag})
-                    result_data = {
-                        "success": True,
-                        "data": make_addr['result']['integrated_address'],
-                        "message": None,
-                        "time": int(time.time())
-                    }
-                    await insert_api_log(get_api['id'], method_call, data_call, json.dumps(result_data))
-                    return result_data
-                else:
-                    failed_result = {
-                        "success": False,
-                        "data": None,
-                        "message": "internal error during inserting to DB.",
-                        "time": int(time.time())
-                    }
-                    try:
-                        await insert_api_failed_log(get_api['id'], method_call, str(item), json.dumps(failed_result))
-                    except Exception:
-                        traceback.print_exc(file=sys.stdout) 
-                    return failed_result
-        elif coin_name in config['coinapi']['list_btc']:
-            url = runner.coin_list[coin_name]['daemon_address']
-            address_call = await call_doge(url, 'getnewaddress', coin_name, payload='')
-            reg_address = {}
-            reg_address['address'] = address_call
-            key_call = await call_doge(url, 'dumpprivkey', coin_name, payload=f'"{address_call}"')
-            reg_address['privateKey'] = key_call
-            if reg_address['address'] and reg_address['privateKey']:
-                inserting = await insert_address(
-                    get_api['id'], coin_name, reg_address['address'],
-                    None, reg_address['privateKey'], item.tag
-                )
-                if inserting is not None:
-                    collect_address = await get_coin_deposits()
-                    if collect_address:
-                        runner.addresses = collect_address['addresses']
-                        runner.by_key = collect_address['by_key']
-                        print("Reloading {} address(es).".format(len(runner.addresses)))
-                    data_call = json.dumps({"coin": coin_name, "tag": item.tag})
-                    result_data = {
-                        "success": True,
-                        "data": reg_address['address'],
-                        "message": None,
-                        "time": int(time.time())
-                    }
-                    await insert_api_log(get_api['id'], method_call, data_call, json.dumps(result_data))
-                    return result_data
-                else:
-                    failed_result = {
-                        "success": False,
-                        "data": None,
-                        "message": "internal error during inserting to DB.",
-                        "time": int(time.time())
-                    }
-                    try:
-                        await insert_api_failed_log(get_api['id'], method_call, str(item), json.dumps(failed_result))
-                    except Exception:
-                        traceback.print_exc(file=sys.stdout) 
-                    return failed_result
+                # a tag stored meanwhile by another call resolves to that call's address
+                for each in await find_addresses_coin_tags(get_api['id'], [(i[1], i[6]) for i in records]):
+                    found[tag_key(each['coin_name'], each['tag'])] = each
+                    notify_address(each)
+                for each in records:
+                    if tag_key(each[1], each[6]) not in found:
+                        error_list.append("{}, failed to store address for tag '{}'.".format(each[1], each[6]))
+
+    result_data = {
+        "success": len(error_list) == 0,
+        "data": [{
+            "coin": coin_name,
+            "tag": tag,
+            "address": found[key]['address'],
+            "new": key not in existing
+            } for key, (coin_name, tag, _) in requested.items() if key in found
+        ],
+        "message": "; ".join(error_list) if len(error_list) > 0 else None,
+        "time": int(time.time())
+    }
+    data_call = json.dumps([{"coin": i[0], "tag": i[1]} for i in requested.values()])
+    result_body = dump_json(result_data)
+    if len(error_list) > 0:
+        try:
+            await insert_api_failed_log(get_api['id'], method_call, data_call, result_body)
+        except Exception:
+            traceback.print_exc(file=sys.stdout) 
+    else:
+        await insert_api_log(get_api['id'], method_call, data_call, result_body)
+    return api_response(result_body)
 
 class balance_coin(BaseModel):
     coin: str
@@ -1475,11 +3630,12 @@ async def get_a_balance(
                     "message": "{}, address not found {}!".format(coin_name, address),
                     "time": int(time.time())
                 }
+                failed_body = dump_json(failed_result)
                 try:
-                    await insert_api_failed_log(get_api['id'], method_call, str(item), json.dumps(failed_result))
+                    await insert_api_failed_log(get_api['id'], method_call, str(item), failed_body)
                 except Exception:
                     traceback.print_exc(file=sys.stdout) 
-                return failed_result
+                return api_response(failed_body)
             else:
                 round_places = runner.coin_list[coin_name]['round_places']
                 data_call = json.dumps({"coin": coin_name, "address": address})
@@ -1488,17 +3644,19 @@ async def get_a_balance(
                     "data": {
                         "coin": coin_name,
                         "address": address,
-                        "balance": round_amount(get_balance['total_deposited'] + get_balance['total_received'] - get_balance['total_sent'] - get_balance['total_withdrew'], round_places),
+                        "balance": round_amount(get_balance['total_deposited'] + get_balance['total_received'] - get_balance['total_sent'] - get_balance['total_withdrew'] - float(get_balance['total_reserved']), round_places),
                         "deposit": round_amount(get_balance['total_deposited'], round_places),
                         "withdrew": round_amount(get_balance['total_withdrew'], round_places),
                         "received": round_amount(get_balance['total_received'], round_places),
-                        "sent": round_amount(get_balance['total_sent'], round_places)
+                        "sent": round_amount(get_balance['total_sent'], round_places),
+                        "reserved": round_amount(float(get_balance['total_reserved']), round_places)
                     },
                     "message": None,
                     "time": int(time.time())
                 }
-                await insert_api_log(get_api['id'], method_call, data_call, json.dumps(result_data))
-                return result_data
+                result_body = dump_json(result_data)
+                await insert_api_log(get_api['id'], method_call, data_call, result_body)
+                return api_response(result_body)
 
 class withdraw_data(BaseModel):
     coin: str
@@ -1506,6 +3664,7 @@ class withdraw_data(BaseModel):
     to_address: str
     amount: float
     remark: str
+    background: bool=False
 
 @app.post("/withdraw")
 async def withdraw_coin(
@@ -1515,6 +3674,8 @@ async def withdraw_coin(
     Withdraw from a coin address to an external wallet through blockchain
 
     item: transfer data
+
+    background: if true, only reserve the balance and return a job id. Poll GET /withdraw/{job_id} for the result.
     """
     method_call = "/withdraw"
     coin_name = item.coin.upper()
@@ -1572,11 +3733,12 @@ async def withdraw_coin(
                     "message": f"Your API is limited to these coins: {get_api['allowed_coin']}! If you need, please request additional access.",
                     "time": int(time.time())
                 }
+                failed_body = dump_json(failed_result)
                 try:
-                    await insert_api_failed_log(get_api['id'], method_call, str(item), json.dumps(failed_result))
+                    await insert_api_failed_log(get_api['id'], method_call, str(item), failed_body)
                 except Exception:
                     traceback.print_exc(file=sys.stdout) 
-                return failed_result
+                return api_response(failed_body)
 
             # check if enable_withdraw != 1
             if runner.coin_list[coin_name]['enable_withdraw'] != 1:
@@ -1586,11 +3748,12 @@ async def withdraw_coin(
                     "message": f"Currently, {coin_name} not enable for withdraw. Try again later!",
                     "time": int(time.time())
                 }
+                failed_body = dump_json(failed_result)
                 try:
-                    await insert_api_failed_log(get_api['id'], method_call, str(item), json.dumps(failed_result))
+                    await insert_api_failed_log(get_api['id'], method_call, str(item), failed_body)
                 except Exception:
                     traceback.print_exc(file=sys.stdout) 
-                return failed_result
+                return api_response(failed_body)
 
             # check if that API own that address
             if from_address not in runner.addresses:
@@ -1600,11 +3763,12 @@ async def withdraw_coin(
                     "message": "{}, address {}.. not in our database.".format(coin_name, from_address),
                     "time": int(time.time())
                 }
+                failed_body = dump_json(failed_result)
                 try:
-                    await insert_api_failed_log(get_api['id'], method_call, str(item), json.dumps(failed_result))
+                    await insert_api_failed_log(get_api['id'], method_call, str(item), failed_body)
                 except Exception:
                     traceback.print_exc(file=sys.stdout) 
-                return failed_result
+                return api_response(failed_body)
             else:
                 if get_api['id'] != runner.by_key["{}_{}".format(coin_name, from_address)]['api_id']:
                     failed_result = {
@@ -1613,11 +3777,12 @@ async def withdraw_coin(
                         "message": "{}, address {}.. permission denied.".format(coin_name, from_address),
                         "time": int(time.time())
                     }
+                    failed_body = dump_json(failed_result)
                     try:
-                        await insert_api_failed_log(get_api['id'], method_call, str(item), json.dumps(failed_result))
+                        await insert_api_failed_log(get_api['id'], method_call, str(item), failed_body)
                     except Exception:
                         traceback.print_exc(file=sys.stdout) 
-                    return failed_result
+                    return api_response(failed_body)
                 else:
                     # check if the receiving address insides API
                     if to_address in runner.addresses:
@@ -1627,8 +3792,9 @@ async def withdraw_coin(
                             "message": "{}, you can not send to address {}. You might need to call /transfer instead".format(coin_name, to_address),
                             "time": int(time.time())
                         }
+                        failed_body = dump_json(failed_result)
                         try:
-                            await insert_api_failed_log(get_api['id'], method_call, str(item), json.dumps(failed_result))
+                            await insert_api_failed_log(get_api['id'], method_call, str(item), failed_body)
                         except Exception:
                             traceback.print_exc(file=sys.stdout)
                         try:
@@ -1638,7 +3804,7 @@ async def withdraw_coin(
                             )
                         except Exception:
                             traceback.print_exc(file=sys.stdout)
-                        return failed_result
+                        return api_response(failed_body)
                     # he owns it, check amount, balance
                     # truncate amount
                     if amount < runner.coin_list[coin_name]['min_withdraw'] or amount > runner.coin_list[coin_name]['max_withdraw']:
@@ -1648,11 +3814,12 @@ async def withdraw_coin(
                             "message": "{}, withdraw amount out of range {}-{}.".format(coin_name, runner.coin_list[coin_name]['min_withdraw'], runner.coin_list[coin_name]['max_withdraw']),
                             "time": int(time.time())
                         }
+                        failed_body = dump_json(failed_result)
                         try:
-                            await insert_api_failed_log(get_api['id'], method_call, str(item), json.dumps(failed_result))
+                            await insert_api_failed_log(get_api['id'], method_call, str(item), failed_body)
                         except Exception:
                             traceback.print_exc(file=sys.stdout) 
-                        return failed_result
+                        return api_response(failed_body)
                     else:
                         # check balance
                         get_balance = await get_balance_coin_address(
@@ -1665,11 +3832,12 @@ async def withdraw_coin(
                                 "message": "{}, address not found {}!".format(coin_name, from_address),
                                 "time": int(time.time())
                             }
+                            failed_body = dump_json(failed_result)
                             try:
-                                await insert_api_failed_log(get_api['id'], method_call, str(item), json.dumps(failed_result))
+                                await insert_api_failed_log(get_api['id'], method_call, str(item), failed_body)
                             except Exception:
                                 traceback.print_exc(file=sys.stdout) 
-                            return failed_result
+                            return api_response(failed_body)
                         else:
                             # remark length
                             if len(remark) > 100:
@@ -1679,15 +3847,15 @@ async def withdraw_coin(
                                     "message": "{}, remark is too long {}.".format(coin_name, item.remark),
                                     "time": int(time.time())
                                 }
+                                failed_body = dump_json(failed_result)
                                 try:
-                                    await insert_api_failed_log(get_api['id'], method_call, str(item), json.dumps(failed_result))
+                                    await insert_api_failed_log(get_api['id'], method_call, str(item), failed_body)
                                 except Exception:
                                     traceback.print_exc(file=sys.stdout) 
-                                return failed_result
+                                return api_response(failed_body)
                             round_places = runner.coin_list[coin_name]['round_places']
                             tx_fee = runner.coin_list[coin_name]['fee_withdraw']
-                            has_pos = runner.coin_list[coin_name]['has_pos']
-                            balance = round_amount(get_balance['total_deposited'] + get_balance['total_received'] - get_balance['total_sent'] - get_balance['total_withdrew'], round_places)
+                            balance = round_amount(get_balance['total_deposited'] + get_balance['total_received'] - get_balance['total_sent'] - get_balance['total_withdrew'] - float(get_balance['total_reserved']), round_places)
                             if amount + tx_fee > balance:
                                 failed_result = {
                                     "success": False,
@@ -1695,118 +3863,190 @@ async def withdraw_coin(
                                     "message": "{}, insufficient balance to withdraw for {}! Fee: {} {}. Having {} {}.".format(coin_name, from_address, tx_fee, coin_name, balance, coin_name),
                                     "time": int(time.time())
                                 }
+                                failed_body = dump_json(failed_result)
                                 try:
-                                    await insert_api_failed_log(get_api['id'], method_call, str(item), json.dumps(failed_result))
+                                    await insert_api_failed_log(get_api['id'], method_call, str(item), failed_body)
                                 except Exception:
                                     traceback.print_exc(file=sys.stdout) 
-                                return failed_result
+                                return api_response(failed_body)
                             else:
                                 # enough balance to withdraw
-                                wallet_address = runner.coin_list[coin_name]['wallet_address']
-                                mixin = runner.coin_list[coin_name]['mixin']
-                                header = runner.coin_list[coin_name]['header']
-                                is_fee_per_byte = runner.coin_list[coin_name]['is_fee_per_byte']
-                                main_address = runner.coin_list[coin_name]['main_address']
-                                if coin_name in config['coinapi']['list_bcn_xmr']:
-                                    sending_tx = await send_external_xmr(
-                                        runner, runner.coin_list[coin_name]['type'], main_address, amount, to_address, coin_name,
-                                        runner.coin_list[coin_name]['decimal'], tx_fee, is_fee_per_byte, mixin, wallet_address, header
+                                if item.background is True:
+                                    # reserve now, the wallet send happens in runner.withdraw_worker()
+                                    job_id = str(uuid.uuid4())
+                                    reserving = await reserve_withdraw(
+                                        get_api['id'], coin_name, from_address, amount, tx_fee, round_places,
+                                        job_id, to_address, remark
                                     )
-                                    if sending_tx is None:
+                                    if reserving is None or reserving['reserved'] is False:
                                         failed_result = {
                                             "success": False,
                                             "data": None,
-                                            "message": "{}, failed to send {} {} to {}.".format(coin_name, amount, coin_name, to_address),
+                                            "message": "{}, failed to queue withdraw of {} {} to {}.".format(coin_name, amount, coin_name, to_address),
                                             "time": int(time.time())
                                         }
-                                        try:
-                                            await insert_api_failed_log(get_api['id'], method_call, str(item), json.dumps(failed_result))
-                                        except Exception:
-                                            traceback.print_exc(file=sys.stdout)
-                                        try:
-                                            await log_to_discord(
-                                                "API: {} / 🔴 FAILED TO WITHDRAW {} {} to {}.".format(get_api['id'], amount, coin_name, to_address),
-                                                config['log']['discord_webhook_default']
+                                        if reserving is not None:
+                                            failed_result['message'] = "{}, insufficient balance to withdraw for {}! Fee: {} {}. Having {} {}.".format(
+                                                coin_name, from_address, tx_fee, coin_name, reserving['balance'], coin_name
                                             )
+                                        failed_body = dump_json(failed_result)
+                                        try:
+                                            await insert_api_failed_log(get_api['id'], method_call, str(item), failed_body)
                                         except Exception:
                                             traceback.print_exc(file=sys.stdout)
-                                        return failed_result
-                                    else:
-                                        ref_uuid = str(uuid.uuid4())
-                                        await insert_withdraw_success(
-                                            get_api['id'], coin_name, from_address, amount, tx_fee, runner.by_key["{}_{}".format(coin_name, from_address)]['id'],
-                                            to_address, sending_tx['hash'], sending_tx['key'], remark, ref_uuid
+                                        return api_response(failed_body)
+                                    runner.queue_withdraw_job(job_id, coin_name)
+                                    result_data = {
+                                        "success": True,
+                                        "data": job_id,
+                                        "message": "{}, queued withdraw {} {} to {}. Job: {}".format(coin_name, amount, coin_name, to_address, job_id),
+                                        "time": int(time.time())
+                                    }
+                                    result_body = dump_json(result_data)
+                                    await insert_api_log(get_api['id'], method_call, str(item), result_body)
+                                    return api_response(result_body)
+
+                                async with address_lock(coin_name, from_address) as locked:
+                                    reserving = None
+                                    if locked is True:
+                                        reserving = await reserve_withdraw(
+                                            get_api['id'], coin_name, from_address, amount, tx_fee, round_places
                                         )
-                                        result_data = {
-                                            "success": True,
-                                            "data": sending_tx['hash'],
-                                            "message": "{}, successfully sent {} {} to {}. Tx: {}, Ref: {}".format(coin_name, amount, coin_name, to_address, sending_tx['hash'], ref_uuid),
+                                    if reserving is None or reserving['reserved'] is False:
+                                        failed_result = {
+                                            "success": False,
+                                            "data": None,
+                                            "message": "{}, address {} is busy with another withdraw. Try again later!".format(coin_name, from_address),
                                             "time": int(time.time())
                                         }
-                                        collect_address = await get_coin_deposits()
-                                        if collect_address:
-                                            runner.addresses = collect_address['addresses']
-                                            runner.by_key = collect_address['by_key']
-                                            print("Reloading {} address(es).".format(len(runner.addresses)))
-                                        await insert_api_log(get_api['id'], method_call, str(item), json.dumps(result_data))
-                                        try:
-                                            await log_to_discord(
-                                                "API: {} / ✈️ WITHDRAW {} {} to {}. Tx: {}".format(get_api['id'], amount, coin_name, to_address, sending_tx['hash']),
-                                                config['log']['discord_webhook_default']
+                                        if reserving is not None:
+                                            failed_result['message'] = "{}, insufficient balance to withdraw for {}! Fee: {} {}. Having {} {}.".format(
+                                                coin_name, from_address, tx_fee, coin_name, reserving['balance'], coin_name
                                             )
+                                        failed_body = dump_json(failed_result)
+                                        try:
+                                            await insert_api_failed_log(get_api['id'], method_call, str(item), failed_body)
                                         except Exception:
-                                            traceback.print_exc(file=sys.stdout) 
-                                        return result_data
-                                elif coin_name in config['coinapi']['list_btc']:
-                                    url = runner.coin_list[coin_name]['daemon_address']
-                                    sending_tx = await send_external_doge(
-                                        url, from_address, amount, to_address, coin_name, has_pos
-                                    )
+                                            traceback.print_exc(file=sys.stdout)
+                                        return api_response(failed_body)
+
+                                    sending_tx = await send_withdraw(coin_name, from_address, amount, to_address)
                                     if sending_tx is None:
+                                        await release_withdraw(reserving['deposit_id'], amount, tx_fee)
                                         failed_result = {
                                             "success": False,
                                             "data": None,
                                             "message": "{}, failed to send {} {} to {}.".format(coin_name, amount, coin_name, to_address),
                                             "time": int(time.time())
                                         }
+                                        failed_body = dump_json(failed_result)
                                         try:
-                                            await insert_api_failed_log(get_api['id'], method_call, str(item), json.dumps(failed_result))
+                                            await insert_api_failed_log(get_api['id'], method_call, str(item), failed_body)
                                         except Exception:
-                                            traceback.print_exc(file=sys.stdout) 
+                                            traceback.print_exc(file=sys.stdout)
                                         try:
                                             await log_to_discord(
                                                 "API: {} / 🔴 FAILED TO WITHDRAW {} {} to {}.".format(get_api['id'], amount, coin_name, to_address),
                                                 config['log']['discord_webhook_default']
                                             )
                                         except Exception:
-                                            traceback.print_exc(file=sys.stdout) 
-                                        return failed_result
+                                            traceback.print_exc(file=sys.stdout)
+                                        return api_response(failed_body)
                                     else:
                                         ref_uuid = str(uuid.uuid4())
-                                        await insert_withdraw_success(
-                                            get_api['id'], coin_name, from_address, amount, tx_fee, runner.by_key["{}_{}".format(coin_name, from_address)]['id'],
-                                            to_address, sending_tx, None, remark, ref_uuid
+                                        # records the withdraw and releases the reservation together
+                                        completed = await complete_withdraw(
+                                            get_api['id'], coin_name, from_address, amount, tx_fee, reserving['deposit_id'],
+                                            to_address, sending_tx['hash'], sending_tx['key'], remark, ref_uuid
                                         )
+                                        if completed is False:
+                                            print_color(f"{datetime.now():%Y-%m-%d %H:%M:%S} {coin_name} sent {sending_tx['hash']} but failed to record!", color="red")
                                         result_data = {
                                             "success": True,
-                                            "data": sending_tx,
-                                            "message": "{}, successfully sent {} {} to {}. Tx: {}, Ref: {}".format(coin_name, amount, coin_name, to_address, sending_tx, ref_uuid),
+                                            "data": sending_tx['hash'],
+                                            "message": "{}, successfully sent {} {} to {}. Tx: {}, Ref: {}".format(coin_name, amount, coin_name, to_address, sending_tx['hash'], ref_uuid),
                                             "time": int(time.time())
                                         }
-                                        collect_address = await get_coin_deposits()
-                                        if collect_address:
-                                            runner.addresses = collect_address['addresses']
-                                            runner.by_key = collect_address['by_key']
-                                            print("Reloading {} address(es).".format(len(runner.addresses)))
-                                        await insert_api_log(get_api['id'], method_call, str(item), json.dumps(result_data))
+                                        result_body = dump_json(result_data)
+                                        await insert_api_log(get_api['id'], method_call, str(item), result_body)
                                         try:
                                             await log_to_discord(
-                                                "API: {} / ✈️ WITHDRAW {} {} to {}. Tx: {}".format(get_api['id'], amount, coin_name, to_address, sending_tx),
+                                                "API: {} / ✈️ WITHDRAW {} {} to {}. Tx: {}".format(get_api['id'], amount, coin_name, to_address, sending_tx['hash']),
                                                 config['log']['discord_webhook_default']
                                             )
                                         except Exception:
                                             traceback.print_exc(file=sys.stdout) 
-                                        return result_data
+                                        return api_response(result_body)
+
+@app.get("/withdraw/{job_id}")
+async def withdraw_job_status(
+    request: Request, job_id: str, Authorization: Union[str, None] = Header(default=None)
+):
+    """
+    Get status of a queued withdraw
+
+    job_id: job id returned by /withdraw with background=true
+    """
+    method_call = "/withdraw/"
+    if 'Authorization' not in request.headers:
+        return {
+            "success": False,
+            "data": None,
+            "message": "You need Authorization key in header!",
+            "time": int(time.time())
+        }
+    else:
+        # get who own that key
+        get_api = await get_api_by_key(request.headers['Authorization'])
+        if get_api is None:
+            return {
+                "success": False,
+                "data": None,
+                "message": "Wrong API key!",
+                "time": int(time.time())
+            }
+        elif get_api['is_suspended'] != 0:
+            return {
+                "success": False,
+                "data": None,
+                "message": "We suspended your API key, please contact us!",
+                "time": int(time.time())
+            }
+
+        get_job = await get_withdraw_job(job_id, get_api['id'])
+        if get_job is None:
+            failed_result = {
+                "success": False,
+                "data": None,
+                "message": "no such withdraw job {}.".format(job_id),
+                "time": int(time.time())
+            }
+            failed_body = dump_json(failed_result)
+            try:
+                await insert_api_failed_log(get_api['id'], method_call, json.dumps({"job_id": job_id}), failed_body)
+            except Exception:
+                traceback.print_exc(file=sys.stdout) 
+            return api_response(failed_body)
+        else:
+            return {
+                "success": True,
+                "data": {
+                    "job_id": get_job['job_id'],
+                    "coin": get_job['coin_name'],
+                    "from_address": get_job['from_address'],
+                    "to_address": get_job['to_address'],
+                    "amount": float(get_job['amount']),
+                    "fee": float(get_job['fee_and_tax']),
+                    "status": get_job['status'],
+                    "txid": get_job['txid'],
+                    "ref_uuid": get_job['ref_uuid'],
+                    "remark": get_job['remark'],
+                    "created": get_job['created'],
+                    "updated": get_job['updated']
+                },
+                "message": get_job['message'],
+                "time": int(time.time())
+            }
 
 class transfer_data(BaseModel):
     coin: str
@@ -1865,85 +4105,33 @@ async def transfer_balances(
                     "time": int(time.time())
                 }
 
-            has_error = False
             error_list = []
             records = []
+            results = []
             ref_id = str(uuid.uuid4())
             records_coins = {}
-            temp_balances = {}
-            for ea in items:
-                try:
-                    coin_name = ea.coin.upper()
-                    if ea.from_address not in runner.addresses:
-                        continue
-                    if ea.to_address not in runner.addresses:
-                        continue
-
-                    temp_balances["{}_{}".format(coin_name, ea.from_address)] = runner.by_key["{}_{}".format(coin_name, ea.from_address)]['total_deposited'] + runner.by_key["{}_{}".format(coin_name, ea.from_address)]['total_received'] - \
-                    runner.by_key["{}_{}".format(coin_name, ea.from_address)]['total_sent'] - runner.by_key["{}_{}".format(coin_name, ea.from_address)]['total_withdrew']
-                    
-                    temp_balances["{}_{}".format(coin_name, ea.to_address)] = runner.by_key["{}_{}".format(coin_name, ea.to_address)]['total_deposited'] + runner.by_key["{}_{}".format(coin_name, ea.to_address)]['total_received'] - \
-                    runner.by_key["{}_{}".format(coin_name, ea.to_address)]['total_sent'] - runner.by_key["{}_{}".format(coin_name, ea.to_address)]['total_withdrew']
-                except Exception:
-                    traceback.print_exc(file=sys.stdout) 
-
             for ea in items:
-                ea_error = False
+                ea_errors = []
+                coin_name = ea.coin.upper()
                 try:
-                    coin_name = ea.coin.upper()
                     if coin_name not in runner.coin_list.keys():
-                        has_error = True
-                        ea_error = True
-                        error_list.append("{} is not in the supported list!".format(coin_name))
+                        ea_errors.append("{} is not in the supported list!".format(coin_name))
                     elif ea.amount < runner.coin_list[coin_name]['min_transfer'] or ea.amount > runner.coin_list[coin_name]['max_transfer']:
-                        has_error = True
-                        ea_error = True
-                        error_list.append("{} {} is out of range transfer.".format(ea.amount, coin_name))
+                        ea_errors.append("{} {} is out of range transfer.".format(ea.amount, coin_name))
                     if ea.remark and len(ea.remark) >= 100:
-                        has_error = True
-                        ea_error = True
-                        error_list.append("{}, remark {}.. is too long.".format(coin_name, ea.remark[0:90]))
+                        ea_errors.append("{}, remark {}.. is too long.".format(coin_name, ea.remark[0:90]))
                     if ea.from_address == ea.to_address:
-                        has_error = True
-                        ea_error = True
-                        error_list.append("{}, same address from and to.".format(coin_name))
-                    if ea.from_address not in runner.addresses:
-                        has_error = True
-                        ea_error = True
-                        error_list.append("{}, address {}.. not in our database.".format(coin_name, ea.from_address[0:30]))
-                    else:
-                        # in database
-                        # check loop transfer
-                        if coin_name not in records_coins:
-                            records_coins[coin_name] = []
-                        if ea.from_address + ea.to_address in records_coins[coin_name]:
-                            has_error = True
-                            ea_error = True
-                            error_list.append(f"{coin_name}, loop transfer detected.")
-                        else:
-                            records_coins[coin_name].append("{}{}".format(ea.to_address, ea.from_address))
+                        ea_errors.append("{}, same address from and to.".format(coin_name))
 
-                        if runner.by_key.get("{}_{}".format(coin_name, ea.from_address)) is None:
-                            has_error = True
-                            ea_error = True
-                            error_list.append("{}, address {}.. not in our API.".format(coin_name, ea.from_address[0:30]))
-                        else:
-                            temp_balances["{}_{}".format(coin_name, ea.from_address)] -= ea.amount
-                            # check balance
-                            if temp_balances["{}_{}".format(coin_name, ea.from_address)] < 0:
-                                has_error = True
-                                ea_error = True
-                                error_list.append("{}, address {}.. not sufficient balance.".format(coin_name, ea.from_address[0:30]))
-
-                    # to_address no need to check API
-                    if ea.to_address not in runner.addresses:
-                        has_error = True
-                        ea_error = True
-                        error_list.append("{}, address {}.. not in our database.".format(coin_name, ea.to_address[0:30]))
+                    # check loop transfer
+                    if coin_name not in records_coins:
+                        records_coins[coin_name] = {}
+                    if has_transfer_loop(records_coins[coin_name], ea.from_address, ea.to_address):
+                        ea_errors.append(f"{coin_name}, loop transfer detected.")
                     else:
-                        temp_balances["{}_{}".format(coin_name, ea.to_address)] += ea.amount
+                        records_coins[coin_name].setdefault(ea.from_address, set()).add(ea.to_address)
 
-                    if ea_error is False:
+                    if len(ea_errors) == 0:
                         round_places = runner.coin_list[coin_name]['round_places']
                         print("{}, preparing transfer from: {}.., to: {}.., amount: {}".format(
                             coin_name, ea.from_address[0:30], ea.to_address[0:30], round_amount(ea.amount, round_places)
@@ -1952,61 +4140,176 @@ async def transfer_balances(
                             get_api['id'], ea.from_address, ea.to_address, round_amount(ea.amount, round_places), coin_name, ea.remark, int(time.time()), ref_id
                         ))
                 except Exception:
-                    traceback.print_exc(file=sys.stdout)        
-            if has_error is True:
+                    traceback.print_exc(file=sys.stdout)
+                    ea_errors.append("{}, internal error.".format(coin_name))
+                error_list += ea_errors
+                results.append({
+                    "coin": coin_name,
+                    "from_address": ea.from_address,
+                    "to_address": ea.to_address,
+                    "amount": ea.amount,
+                    "success": len(ea_errors) == 0,
+                    "message": "; ".join(ea_errors) if len(ea_errors) > 0 else None
+                })
+
+            if len(error_list) == 0:
+                # balances and ownership are checked against locked rows inside the transaction
+                applied = await transfer_records(get_api['id'], records)
+                if applied is None:
+                    failed_result = {
+                        "success": False,
+                        "data": None,
+                        "message": "internal error.",
+                        "time": int(time.time())
+                    }
+                    failed_body = dump_json(failed_result)
+                    try:
+                        await insert_api_failed_log(get_api['id'], method_call, str(items), failed_body)
+                    except Exception:
+                        traceback.print_exc(file=sys.stdout) 
+                    return api_response(failed_body)
+                for each, error in zip(results, applied):
+                    if error is not None:
+                        each['success'] = False
+                        each['message'] = error
+                        error_list.append(error)
+
+            if len(error_list) > 0:
                 failed_result = {
                     "success": False,
                     "data": error_list,
+                    "results": results,
                     "message": "there is one or more error(s)!",
                     "time": int(time.time())
                 }
+                failed_body = dump_json(failed_result)
                 try:
-                    await insert_api_failed_log(get_api['id'], method_call, str(items), json.dumps(failed_result))
+                    await insert_api_failed_log(get_api['id'], method_call, str(items), failed_body)
                 except Exception:
                     traceback.print_exc(file=sys.stdout) 
-                return failed_result
+                return api_response(failed_body)
             else:
-                if len(records) > 0:
-                    # check fofr loop transfer
-                    inserting = await transfer_records(records)
-                    if inserting:
-                        collect_address = await get_coin_deposits()
-                        if collect_address:
-                            runner.addresses = collect_address['addresses']
-                            runner.by_key = collect_address['by_key']
-                            print("Reloading {} address(es).".format(len(runner.addresses)))
-                        result_data = {
-                            "success": True,
-                            "data": ref_id,
-                            "message": "processed {} transfer(s).".format(len(records)),
-                            "time": int(time.time())
-                        }
-                        await insert_api_log(get_api['id'], method_call, json.dumps(records), json.dumps(result_data))
-                        return result_data
-                    else:
-                        failed_result = {
-                            "success": False,
-                            "data": None,
-                            "message": "internal error.",
-                            "time": int(time.time())
-                        }
-                        try:
-                            await insert_api_failed_log(get_api['id'], method_call, str(items), json.dumps(failed_result))
-                        except Exception:
-                            traceback.print_exc(file=sys.stdout) 
-                        return failed_result
-                else:
-                    failed_result = {
-                        "success": False,
-                        "data": None,
-                        "message": "no transfer records!",
-                        "time": int(time.time())
-                    }
-                    try:
-                        await insert_api_failed_log(get_api['id'], method_call, str(items), json.dumps(failed_result))
-                    except Exception:
-                        traceback.print_exc(file=sys.stdout) 
-                    return failed_result
+                result_data = {
+                    "success": True,
+                    "data": ref_id,
+                    "results": results,
+                    "message": "processed {} transfer(s).".format(len(records)),
+                    "time": int(time.time())
+                }
+                result_body = dump_json(result_data)
+                await insert_api_log(get_api['id'], method_call, json.dumps(records), result_body)
+                return api_response(result_body)
+
+def format_transfer(api_id: int, tr: Dict):
+    return {
+        "coin_name": tr['coin_name'],
+        "from_address": tr['from_address'],
+        "to_address": tr['to_address'],
+        "amount": tr['amount'],
+        "purpose": tr['purpose'],
+        "time": tr['timestamp'],
+        "ref_uuid": tr['ref_uuid'],
+        "direction": "internal" if tr['api_id'] == tr['to_api_id'] else "out" if tr['api_id'] == api_id else "in"
+    }
+
+def format_withdraw(wd: Dict):
+    return {
+        "coin_name": wd['coin_name'],
+        "from_address": wd['from_address'],
+        "to_address": wd['to_address'],
+        "amount": wd['amount'],
+        "fee": wd['fee_and_tax'],
+        "txid": wd['txid'],
+        "time": wd['timestamp'],
+        "ref_uuid": wd['ref_uuid'],
+        "remark": wd['remark']
+    }
+
+def format_tx(coin_name: str, tx: Dict):
+    return {
+        "coin_name": coin_name,
+        "txid": tx['txid'],
+        "amount": tx['amount'],
+        "address": tx['address'],
+        "time": tx['time_insert'],
+        "tag": tx['tag'],
+        "second_tag": tx['second_tag'],
+        "noted": tx['already_noted'],
+        "noted_time": tx['noted_time']
+    }
+
+async def list_transactions_result(
+    get_api: Dict, method_call: str, data_call: str, coin_name: str, address: str,
+    limit: int, before: str, since: str, format: str
+):
+    before_key = parse_cursor(before) if before is not None else None
+    since_key = parse_cursor(since) if since is not None else None
+    max_page_size = config['coinapi'].get('max_page_size', 1000)
+    failed_message = None
+    if (before is not None and before_key is None) or (since is not None and since_key is None):
+        failed_message = "invalid cursor."
+    elif before is not None and since is not None:
+        failed_message = "use either before or since, not both."
+    elif limit is not None and (limit < 1 or (format != "ndjson" and limit > max_page_size)):
+        failed_message = "limit must be between 1 and {}.".format(max_page_size)
+    elif format not in ["json", "ndjson", "columnar"]:
+        failed_message = "format must be json, ndjson or columnar."
+    if failed_message is not None:
+        failed_result = {
+            "success": False,
+            "data": None,
+            "message": failed_message,
+            "time": int(time.time())
+        }
+        failed_body = dump_json(failed_result)
+        try:
+            await insert_api_failed_log(get_api['id'], method_call, data_call, failed_body)
+        except Exception:
+            traceback.print_exc(file=sys.stdout) 
+        return api_response(failed_body)
+
+    if format == "ndjson":
+        async def stream_lines():
+            numb = 0
+            try:
+                async for rows in stream_txes_address_coin_api(coin_name, get_api['id'], address, before_key, since_key):
+                    lines = []
+                    for i in rows:
+                        if limit is not None and numb >= limit:
+                            break
+                        each = format_tx(coin_name, i)
+                        each['cursor'] = "{}_{}".format(i['time_insert'], i['id'])
+                        lines.append(dump_json(each))
+                        numb += 1
+                    if len(lines) > 0:
+                        yield "\n".join(lines) + "\n"
+                    if limit is not None and numb >= limit:
+                        break
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
+            result_data = {"success": True, "data": None, "message": "streamed {} transaction(s).".format(numb), "time": int(time.time())}
+            await insert_api_log(get_api['id'], method_call, data_call, dump_json(result_data))
+        return StreamingResponse(stream_lines(), media_type="application/x-ndjson")
+
+    if limit is None:
+        limit = 500
+    get_txes = await get_txes_address_coin_api(
+        coin_name, get_api['id'], address, limit, before_key, since_key
+    )
+    next_cursor = None
+    if len(get_txes) == limit:
+        next_cursor = "{}_{}".format(get_txes[-1]['time_insert'], get_txes[-1]['id'])
+    data = [format_tx(coin_name, i) for i in get_txes]
+    result_data = {
+        "success": True,
+        "data": to_columnar(data) if format == "columnar" else data,
+        "next_cursor": next_cursor,
+        "message": None if len(get_txes) > 0 else "no transactions.",
+        "time": int(time.time())
+    }
+    result_body = dump_json(result_data)
+    await insert_api_log(get_api['id'], method_call, data_call, result_body)
+    return api_response(result_body)
 
 @app.get("/noted/{coin_name}/{tx}")
 async def remark_noted_a_tx(
@@ -2070,8 +4373,9 @@ async def remark_noted_a_tx(
                     "message": f"no such transaction for {coin_name}.",
                     "time": int(time.time())
                 }
-                await insert_api_log(get_api['id'], method_call, data_call, json.dumps(result_data))
-                return result_data
+                result_body = dump_json(result_data)
+                await insert_api_log(get_api['id'], method_call, data_call, result_body)
+                return api_response(result_body)
             else:
                 noted = await note_tx_coin(
                     coin_name, tx, get_api['id'], find_tx['depost_id']
@@ -2083,8 +4387,9 @@ async def remark_noted_a_tx(
                         "message": f"noted for tx {tx}.",
                         "time": int(time.time())
                     }
-                    await insert_api_log(get_api['id'], method_call, data_call, json.dumps(result_data))
-                    return result_data
+                    result_body = dump_json(result_data)
+                    await insert_api_log(get_api['id'], method_call, data_call, result_body)
+                    return api_response(result_body)
                 else:
                     failed_result = {
                         "success": False,
@@ -2092,23 +4397,259 @@ async def remark_noted_a_tx(
                         "message": "{}, internal error noting tx: {}.".format(coin_name, tx),
                         "time": int(time.time())
                     }
+                    failed_body = dump_json(failed_result)
                     try:
-                        await insert_api_failed_log(get_api['id'], method_call, json.dumps(data_call), json.dumps(failed_result))
+                        await insert_api_failed_log(get_api['id'], method_call, json.dumps(data_call), failed_body)
                     except Exception:
                         traceback.print_exc(file=sys.stdout) 
-                    return failed_result
+                    return api_response(failed_body)
+
+@app.get("/list_transactions/{coin_name}/{address}")
+async def list_transactions(
+    request: Request, coin_name: str, address: str, Authorization: Union[str, None] = Header(default=None),
+    limit: Union[int, None] = None, before: Union[str, None] = None, since: Union[str, None] = None, format: str = "json"
+):
+    """
+    Get list of transactions for a coin, address
+
+    coin_name: coin name
+    address: address of deposited coin
+    limit: page size, default 500
+    before: next_cursor of the previous page, to page back in time
+    since: a cursor, to read newer transactions oldest first
+    format: json, ndjson (streams every matching transaction, one per line) or columnar (field names once, then rows of values)
+    """
+    method_call = "/list_transactions/"
+    coin_name = coin_name.upper()
+    if runner.coin_list is None or len(runner.coin_list) == 0:
+        return {
+            "success": False,
+            "data": None,
+            "message": "internal error.",
+            "time": int(time.time())
+        }
+    if coin_name not in runner.coin_list.keys():
+        return {
+            "success": False,
+            "data": None,
+            "message": "coin {} not in the supported list!".format(coin_name),
+            "time": int(time.time())
+        }
+    else:
+        if 'Authorization' not in request.headers:
+            return {
+                "success": False,
+                "data": None,
+                "message": "You need Authorization key in header!",
+                "time": int(time.time())
+            }
+        else:
+            # get who own that key
+            get_api = await get_api_by_key(request.headers['Authorization'])
+            if get_api is None:
+                return {
+                    "success": False,
+                    "data": None,
+                    "message": "Wrong API key!",
+                    "time": int(time.time())
+                }
+            elif get_api['is_suspended'] != 0:
+                return {
+                    "success": False,
+                    "data": None,
+                    "message": "We suspended your API key, please contact us!",
+                    "time": int(time.time())
+                }
+
+            data_call = json.dumps({"coin_name": coin_name, "api_id": get_api['id'], "address": address})
+            # check if that API can use that coin
+            if coin_name not in get_api['allowed_coin'].replace(" ","").split(","):
+                failed_result = {
+                    "success": False,
+                    "data": None,
+                    "message": f"Your API is limited to these coins: {get_api['allowed_coin']}! If you need, please request additional access.",
+                    "time": int(time.time())
+                }
+                failed_body = dump_json(failed_result)
+                try:
+                    await insert_api_failed_log(get_api['id'], method_call, data_call, failed_body)
+                except Exception:
+                    traceback.print_exc(file=sys.stdout) 
+                return api_response(failed_body)
+
+            if address not in runner.addresses:
+                failed_result = {
+                    "success": False,
+                    "data": None,
+                    "message": "{}, address: {} not within your API.".format(coin_name, address),
+                    "time": int(time.time())
+                }
+                data_call = {"coin_name": coin_name, "address": address}
+                failed_body = dump_json(failed_result)
+                try:
+                    await insert_api_failed_log(get_api['id'], method_call, json.dumps(data_call), failed_body)
+                except Exception:
+                    traceback.print_exc(file=sys.stdout) 
+                return api_response(failed_body)
+            else:
+                return await list_transactions_result(
+                    get_api, method_call, data_call, coin_name, address, limit, before, since, format
+                )
+
+@app.get("/list_transactions/{coin_name}")
+async def list_transactions_coin(
+    request: Request, coin_name: str, Authorization: Union[str, None] = Header(default=None),
+    limit: Union[int, None] = None, before: Union[str, None] = None, since: Union[str, None] = None, format: str = "json"
+):
+    """
+    Get list of transactions for a coin, address
+
+    coin_name: coin name
+    limit: page size, default 500
+    before: next_cursor of the previous page, to page back in time
+    since: a cursor, to read newer transactions oldest first
+    format: json, ndjson (streams every matching transaction, one per line) or columnar (field names once, then rows of values)
+    """
+    method_call = "/list_transactions/"
+    coin_name = coin_name.upper()
+    if runner.coin_list is None or len(runner.coin_list) == 0:
+        return {
+            "success": False,
+            "data": None,
+            "message": "internal error.",
+            "time": int(time.time())
+        }
+    if coin_name not in runner.coin_list.keys():
+        return {
+            "success": False,
+            "data": None,
+            "message": "coin {} not in the supported list!".format(coin_name),
+            "time": int(time.time())
+        }
+    else:
+        if 'Authorization' not in request.headers:
+            return {
+                "success": False,
+                "data": None,
+                "message": "You need Authorization key in header!",
+                "time": int(time.time())
+            }
+        else:
+            # get who own that key
+            get_api = await get_api_by_key(request.headers['Authorization'])
+            if get_api is None:
+                return {
+                    "success": False,
+                    "data": None,
+                    "message": "Wrong API key!",
+                    "time": int(time.time())
+                }
+            elif get_api['is_suspended'] != 0:
+                return {
+                    "success": False,
+                    "data": None,
+                    "message": "We suspended your API key, please contact us!",
+                    "time": int(time.time())
+                }
+
+            data_call = json.dumps({"coin_name": coin_name, "api_id": get_api['id']})
+            # check if that API can use that coin
+            if coin_name not in get_api['allowed_coin'].replace(" ","").split(","):
+                failed_result = {
+                    "success": False,
+                    "data": None,
+                    "message": f"Your API is limited to these coins: {get_api['allowed_coin']}! If you need, please request additional access.",
+                    "time": int(time.time())
+                }
+                failed_body = dump_json(failed_result)
+                try:
+                    await insert_api_failed_log(get_api['id'], method_call, data_call, failed_body)
+                except Exception:
+                    traceback.print_exc(file=sys.stdout) 
+                return api_response(failed_body)
+
+            return await list_transactions_result(
+                get_api, method_call, data_call, coin_name, None, limit, before, since, format
+            )
+
+# keys of format_address, in order, for the columnar stream header
+ADDRESS_COLUMNS = ["coin_name", "address", "created", "tag"]
+
+async def list_history_result(
+    get_api: Dict, method_call: str, data_call: str, kind: str, coin_name: str, address: str, ref_uuid: str,
+    limit: int, before: str, format: str
+):
+    # kind: transfers or withdraws
+    before_id = None
+    if before is not None:
+        try:
+            before_id = int(before)
+        except ValueError:
+            pass
+    max_page_size = config['coinapi'].get('max_page_size', 1000)
+    failed_message = None
+    if before is not None and before_id is None:
+        failed_message = "invalid cursor."
+    elif limit is not None and (limit < 1 or limit > max_page_size):
+        failed_message = "limit must be between 1 and {}.".format(max_page_size)
+    elif format not in ["json", "columnar"]:
+        failed_message = "format must be json or columnar."
+    elif address is not None and (
+        "{}_{}".format(coin_name, address) not in runner.by_key or runner.by_key["{}_{}".format(coin_name, address)]['api_id'] != get_api['id']
+    ):
+        failed_message = "{}, address: {} not within your API.".format(coin_name, address)
+    if failed_message is not None:
+        failed_result = {
+            "success": False,
+            "data": None,
+            "message": failed_message,
+            "time": int(time.time())
+        }
+        failed_body = dump_json(failed_result)
+        try:
+            await insert_api_failed_log(get_api['id'], method_call, data_call, failed_body)
+        except Exception:
+            traceback.print_exc(file=sys.stdout) 
+        return api_response(failed_body)
+
+    if limit is None:
+        limit = 500
+    if kind == "transfers":
+        rows = await get_transfers_coin_api(coin_name, get_api['id'], address, ref_uuid, limit, before_id)
+        data = [format_transfer(get_api['id'], i) for i in rows]
+        next_cursor = str(rows[-1]['tr_id']) if len(rows) == limit else None
+    else:
+        rows = await get_withdraws_coin_api(coin_name, get_api['id'], address, ref_uuid, limit, before_id)
+        data = [format_withdraw(i) for i in rows]
+        next_cursor = str(rows[-1]['id']) if len(rows) == limit else None
+    result_data = {
+        "success": True,
+        "data": to_columnar(data) if format == "columnar" else data,
+        "next_cursor": next_cursor,
+        "message": None if len(data) > 0 else "no {}.".format(kind),
+        "time": int(time.time())
+    }
+    result_body = dump_json(result_data)
+    await insert_api_log(get_api['id'], method_call, data_call, result_body)
+    return api_response(result_body)
 
-@app.get("/list_transactions/{coin_name}/{address}")
-async def list_transactions(
-    request: Request, coin_name: str, address: str, Authorization: Union[str, None] = Header(default=None)
+@app.get("/list_transfers/{coin_name}")
+async def list_transfers_coin(
+    request: Request, coin_name: str, Authorization: Union[str, None] = Header(default=None),
+    address: Union[str, None] = None, ref_uuid: Union[str, None] = None,
+    limit: Union[int, None] = None, before: Union[str, None] = None, format: str = "json"
 ):
     """
-    Get list of transactions for a coin, address
+    Get internal transfers sent or received by your API for a coin, newest first
 
     coin_name: coin name
-    address: address of deposited coin
+    address: only transfers from or to this address of yours
+    ref_uuid: only the transfers of one /transfer call
+    limit: page size, default 500
+    before: next_cursor of the previous page
+    format: json or columnar
     """
-    method_call = "/list_transactions/"
+    method_call = "/list_transfers/"
     coin_name = coin_name.upper()
     if runner.coin_list is None or len(runner.coin_list) == 0:
         return {
@@ -2150,7 +4691,7 @@ async def list_transactions(
                     "time": int(time.time())
                 }
 
-            data_call = json.dumps({"coin_name": coin_name, "api_id": get_api['id'], "address": address})
+            data_call = json.dumps({"coin_name": coin_name, "api_id": get_api['id'], "address": address, "ref_uuid": ref_uuid, "before": before})
             # check if that API can use that coin
             if coin_name not in get_api['allowed_coin'].replace(" ","").split(","):
                 failed_result = {
@@ -2159,70 +4700,34 @@ async def list_transactions(
                     "message": f"Your API is limited to these coins: {get_api['allowed_coin']}! If you need, please request additional access.",
                     "time": int(time.time())
                 }
+                failed_body = dump_json(failed_result)
                 try:
-                    await insert_api_failed_log(get_api['id'], method_call, data_call, json.dumps(failed_result))
+                    await insert_api_failed_log(get_api['id'], method_call, data_call, failed_body)
                 except Exception:
                     traceback.print_exc(file=sys.stdout) 
-                return failed_result
+                return api_response(failed_body)
 
-            if address not in runner.addresses:
-                failed_result = {
-                    "success": False,
-                    "data": None,
-                    "message": "{}, address: {} not within your API.".format(coin_name, address),
-                    "time": int(time.time())
-                }
-                data_call = {"coin_name": coin_name, "address": address}
-                try:
-                    await insert_api_failed_log(get_api['id'], method_call, json.dumps(data_call), json.dumps(failed_result))
-                except Exception:
-                    traceback.print_exc(file=sys.stdout) 
-                return failed_result
-            else:
-                get_txes = await get_txes_address_coin_api(
-                    coin_name, get_api['id'], address, 500
-                )
-                
-                if len(get_txes) == 0:
-                    result_data = {
-                        "success": True,
-                        "data": [],
-                        "message": "no transactions.",
-                        "time": int(time.time())
-                    }
-                    await insert_api_log(get_api['id'], method_call, data_call, json.dumps(result_data))
-                    return result_data
-                else:
-                    result_data = {
-                        "success": True,
-                        "data": [{
-                            "coin_name": coin_name,
-                            "txid": i['txid'],
-                            "amount": i['amount'],
-                            "address": i['address'],
-                            "time": i['time_insert'],
-                            "tag": i['tag'],
-                            "second_tag": i['second_tag'],
-                            "noted": i['already_noted'],
-                            "noted_time": i['noted_time']
-                            } for i in get_txes
-                        ],
-                        "message": None,
-                        "time": int(time.time())
-                    }
-                    await insert_api_log(get_api['id'], method_call, data_call, json.dumps(result_data))
-                    return result_data
+            return await list_history_result(
+                get_api, method_call, data_call, "transfers", coin_name, address, ref_uuid, limit, before, format
+            )
 
-@app.get("/list_transactions/{coin_name}")
-async def list_transactions_coin(
-    request: Request, coin_name: str, Authorization: Union[str, None] = Header(default=None)
+@app.get("/list_withdraws/{coin_name}")
+async def list_withdraws_coin(
+    request: Request, coin_name: str, Authorization: Union[str, None] = Header(default=None),
+    address: Union[str, None] = None, ref_uuid: Union[str, None] = None,
+    limit: Union[int, None] = None, before: Union[str, None] = None, format: str = "json"
 ):
     """
-    Get list of transactions for a coin, address
+    Get withdraws of your API for a coin, newest first
 
     coin_name: coin name
+    address: only withdraws from this address of yours
+    ref_uuid: only the withdraw with this Ref
+    limit: page size, default 500
+    before: next_cursor of the previous page
+    format: json or columnar
     """
-    method_call = "/list_transactions/"
+    method_call = "/list_withdraws/"
     coin_name = coin_name.upper()
     if runner.coin_list is None or len(runner.coin_list) == 0:
         return {
@@ -2264,7 +4769,7 @@ async def list_transactions_coin(
                     "time": int(time.time())
                 }
 
-            data_call = json.dumps({"coin_name": coin_name, "api_id": get_api['id']})
+            data_call = json.dumps({"coin_name": coin_name, "api_id": get_api['id'], "address": address, "ref_uuid": ref_uuid, "before": before})
             # check if that API can use that coin
             if coin_name not in get_api['allowed_coin'].replace(" ","").split(","):
                 failed_result = {
@@ -2273,53 +4778,126 @@ async def list_transactions_coin(
                     "message": f"Your API is limited to these coins: {get_api['allowed_coin']}! If you need, please request additional access.",
                     "time": int(time.time())
                 }
+                failed_body = dump_json(failed_result)
                 try:
-                    await insert_api_failed_log(get_api['id'], method_call, data_call, json.dumps(failed_result))
+                    await insert_api_failed_log(get_api['id'], method_call, data_call, failed_body)
                 except Exception:
                     traceback.print_exc(file=sys.stdout) 
-                return failed_result
+                return api_response(failed_body)
 
-            get_txes = await get_txes_address_coin_api(
-                coin_name, get_api['id'], None, 500
+            return await list_history_result(
+                get_api, method_call, data_call, "withdraws", coin_name, address, ref_uuid, limit, before, format
             )
-            if len(get_txes) == 0:
-                result_data = {
-                    "success": True,
-                    "data": [],
-                    "message": "no transactions.",
-                    "time": int(time.time())
-                }
-                await insert_api_log(get_api['id'], method_call, data_call, json.dumps(result_data))
-                return result_data
-            else:
-                result_data = {
-                    "success": True,
-                    "data": [{
-                        "coin_name": coin_name,
-                        "txid": i['txid'],
-                        "amount": i['amount'],
-                        "address": i['address'],
-                        "time": i['time_insert'],
-                        "tag": i['tag'],
-                        "second_tag": i['second_tag'],
-                        "noted": i['already_noted'],
-                        "noted_time": i['noted_time']
-                        } for i in get_txes
-                    ],
-                    "message": None,
-                    "time": int(time.time())
-                }
-                await insert_api_log(get_api['id'], method_call, data_call, json.dumps(result_data))
-                return result_data
+
+def format_address(coin_name: str, row: Dict):
+    return {"coin_name": coin_name, "address": row['address'], "created": row['created_date'], "tag": row['tag']}
+
+async def list_addresses_result(
+    get_api: Dict, method_call: str, data_call: str, coin_name: str, tag_prefix: str,
+    limit: int, after: str, format: str
+):
+    after_id = None
+    if after is not None:
+        try:
+            after_id = int(after)
+        except ValueError:
+            pass
+    max_page_size = config['coinapi'].get('max_page_size', 1000)
+    failed_message = None
+    if after is not None and after_id is None:
+        failed_message = "invalid cursor."
+    elif limit is not None and (limit < 1 or (format != "ndjson" and limit > max_page_size)):
+        failed_message = "limit must be between 1 and {}.".format(max_page_size)
+    elif format not in ["json", "ndjson", "columnar"]:
+        failed_message = "format must be json, ndjson or columnar."
+    if failed_message is not None:
+        failed_result = {
+            "success": False,
+            "data": None,
+            "message": failed_message,
+            "time": int(time.time())
+        }
+        failed_body = dump_json(failed_result)
+        try:
+            await insert_api_failed_log(get_api['id'], method_call, data_call, failed_body)
+        except Exception:
+            traceback.print_exc(file=sys.stdout) 
+        return api_response(failed_body)
+
+    if format != "ndjson" and limit is not None:
+        get_addresses = await get_addresses_coin_api(
+            coin_name, get_api['id'], tag_prefix, limit, after_id
+        )
+        next_cursor = None
+        if len(get_addresses) == limit:
+            next_cursor = str(get_addresses[-1]['id'])
+        data = [format_address(coin_name, i) for i in get_addresses]
+        result_data = {
+            "success": True,
+            "data": to_columnar(data) if format == "columnar" else data,
+            "next_cursor": next_cursor,
+            "message": None if len(get_addresses) > 0 else "no address.",
+            "time": int(time.time())
+        }
+        result_body = dump_json(result_data)
+        await insert_api_log(get_api['id'], method_call, data_call, result_body)
+        return api_response(result_body)
+
+    # without a page size, rows go to the client page by page as they are read;
+    # the envelope closes after data so success reflects the whole stream
+    async def stream_rows():
+        numb = 0
+        success = True
+        if format == "json":
+            yield '{"data": ['
+        elif format == "columnar":
+            yield '{"data": {"columns": ' + dump_json(ADDRESS_COLUMNS) + ', "rows": ['
+        try:
+            async for rows in stream_addresses_coin_api(coin_name, get_api['id'], tag_prefix, after_id):
+                lines = []
+                for i in rows:
+                    if limit is not None and numb >= limit:
+                        break
+                    each = format_address(coin_name, i)
+                    if format == "ndjson":
+                        each['cursor'] = str(i['id'])
+                    lines.append(dump_json(list(each.values()) if format == "columnar" else each))
+                    numb += 1
+                if len(lines) > 0:
+                    if format == "ndjson":
+                        yield "\n".join(lines) + "\n"
+                    else:
+                        yield (", " if numb > len(lines) else "") + ", ".join(lines)
+                if limit is not None and numb >= limit:
+                    break
+        except Exception:
+            success = False
+            traceback.print_exc(file=sys.stdout)
+        message = "streamed {} address(es).".format(numb) if success else "stream interrupted."
+        if format != "ndjson":
+            yield ("]}, " if format == "columnar" else "], ") + dump_json({
+                "success": success,
+                "message": None if success and numb > 0 else "no address." if success else message,
+                "time": int(time.time())
+            })[1:]
+        result_data = {"success": success, "data": None, "message": message, "time": int(time.time())}
+        await insert_api_log(get_api['id'], method_call, data_call, dump_json(result_data))
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/json"
+    return StreamingResponse(stream_rows(), media_type=media_type)
 
 @app.get("/list_address/{coin_name}")
 async def list_addresses(
-    request: Request, coin_name: str, Authorization: Union[str, None] = Header(default=None)
+    request: Request, coin_name: str, Authorization: Union[str, None] = Header(default=None),
+    tag_prefix: Union[str, None] = None, limit: Union[int, None] = None, after: Union[str, None] = None, format: str = "json"
 ):
     """
     Get list of addresses of a coin with tag
 
     coin_name: coin name
+    tag_prefix: only addresses whose tag starts with it
+    limit: page size; without it every address is streamed in one response
+    after: next_cursor of the previous page
+    format: json, ndjson (one address per line) or columnar (field names once, then rows of values)
     """
     method_call = "/list_address/"
     coin_name = coin_name.upper()
@@ -2363,7 +4941,7 @@ async def list_addresses(
                     "time": int(time.time())
                 }
 
-            data_call = json.dumps({"coin_name": coin_name, "api_id": get_api['id']})
+            data_call = json.dumps({"coin_name": coin_name, "api_id": get_api['id'], "tag_prefix": tag_prefix, "limit": limit, "after": after})
             # check if that API can use that coin
             if coin_name not in get_api['allowed_coin'].replace(" ","").split(","):
                 failed_result = {
@@ -2372,39 +4950,454 @@ async def list_addresses(
                     "message": f"Your API is limited to these coins: {get_api['allowed_coin']}! If you need, please request additional access.",
                     "time": int(time.time())
                 }
+                failed_body = dump_json(failed_result)
                 try:
-                    await insert_api_failed_log(get_api['id'], method_call, data_call, json.dumps(failed_result))
+                    await insert_api_failed_log(get_api['id'], method_call, data_call, failed_body)
                 except Exception:
                     traceback.print_exc(file=sys.stdout) 
-                return failed_result
+                return api_response(failed_body)
 
-            get_addresses = await get_addresses_coin_api(
-                coin_name, get_api['id']
+            return await list_addresses_result(
+                get_api, method_call, data_call, coin_name, tag_prefix, limit, after, format
             )
-            if len(get_addresses) == 0:
-                result_data = {
-                    "success": True,
-                    "data": [],
-                    "message": "no address.",
-                    "time": int(time.time())
-                }
-                await insert_api_log(get_api['id'], method_call, data_call, json.dumps(result_data))
-                return result_data
-            else:
-                result_data = {
-                    "success": True,
-                    "data": [{"coin_name": coin_name, "address": i['address'], "created": i['created_date'], "tag": i['tag']} for i in get_addresses],
-                    "message": None,
-                    "time": int(time.time())
-                }
-                await insert_api_log(get_api['id'], method_call, data_call, json.dumps(result_data))
-                return result_data
+
+class webhook_data(BaseModel):
+    url: str
+    events: Union[List[str], None] = None
+
+@app.post("/webhook")
+async def create_webhook(
+    request: Request, item: webhook_data, Authorization: Union[str, None] = Header(default=None)
+):
+    """
+    Subscribe an URL to events of your API. Each POST carries {"events": [...]} with headers
+    X-CoinAPI-Timestamp and X-CoinAPI-Signature: sha256=HMAC-SHA256(secret, timestamp + "." + body).
+
+    url: https URL receiving the events
+    events: any of deposit_pending, deposit_credited, withdraw_sent, transfer; default all
+    """
+    method_call = "/webhook"
+    if 'Authorization' not in request.headers:
+        return {
+            "success": False,
+            "data": None,
+            "message": "You need Authorization key in header!",
+            "time": int(time.time())
+        }
+    # get who own that key
+    get_api = await get_api_by_key(request.headers['Authorization'])
+    if get_api is None:
+        return {
+            "success": False,
+            "data": None,
+            "message": "Wrong API key!",
+            "time": int(time.time())
+        }
+    elif get_api['is_suspended'] != 0:
+        return {
+            "success": False,
+            "data": None,
+            "message": "We suspended your API key, please contact us!",
+            "time": int(time.time())
+        }
+
+    webhook_config = config.get('webhook', {})
+    events = item.events if item.events else WEBHOOK_EVENTS
+    failed_message = None
+    if webhook_config.get('enable', False) is not True:
+        failed_message = "webhooks are not enabled."
+    elif not item.url.startswith("https://") and not (webhook_config.get('allow_http', False) is True and item.url.startswith("http://")):
+        failed_message = "webhook url must be https."
+    elif len(item.url) > 512:
+        failed_message = "webhook url is too long."
+    elif webhook_config.get('allow_private', False) is not True and not await is_public_webhook_url(item.url):
+        failed_message = "webhook url must resolve to a public address."
+    elif any([i not in WEBHOOK_EVENTS for i in events]):
+        failed_message = "events must be within: {}.".format(", ".join(WEBHOOK_EVENTS))
+    elif len(await get_webhooks(get_api['id'])) >= webhook_config.get('max_per_api', 5):
+        failed_message = "you have reached the maximum of {} webhooks.".format(webhook_config.get('max_per_api', 5))
+    data_call = json.dumps({"url": item.url, "events": events})
+    if failed_message is not None:
+        failed_result = {
+            "success": False,
+            "data": None,
+            "message": failed_message,
+            "time": int(time.time())
+        }
+        failed_body = dump_json(failed_result)
+        try:
+            await insert_api_failed_log(get_api['id'], method_call, data_call, failed_body)
+        except Exception:
+            traceback.print_exc(file=sys.stdout) 
+        return api_response(failed_body)
+
+    secret = secrets.token_hex(32)
+    webhook_id = await insert_webhook(get_api['id'], item.url, secret, events)
+    if webhook_id is None:
+        return {
+            "success": False,
+            "data": None,
+            "message": "internal error during inserting to DB.",
+            "time": int(time.time())
+        }
+    result_data = {
+        "success": True,
+        "data": {"id": webhook_id, "url": item.url, "events": events, "secret": secret},
+        "message": "keep the secret, it is shown only once.",
+        "time": int(time.time())
+    }
+    # the secret is not logged
+    await insert_api_log(get_api['id'], method_call, data_call, json.dumps({"success": True, "data": webhook_id}))
+    return result_data
+
+@app.get("/webhooks")
+async def list_webhooks(
+    request: Request, Authorization: Union[str, None] = Header(default=None)
+):
+    """
+    Get list of your active webhooks
+    """
+    if 'Authorization' not in request.headers:
+        return {
+            "success": False,
+            "data": None,
+            "message": "You need Authorization key in header!",
+            "time": int(time.time())
+        }
+    # get who own that key
+    get_api = await get_api_by_key(request.headers['Authorization'])
+    if get_api is None:
+        return {
+            "success": False,
+            "data": None,
+            "message": "Wrong API key!",
+            "time": int(time.time())
+        }
+    elif get_api['is_suspended'] != 0:
+        return {
+            "success": False,
+            "data": None,
+            "message": "We suspended your API key, please contact us!",
+            "time": int(time.time())
+        }
+    return {
+        "success": True,
+        "data": [{"id": i['id'], "url": i['url'], "events": i['events'].split(","), "created": i['created']} for i in await get_webhooks(get_api['id'])],
+        "message": None,
+        "time": int(time.time())
+    }
+
+@app.delete("/webhook/{webhook_id}")
+async def delete_webhook(
+    request: Request, webhook_id: int, Authorization: Union[str, None] = Header(default=None)
+):
+    """
+    Remove a webhook, its undelivered events are dropped
+
+    webhook_id: id returned by POST /webhook
+    """
+    method_call = "/webhook/delete"
+    if 'Authorization' not in request.headers:
+        return {
+            "success": False,
+            "data": None,
+            "message": "You need Authorization key in header!",
+            "time": int(time.time())
+        }
+    # get who own that key
+    get_api = await get_api_by_key(request.headers['Authorization'])
+    if get_api is None:
+        return {
+            "success": False,
+            "data": None,
+            "message": "Wrong API key!",
+            "time": int(time.time())
+        }
+    elif get_api['is_suspended'] != 0:
+        return {
+            "success": False,
+            "data": None,
+            "message": "We suspended your API key, please contact us!",
+            "time": int(time.time())
+        }
+    data_call = json.dumps({"webhook_id": webhook_id})
+    if await disable_webhook(webhook_id, get_api['id']) is False:
+        failed_result = {
+            "success": False,
+            "data": None,
+            "message": "no such webhook {}.".format(webhook_id),
+            "time": int(time.time())
+        }
+        failed_body = dump_json(failed_result)
+        try:
+            await insert_api_failed_log(get_api['id'], method_call, data_call, failed_body)
+        except Exception:
+            traceback.print_exc(file=sys.stdout) 
+        return api_response(failed_body)
+    result_data = {
+        "success": True,
+        "data": webhook_id,
+        "message": "webhook {} removed.".format(webhook_id),
+        "time": int(time.time())
+    }
+    result_body = dump_json(result_data)
+    await insert_api_log(get_api['id'], method_call, data_call, result_body)
+    return api_response(result_body)
+
+def format_api_event(event: Dict):
+    # stored payload plus its id, without decoding it
+    return '{"id":' + str(event['id']) + ',' + event['payload'][1:]
+
+@app.get("/events")
+async def api_events(
+    request: Request, Authorization: Union[str, None] = Header(default=None),
+    cursor: Union[str, None] = None, mode: str = "sse", types: Union[str, None] = None, timeout: int = 25
+):
+    """
+    Follow events of your API: deposit_pending, deposit_credited, withdraw_sent, transfer
+
+    cursor: id of the last event you got (SSE also reads Last-Event-ID); default only new events
+    mode: sse (text/event-stream) or poll (waits up to timeout seconds for events, returns next_cursor)
+    types: comma separated event types, default all
+    timeout: for poll, 1 to 60 seconds
+    """
+    method_call = "/events"
+    if 'Authorization' not in request.headers:
+        return {
+            "success": False,
+            "data": None,
+            "message": "You need Authorization key in header!",
+            "time": int(time.time())
+        }
+    # get who own that key
+    get_api = await get_api_by_key(request.headers['Authorization'])
+    if get_api is None:
+        return {
+            "success": False,
+            "data": None,
+            "message": "Wrong API key!",
+            "time": int(time.time())
+        }
+    elif get_api['is_suspended'] != 0:
+        return {
+            "success": False,
+            "data": None,
+            "message": "We suspended your API key, please contact us!",
+            "time": int(time.time())
+        }
+
+    if cursor is None and mode == "sse":
+        cursor = request.headers.get('Last-Event-ID')
+    event_types = types.replace(" ", "").split(",") if types else None
+    after_id = None
+    if cursor is not None:
+        try:
+            after_id = int(cursor)
+        except ValueError:
+            pass
+    failed_message = None
+    if cursor is not None and after_id is None:
+        failed_message = "invalid cursor."
+    elif mode not in ["sse", "poll"]:
+        failed_message = "mode must be sse or poll."
+    elif event_types is not None and any([i not in WEBHOOK_EVENTS for i in event_types]):
+        failed_message = "types must be within: {}.".format(", ".join(WEBHOOK_EVENTS))
+    elif timeout < 1 or timeout > 60:
+        failed_message = "timeout must be between 1 and 60."
+    data_call = json.dumps({"cursor": cursor, "mode": mode, "types": types})
+    if failed_message is not None:
+        failed_result = {
+            "success": False,
+            "data": None,
+            "message": failed_message,
+            "time": int(time.time())
+        }
+        failed_body = dump_json(failed_result)
+        try:
+            await insert_api_failed_log(get_api['id'], method_call, data_call, failed_body)
+        except Exception:
+            traceback.print_exc(file=sys.stdout) 
+        return api_response(failed_body)
+    if after_id is None:
+        after_id = await get_last_api_event_id(get_api['id'])
+        if after_id is None:
+            return {
+                "success": False,
+                "data": None,
+                "message": "internal error.",
+                "time": int(time.time())
+            }
+
+    events_config = config.get('events', {})
+    # wake-ups come from this process or, with cache_events, from the others; recheck covers the rest
+    recheck = events_config.get('recheck', 5.0)
+    api_id = get_api['id']
+    if mode == "poll":
+        # clients poll continuously, only failures are logged
+        deadline = time.time() + timeout
+        async with api_event_waiter(api_id) as waiter:
+            while True:
+                waiter.clear()
+                events, pending = await get_api_events(api_id, after_id, event_types)
+                if len(events) > 0 or time.time() >= deadline:
+                    break
+                try:
+                    await asyncio.wait_for(waiter.wait(), min(1.0 if pending else recheck, deadline - time.time()))
+                except asyncio.TimeoutError:
+                    pass
+        next_cursor = events[-1]['id'] if len(events) > 0 else after_id
+        return api_response(
+            '{"success":true,"data":[' + ",".join([format_api_event(i) for i in events]) + '],"next_cursor":' + dump_json(str(next_cursor))
+            + ',"message":null,"time":' + str(int(time.time())) + '}'
+        )
+
+    async def stream_events():
+        nonlocal after_id
+        numb = 0
+        keepalive = events_config.get('keepalive', 15.0)
+        last_sent = time.time()
+        try:
+            async with api_event_waiter(api_id) as waiter:
+                while not await request.is_disconnected():
+                    waiter.clear()
+                    events, pending = await get_api_events(api_id, after_id, event_types)
+                    if len(events) > 0:
+                        yield "".join([
+                            "id: {}\nevent: {}\ndata: {}\n\n".format(i['id'], i['event_type'], format_api_event(i)) for i in events
+                        ])
+                        after_id = events[-1]['id']
+                        numb += len(events)
+                        last_sent = time.time()
+                        continue
+                    if time.time() - last_sent >= keepalive:
+                        yield ": keepalive\n\n"
+                        last_sent = time.time()
+                    try:
+                        await asyncio.wait_for(waiter.wait(), min(1.0 if pending else recheck, keepalive))
+                    except asyncio.TimeoutError:
+                        pass
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+        finally:
+            result_data = {"success": True, "data": None, "message": "streamed {} event(s).".format(numb), "time": int(time.time())}
+            try:
+                await insert_api_log(api_id, method_call, data_call, dump_json(result_data))
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
+    return StreamingResponse(
+        stream_events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/changes")
+async def list_changes(
+    request: Request, Authorization: Union[str, None] = Header(default=None),
+    cursor: Union[str, None] = None, limit: int = 500
+):
+    """
+    Get everything of your API that changed since a cursor: new addresses, deposits, credited deposits,
+    transfers (sent or received) and withdraws. Call again with next_cursor while has_more is true.
+
+    cursor: next_cursor of the previous call; none for a first full sync
+    (credits are kept [events] keep_days, deposits carry their credited state for older ones)
+    limit: rows per section, default 500
+    """
+    method_call = "/changes"
+    if 'Authorization' not in request.headers:
+        return {
+            "success": False,
+            "data": None,
+            "message": "You need Authorization key in header!",
+            "time": int(time.time())
+        }
+    # get who own that key
+    get_api = await get_api_by_key(request.headers['Authorization'])
+    if get_api is None:
+        return {
+            "success": False,
+            "data": None,
+            "message": "Wrong API key!",
+            "time": int(time.time())
+        }
+    elif get_api['is_suspended'] != 0:
+        return {
+            "success": False,
+            "data": None,
+            "message": "We suspended your API key, please contact us!",
+            "time": int(time.time())
+        }
+
+    after_ids = parse_changes_cursor(cursor) if cursor is not None else [(0, 0), 0, 0, 0, 0]
+    max_page_size = config['coinapi'].get('max_page_size', 1000)
+    failed_message = None
+    if after_ids is None:
+        failed_message = "invalid cursor."
+    elif limit < 1 or limit > max_page_size:
+        failed_message = "limit must be between 1 and {}.".format(max_page_size)
+    data_call = json.dumps({"cursor": cursor, "limit": limit})
+    if failed_message is not None:
+        failed_result = {
+            "success": False,
+            "data": None,
+            "message": failed_message,
+            "time": int(time.time())
+        }
+        failed_body = dump_json(failed_result)
+        try:
+            await insert_api_failed_log(get_api['id'], method_call, data_call, failed_body)
+        except Exception:
+            traceback.print_exc(file=sys.stdout) 
+        return api_response(failed_body)
+
+    changes = await get_changes(
+        get_api['id'], after_ids, limit, int(time.time()) - config['coinapi'].get('changes_settle', 2)
+    )
+    if changes is None:
+        return {
+            "success": False,
+            "data": None,
+            "message": "internal error.",
+            "time": int(time.time())
+        }
+    sections = ['addresses', 'deposits', 'credits', 'transfers', 'withdraws']
+    id_columns = ['id', 'id', 'id', 'tr_id', 'id']
+    next_ids = [
+        changes[section][-1][id_column] if len(changes[section]) > 0 else after_ids[i]
+        for i, (section, id_column) in enumerate(zip(sections, id_columns))
+    ]
+    if len(changes['addresses']) > 0:
+        next_ids[0] = (changes['addresses'][-1]['created_date'], changes['addresses'][-1]['id'])
+    result_data = {
+        "success": True,
+        "data": {
+            "addresses": [{
+                "coin_name": i['coin_name'], "address": i['address'], "tag": i['tag'], "created": i['created_date']
+            } for i in changes['addresses']],
+            "deposits": [{
+                "deposit_id": i['id'], "coin_name": i['coin_name'], "txid": i['txid'], "address": i['address'],
+                "amount": i['amount'], "height": i['height'], "time": i['time_insert'], "credited": i['can_credit'] == "YES"
+            } for i in changes['deposits']],
+            "credits": [orjson.loads(i['payload'])['data'] for i in changes['credits']],
+            "transfers": [format_transfer(get_api['id'], i) for i in changes['transfers']],
+            "withdraws": [format_withdraw(i) for i in changes['withdraws']]
+        },
+        "next_cursor": "-".join(["{}.{}".format(*next_ids[0])] + [str(i) for i in next_ids[1:]]),
+        "has_more": any([len(changes[i]) == limit for i in sections]),
+        "message": None,
+        "time": int(time.time())
+    }
+    result_body = dump_json(result_data)
+    await insert_api_log(get_api['id'], method_call, data_call, result_body)
+    return api_response(result_body)
 
 if __name__ == "__main__":
+    # several workers need an import string; pair them with leader_election and redis_lock
+    workers = config['coinapi'].get('api_workers', 1)
     uvicorn.run(
-        app,
+        "coinapi:app" if workers > 1 else app,
         host=config['coinapi']['api_bind'],
         headers=[("server", config['coinapi']['api_name'])],
         port=config['coinapi']['api_port'],
+        workers=workers,
         access_log=False
     )
@@ -5,6 +5,19 @@ SET sql_mode = 'NO_AUTO_VALUE_ON_ZERO';
 
 SET NAMES utf8mb4;
 
+DROP TABLE IF EXISTS `api_events`;
+CREATE TABLE `api_events` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `api_id` int(11) NOT NULL,
+  `event_type` varchar(32) NOT NULL,
+  `payload` text NOT NULL,
+  `created` int(11) NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `api_id_id` (`api_id`,`id`),
+  KEY `created` (`created`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+
 DROP TABLE IF EXISTS `api_logs`;
 CREATE TABLE `api_logs` (
   `log_id` int(11) NOT NULL AUTO_INCREMENT,
@@ -70,13 +83,29 @@ CREATE TABLE `api_users` (
   `is_suspended` tinyint(4) NOT NULL DEFAULT 0,
   `remark` text DEFAULT NULL,
   `created` int(11) NOT NULL,
+  `api_key_hash` binary(32) AS (unhex(sha2(`api_key`,256))) STORED,
   PRIMARY KEY (`id`),
+  UNIQUE KEY `api_key_hash` (`api_key_hash`),
   KEY `email` (`email`(768)),
   KEY `api_key` (`api_key`(768)),
   KEY `is_suspended` (`is_suspended`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
 
 
+DROP TABLE IF EXISTS `api_webhooks`;
+CREATE TABLE `api_webhooks` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `api_id` int(11) NOT NULL,
+  `url` varchar(512) NOT NULL,
+  `secret` varchar(128) NOT NULL,
+  `events` varchar(256) NOT NULL,
+  `is_active` tinyint(4) NOT NULL DEFAULT 1,
+  `created` int(11) NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `api_id_is_active` (`api_id`,`is_active`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+
 DROP TABLE IF EXISTS `coin_settings`;
 CREATE TABLE `coin_settings` (
   `coin_id` int(11) NOT NULL AUTO_INCREMENT,
@@ -107,6 +136,8 @@ CREATE TABLE `coin_settings` (
   `enable_withdraw` tinyint(4) NOT NULL DEFAULT 1,
   `enbale_transfer` tinyint(4) NOT NULL DEFAULT 1,
   `enable_create` tinyint(4) NOT NULL DEFAULT 1,
+  `withdraw_batch_window` int(11) NOT NULL DEFAULT 0,
+  `withdraw_batch_max` int(11) NOT NULL DEFAULT 16,
   PRIMARY KEY (`coin_id`),
   KEY `enable` (`enable`),
   KEY `coin_name` (`coin_name`),
@@ -133,13 +164,17 @@ CREATE TABLE `deposits` (
   `confirmations` int(11) DEFAULT NULL,
   `already_noted` tinyint(1) NOT NULL DEFAULT 0,
   `noted_time` int(11) DEFAULT NULL,
+  `address_hash` binary(16) AS (unhex(md5(`address`))) STORED,
   PRIMARY KEY (`id`),
   UNIQUE KEY `txid_address` (`txid`,`address`),
   KEY `coin_name` (`coin_name`),
   KEY `api_id` (`api_id`),
   KEY `address` (`address`),
   KEY `time_insert` (`time_insert`),
-  KEY `txid` (`txid`)
+  KEY `txid` (`txid`),
+  KEY `api_id_coin_name_time` (`api_id`,`coin_name`,`time_insert`,`id`),
+  KEY `api_id_coin_name_address_time` (`api_id`,`coin_name`,`address_hash`,`time_insert`,`id`),
+  KEY `can_credit` (`can_credit`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
 
 
@@ -150,7 +185,7 @@ BEGIN
   IF (OLD.can_credit<> NEW.can_credit AND NEW.can_credit="YES" AND NEW.amount>0) THEN
     UPDATE `deposit_addresses`
     SET `total_deposited`=`total_deposited`+NEW.amount, `numb_deposit`=`numb_deposit`+1
-    WHERE `api_id`=NEW.api_id AND `coin_name`=NEW.coin_name AND (`address`=NEW.address OR (`address_extra`=NEW.extra AND NEW.extra IS NOT NULL)) LIMIT 1;
+    WHERE `id`=NEW.depost_id LIMIT 1;
   END IF;
 END;;
 
@@ -175,10 +210,19 @@ CREATE TABLE `deposit_addresses` (
   `numb_sent` int(11) NOT NULL DEFAULT 0,
   `total_withdrew` float NOT NULL DEFAULT 0,
   `numb_withdrew` int(11) NOT NULL DEFAULT 0,
+  `total_reserved` decimal(36,18) NOT NULL DEFAULT 0,
+  `address_hash` binary(16) AS (unhex(md5(`address`))) STORED,
+  `tag_hash` binary(16) AS (unhex(md5(lower(`tag`)))) STORED,
   PRIMARY KEY (`id`),
   UNIQUE KEY `api_id_coin_name_tag` (`api_id`,`coin_name`,`tag`) USING HASH,
   KEY `api_id` (`api_id`),
+  KEY `api_id_coin_name` (`api_id`,`coin_name`),
+  KEY `api_id_coin_name_address` (`api_id`,`coin_name`,`address_hash`),
+  KEY `api_id_coin_name_tag_hash` (`api_id`,`coin_name`,`tag_hash`),
+  KEY `api_id_created_date_id` (`api_id`,`created_date`,`id`),
+  KEY `address_extra_coin_name` (`address_extra`,`coin_name`),
   KEY `coin_name` (`coin_name`),
+  KEY `coin_name_address` (`coin_name`,`address_hash`),
   KEY `tag` (`tag`(768)),
   KEY `second_tag` (`second_tag`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
@@ -188,6 +232,7 @@ DROP TABLE IF EXISTS `transfer_records`;
 CREATE TABLE `transfer_records` (
   `tr_id` bigint(20) NOT NULL AUTO_INCREMENT,
   `api_id` int(11) NOT NULL,
+  `to_api_id` int(11) DEFAULT NULL,
   `from_address` varchar(256) NOT NULL,
   `to_address` varchar(256) NOT NULL,
   `amount` float NOT NULL,
@@ -197,6 +242,10 @@ CREATE TABLE `transfer_records` (
   `ref_uuid` varchar(128) NOT NULL,
   PRIMARY KEY (`tr_id`),
   KEY `api_id` (`api_id`),
+  KEY `to_api_id` (`to_api_id`),
+  KEY `api_id_coin_name_tr_id` (`api_id`,`coin_name`,`tr_id`),
+  KEY `to_api_id_coin_name_tr_id` (`to_api_id`,`coin_name`,`tr_id`),
+  KEY `ref_uuid` (`ref_uuid`),
   KEY `from_dep_id` (`from_address`),
   KEY `to_dep_id` (`to_address`),
   KEY `coin_name` (`coin_name`),
@@ -204,20 +253,53 @@ CREATE TABLE `transfer_records` (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
 
 
-DELIMITER ;;
+DROP TABLE IF EXISTS `webhook_outbox`;
+CREATE TABLE `webhook_outbox` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `webhook_id` int(11) NOT NULL,
+  `api_id` int(11) NOT NULL,
+  `event_type` varchar(32) NOT NULL,
+  `payload` text NOT NULL,
+  `status` enum('PENDING','SENT','FAILED') NOT NULL DEFAULT 'PENDING',
+  `attempts` int(11) NOT NULL DEFAULT 0,
+  `next_attempt` int(11) NOT NULL,
+  `last_error` varchar(512) DEFAULT NULL,
+  `created` int(11) NOT NULL,
+  `sent_time` int(11) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `status_next_attempt` (`status`,`next_attempt`),
+  KEY `webhook_id` (`webhook_id`),
+  KEY `webhook_id_status_next_attempt` (`webhook_id`,`status`,`next_attempt`,`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
 
-CREATE TRIGGER `transfer_records_to_deposit` AFTER INSERT ON `transfer_records` FOR EACH ROW
-BEGIN
-  UPDATE `deposit_addresses`
-  SET `total_received`=`total_received`+NEW.amount, `numb_received`=`numb_received`+1
-  WHERE `address`=NEW.to_address AND `coin_name`=NEW.coin_name LIMIT 1;
 
-  UPDATE `deposit_addresses`
-  SET `total_sent`=`total_sent`+NEW.amount, `numb_sent`=`numb_sent`+1
-  WHERE `address`=NEW.from_address AND `coin_name`=NEW.coin_name LIMIT 1;
-END;;
+DROP TABLE IF EXISTS `withdraw_jobs`;
+CREATE TABLE `withdraw_jobs` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `job_id` varchar(64) NOT NULL,
+  `api_id` int(11) NOT NULL,
+  `coin_name` varchar(32) NOT NULL,
+  `from_address` varchar(256) NOT NULL,
+  `from_deposit_id` int(11) NOT NULL,
+  `to_address` varchar(256) NOT NULL,
+  `amount` decimal(36,18) NOT NULL,
+  `fee_and_tax` decimal(36,18) NOT NULL DEFAULT 0,
+  `remark` text DEFAULT NULL,
+  `status` enum('PENDING','SENDING','SENT','FAILED') NOT NULL DEFAULT 'PENDING',
+  `txid` varchar(256) DEFAULT NULL,
+  `ref_uuid` varchar(128) DEFAULT NULL,
+  `message` text DEFAULT NULL,
+  `batch_id` varchar(64) DEFAULT NULL,
+  `created` int(11) NOT NULL,
+  `updated` int(11) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `job_id` (`job_id`),
+  KEY `api_id` (`api_id`),
+  KEY `status_created` (`status`,`created`),
+  KEY `coin_name_status` (`coin_name`,`status`),
+  KEY `batch_id` (`batch_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
 
-DELIMITER ;
 
 DROP TABLE IF EXISTS `withdraws`;
 CREATE TABLE `withdraws` (
@@ -237,7 +319,10 @@ CREATE TABLE `withdraws` (
   `ref_uuid` varchar(128) NOT NULL,
   PRIMARY KEY (`id`),
   KEY `api_id` (`api_id`),
-  KEY `coin_name` (`coin_name`)
+  KEY `coin_name` (`coin_name`),
+  KEY `api_id_coin_name_id` (`api_id`,`coin_name`,`id`),
+  KEY `api_id_coin_name_from_address` (`api_id`,`coin_name`,`from_address`,`id`),
+  KEY `ref_uuid` (`ref_uuid`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
 
 
@@ -247,7 +332,7 @@ CREATE TRIGGER `withdraws_to_deposits` AFTER INSERT ON `withdraws` FOR EACH ROW
 BEGIN
   UPDATE `deposit_addresses`
   SET `total_withdrew`=`total_withdrew`+NEW.amount+NEW.fee_and_tax, `numb_withdrew`=`numb_withdrew`+1
-  WHERE `api_id`=NEW.api_id AND `coin_name`=NEW.coin_name AND `address`=NEW.from_address LIMIT 1;
+  WHERE `id`=NEW.from_deposit_id LIMIT 1;
 END;;
 
 DELIMITER ;
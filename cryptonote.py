@@ -0,0 +1,152 @@
+import os
+from functools import lru_cache
+
+# CryptoNote address encoding (Monero-style base58 with Keccak-256 checksum),
+# used to build integrated addresses without a wallet-rpc round trip.
+
+ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+FULL_BLOCK_SIZE = 8
+FULL_ENCODED_BLOCK_SIZE = 11
+ENCODED_BLOCK_SIZES = [0, 2, 3, 5, 6, 7, 9, 10, 11]
+CHECKSUM_SIZE = 4
+
+KECCAK_ROUND_CONSTANTS = [
+    0x0000000000000001, 0x0000000000008082, 0x800000000000808A, 0x8000000080008000,
+    0x000000000000808B, 0x0000000080000001, 0x8000000080008081, 0x8000000000008009,
+    0x000000000000008A, 0x0000000000000088, 0x0000000080008009, 0x000000008000000A,
+    0x000000008000808B, 0x800000000000008B, 0x8000000000008089, 0x8000000000008003,
+    0x8000000000008002, 0x8000000000000080, 0x000000000000800A, 0x800000008000000A,
+    0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008
+]
+KECCAK_ROTATIONS = [
+    [0, 36, 3, 41, 18],
+    [1, 44, 10, 45, 2],
+    [62, 6, 43, 15, 61],
+    [28, 55, 25, 21, 56],
+    [27, 20, 39, 8, 14]
+]
+MASK_64 = (1 << 64) - 1
+# rho and pi steps on a flat state (lane x + 5 * y): (source lane, destination lane, rotation)
+KECCAK_RHO_PI = [
+    (x + 5 * y, y + 5 * ((2 * x + 3 * y) % 5), KECCAK_ROTATIONS[x][y]) for x in range(5) for y in range(5)
+]
+
+
+def keccak_f(state):
+    for round_constant in KECCAK_ROUND_CONSTANTS:
+        c = [state[x] ^ state[x + 5] ^ state[x + 10] ^ state[x + 15] ^ state[x + 20] for x in range(5)]
+        for x in range(5):
+            rot = c[(x + 1) % 5]
+            d = c[(x - 1) % 5] ^ (((rot << 1) | (rot >> 63)) & MASK_64)
+            for y in range(0, 25, 5):
+                state[x + y] ^= d
+        b = [0] * 25
+        for (src, dst, shift) in KECCAK_RHO_PI:
+            lane = state[src]
+            b[dst] = ((lane << shift) | (lane >> (64 - shift))) & MASK_64 if shift else lane
+        for y in range(0, 25, 5):
+            b0, b1, b2, b3, b4 = b[y:y + 5]
+            state[y] = b0 ^ (~b1 & b2)
+            state[y + 1] = b1 ^ (~b2 & b3)
+            state[y + 2] = b2 ^ (~b3 & b4)
+            state[y + 3] = b3 ^ (~b4 & b0)
+            state[y + 4] = b4 ^ (~b0 & b1)
+        state[0] ^= round_constant
+
+
+def keccak_256(data: bytes):
+    # original Keccak padding (0x01), as used by CryptoNote; not hashlib.sha3_256
+    rate = 136
+    padded = bytearray(data)
+    padded.append(0x01)
+    while len(padded) % rate != 0:
+        padded.append(0x00)
+    padded[-1] |= 0x80
+    state = [0] * 25
+    for offset in range(0, len(padded), rate):
+        for i in range(rate // 8):
+            state[i] ^= int.from_bytes(padded[offset + i * 8:offset + i * 8 + 8], "little")
+        keccak_f(state)
+    return b"".join(state[i].to_bytes(8, "little") for i in range(4))
+
+
+def encode_varint(value: int):
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def decode_varint(data: bytes):
+    # returns (value, bytes used)
+    value = 0
+    for i, byte in enumerate(data):
+        value |= (byte & 0x7f) << (7 * i)
+        if byte & 0x80 == 0:
+            return value, i + 1
+    raise ValueError("invalid varint")
+
+
+def b58encode(data: bytes):
+    encoded = []
+    for offset in range(0, len(data), FULL_BLOCK_SIZE):
+        block = data[offset:offset + FULL_BLOCK_SIZE]
+        number = int.from_bytes(block, "big")
+        chars = []
+        while number > 0:
+            number, remainder = divmod(number, 58)
+            chars.append(ALPHABET[remainder])
+        size = ENCODED_BLOCK_SIZES[len(block)]
+        encoded.append("".join(reversed(chars)).rjust(size, ALPHABET[0]))
+    return "".join(encoded)
+
+
+def b58decode(text: str):
+    decoded = bytearray()
+    for offset in range(0, len(text), FULL_ENCODED_BLOCK_SIZE):
+        block = text[offset:offset + FULL_ENCODED_BLOCK_SIZE]
+        if len(block) not in ENCODED_BLOCK_SIZES:
+            raise ValueError("invalid base58 block size")
+        size = ENCODED_BLOCK_SIZES.index(len(block))
+        number = 0
+        for char in block:
+            number = number * 58 + ALPHABET.index(char)
+        if number >= 1 << (8 * size):
+            raise ValueError("base58 block overflow")
+        decoded += number.to_bytes(size, "big")
+    return bytes(decoded)
+
+
+@lru_cache(maxsize=64)
+def decode_address(address: str):
+    # returns (prefix, public_spend_key, public_view_key, payment_id or None)
+    data = b58decode(address)
+    body, checksum = data[:-CHECKSUM_SIZE], data[-CHECKSUM_SIZE:]
+    if keccak_256(body)[:CHECKSUM_SIZE] != checksum:
+        raise ValueError("invalid address checksum")
+    prefix, used = decode_varint(body)
+    keys = body[used:]
+    if len(keys) not in [64, 72]:
+        raise ValueError("invalid address length")
+    return prefix, keys[0:32], keys[32:64], keys[64:] if len(keys) == 72 else None
+
+
+def encode_address(prefix: int, keys: bytes):
+    body = encode_varint(prefix) + keys
+    return b58encode(body + keccak_256(body)[:CHECKSUM_SIZE])
+
+
+def make_integrated_address(main_address: str, integrated_prefix: int, payment_id: str = None):
+    # returns {"integrated_address", "payment_id"} like wallet-rpc make_integrated_address
+    if payment_id is None:
+        payment_id = os.urandom(8).hex()
+    payment_id_bytes = bytes.fromhex(payment_id)
+    if len(payment_id_bytes) != 8:
+        raise ValueError("payment id must be 8 bytes")
+    _, spend_key, view_key, _ = decode_address(main_address)
+    return {
+        "integrated_address": encode_address(integrated_prefix, spend_key + view_key + payment_id_bytes),
+        "payment_id": payment_id
+    }
@@ -0,0 +1,176 @@
+import math
+import threading
+import time
+
+# Minimal Prometheus text exposition (format 0.0.4) for coinapi, no client library needed.
+# Metrics are per process: with api_workers > 1 or scanner.py, every process keeps its own
+# values, and the gauges of a loop only move in the process that runs it.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=None) -> str:
+    pairs = ['{}="{}"'.format(n, escape_label(v)) for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append('{}="{}"'.format(extra[0], extra[1]))
+    return "{" + ",".join(pairs) + "}" if len(pairs) > 0 else ""
+
+
+def format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labels=()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        if len(self.label_names) == 0 and self.kind in ["counter", "gauge"]:
+            # an unlabelled series is exported as 0 before its first update
+            self.values[()] = 0.0
+
+    def key(self, labels) -> tuple:
+        if len(labels) != len(self.label_names):
+            raise ValueError("{} takes labels {}".format(self.name, self.label_names))
+        return tuple(str(i) for i in labels)
+
+    def samples(self):
+        # (suffix, label values, extra label or None, value)
+        with self.lock:
+            return [("", k, None, v) for k, v in self.values.items()]
+
+    def render(self) -> list:
+        lines = ["# HELP {} {}".format(self.name, self.doc), "# TYPE {} {}".format(self.name, self.kind)]
+        for (suffix, labels, extra, value) in self.samples():
+            lines.append("{}{}{} {}".format(
+                self.name, suffix, format_labels(self.label_names, labels, extra), format_value(value)
+            ))
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float=1.0):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, labels=(), collect=None):
+        # collect: optional callable returning {label values tuple: value}, read at scrape time
+        super().__init__(name, doc, labels)
+        self.collect = collect
+
+    def set(self, *labels, value: float):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = float(value)
+
+    def inc(self, *labels, amount: float=1.0):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, *labels, amount: float=1.0):
+        self.inc(*labels, amount=-amount)
+
+    def samples(self):
+        if self.collect is not None:
+            try:
+                return [("", self.key(k), None, float(v)) for k, v in self.collect().items()]
+            except Exception:
+                return []
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, *labels, value: float):
+        key = self.key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # [bucket counts (not cumulative), sum]
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+
+    def samples(self):
+        out = []
+        with self.lock:
+            items = [(k, list(v[0]), v[1]) for k, v in self.values.items()]
+        for (labels, counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                out.append(("_bucket", labels, ("le", format_value(float(bound))), cumulative))
+            out.append(("_sum", labels, None, total))
+            out.append(("_count", labels, None, cumulative))
+        return out
+
+
+class Timer:
+    # with Timer(histogram, "a", "b"): ... observes the elapsed seconds
+    def __init__(self, histogram: Histogram, *labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(*self.labels, value=time.perf_counter() - self.start)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, doc: str, labels=()):
+        return self.register(Counter(name, doc, labels))
+
+    def gauge(self, name: str, doc: str, labels=(), collect=None):
+        return self.register(Gauge(name, doc, labels, collect))
+
+    def histogram(self, name: str, doc: str, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, doc, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,7 @@
+-- /transfer applies per-address net totals itself, inside the same transaction
+-- that inserts transfer_records, so the per-row trigger must go.
+-- The (coin_name, address) key keeps the FOR UPDATE lock on the involved rows only.
+
+ALTER TABLE `deposit_addresses` ADD KEY IF NOT EXISTS `coin_name_address` (`coin_name`,`address`);
+
+DROP TRIGGER IF EXISTS `transfer_records_to_deposit`;
@@ -0,0 +1,26 @@
+-- Queued withdraws (/withdraw with background=true) and the balance they reserve.
+
+ALTER TABLE `deposit_addresses` ADD COLUMN IF NOT EXISTS `total_reserved` float NOT NULL DEFAULT 0 AFTER `numb_withdrew`;
+
+CREATE TABLE IF NOT EXISTS `withdraw_jobs` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `job_id` varchar(64) NOT NULL,
+  `api_id` int(11) NOT NULL,
+  `coin_name` varchar(32) NOT NULL,
+  `from_address` varchar(256) NOT NULL,
+  `from_deposit_id` int(11) NOT NULL,
+  `to_address` varchar(256) NOT NULL,
+  `amount` float NOT NULL,
+  `fee_and_tax` float NOT NULL DEFAULT 0,
+  `remark` text DEFAULT NULL,
+  `status` enum('PENDING','SENDING','SENT','FAILED') NOT NULL DEFAULT 'PENDING',
+  `txid` varchar(256) DEFAULT NULL,
+  `ref_uuid` varchar(128) DEFAULT NULL,
+  `message` text DEFAULT NULL,
+  `created` int(11) NOT NULL,
+  `updated` int(11) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `job_id` (`job_id`),
+  KEY `api_id` (`api_id`),
+  KEY `status_created` (`status`,`created`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
@@ -0,0 +1,9 @@
+-- Per-coin batching of queued withdraws into one multi-destination transaction.
+-- withdraw_batch_window: seconds between batches, 0 keeps one transaction per withdraw.
+
+ALTER TABLE `coin_settings` ADD COLUMN IF NOT EXISTS `withdraw_batch_window` int(11) NOT NULL DEFAULT 0;
+ALTER TABLE `coin_settings` ADD COLUMN IF NOT EXISTS `withdraw_batch_max` int(11) NOT NULL DEFAULT 16;
+
+ALTER TABLE `withdraw_jobs` ADD COLUMN IF NOT EXISTS `batch_id` varchar(64) DEFAULT NULL AFTER `message`;
+ALTER TABLE `withdraw_jobs` ADD KEY IF NOT EXISTS `coin_name_status` (`coin_name`,`status`);
+ALTER TABLE `withdraw_jobs` ADD KEY IF NOT EXISTS `batch_id` (`batch_id`);
@@ -0,0 +1,4 @@
+-- Unassigned pool addresses are deposit_addresses rows with api_id=0;
+-- /newaddress claims the lowest id per coin.
+
+ALTER TABLE `deposit_addresses` ADD KEY IF NOT EXISTS `api_id_coin_name` (`api_id`,`coin_name`);
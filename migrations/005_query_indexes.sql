@@ -0,0 +1,46 @@
+-- Composite indexes matched to the hot queries, and fixed-length hash columns
+-- so long addresses, tags and api keys are looked up by 16/32-byte keys.
+-- Queries compare the hash and the full value, so a hash collision cannot match a wrong row.
+
+ALTER TABLE `api_users`
+  ADD COLUMN IF NOT EXISTS `api_key_hash` binary(32) AS (unhex(sha2(`api_key`,256))) STORED,
+  ADD UNIQUE KEY IF NOT EXISTS `api_key_hash` (`api_key_hash`);
+
+ALTER TABLE `deposits`
+  ADD COLUMN IF NOT EXISTS `address_hash` binary(16) AS (unhex(md5(`address`))) STORED,
+  ADD KEY IF NOT EXISTS `api_id_coin_name_time` (`api_id`,`coin_name`,`time_insert`,`id`),
+  ADD KEY IF NOT EXISTS `api_id_coin_name_address_time` (`api_id`,`coin_name`,`address_hash`,`time_insert`,`id`),
+  ADD KEY IF NOT EXISTS `can_credit` (`can_credit`);
+
+ALTER TABLE `deposit_addresses`
+  ADD COLUMN IF NOT EXISTS `address_hash` binary(16) AS (unhex(md5(`address`))) STORED,
+  ADD COLUMN IF NOT EXISTS `tag_hash` binary(16) AS (unhex(md5(`tag`))) STORED,
+  ADD KEY IF NOT EXISTS `api_id_coin_name_address` (`api_id`,`coin_name`,`address_hash`),
+  ADD KEY IF NOT EXISTS `api_id_coin_name_tag_hash` (`api_id`,`coin_name`,`tag_hash`),
+  ADD KEY IF NOT EXISTS `address_extra_coin_name` (`address_extra`,`coin_name`),
+  DROP KEY IF EXISTS `coin_name_address`,
+  ADD KEY `coin_name_address` (`coin_name`,`address_hash`);
+
+-- balance triggers update the address row by primary key instead of searching by address
+DROP TRIGGER IF EXISTS `deposits_to_address`;
+DROP TRIGGER IF EXISTS `withdraws_to_deposits`;
+
+DELIMITER ;;
+
+CREATE TRIGGER `deposits_to_address` AFTER UPDATE ON `deposits` FOR EACH ROW
+BEGIN
+  IF (OLD.can_credit<> NEW.can_credit AND NEW.can_credit="YES" AND NEW.amount>0) THEN
+    UPDATE `deposit_addresses`
+    SET `total_deposited`=`total_deposited`+NEW.amount, `numb_deposit`=`numb_deposit`+1
+    WHERE `id`=NEW.depost_id LIMIT 1;
+  END IF;
+END;;
+
+CREATE TRIGGER `withdraws_to_deposits` AFTER INSERT ON `withdraws` FOR EACH ROW
+BEGIN
+  UPDATE `deposit_addresses`
+  SET `total_withdrew`=`total_withdrew`+NEW.amount+NEW.fee_and_tax, `numb_withdrew`=`numb_withdrew`+1
+  WHERE `id`=NEW.from_deposit_id LIMIT 1;
+END;;
+
+DELIMITER ;
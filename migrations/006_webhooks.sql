@@ -0,0 +1,30 @@
+-- Per-API webhook subscriptions and the outbox their deliveries are sent from.
+
+CREATE TABLE IF NOT EXISTS `api_webhooks` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `api_id` int(11) NOT NULL,
+  `url` varchar(512) NOT NULL,
+  `secret` varchar(128) NOT NULL,
+  `events` varchar(256) NOT NULL,
+  `is_active` tinyint(4) NOT NULL DEFAULT 1,
+  `created` int(11) NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `api_id_is_active` (`api_id`,`is_active`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+CREATE TABLE IF NOT EXISTS `webhook_outbox` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `webhook_id` int(11) NOT NULL,
+  `api_id` int(11) NOT NULL,
+  `event_type` varchar(32) NOT NULL,
+  `payload` text NOT NULL,
+  `status` enum('PENDING','SENT','FAILED') NOT NULL DEFAULT 'PENDING',
+  `attempts` int(11) NOT NULL DEFAULT 0,
+  `next_attempt` int(11) NOT NULL,
+  `last_error` varchar(512) DEFAULT NULL,
+  `created` int(11) NOT NULL,
+  `sent_time` int(11) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `status_next_attempt` (`status`,`next_attempt`),
+  KEY `webhook_id` (`webhook_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
@@ -0,0 +1,12 @@
+-- Per-API event log read by GET /events (deposits, credits, withdraws, transfers), kept [events] keep_days.
+
+CREATE TABLE IF NOT EXISTS `api_events` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `api_id` int(11) NOT NULL,
+  `event_type` varchar(32) NOT NULL,
+  `payload` text NOT NULL,
+  `created` int(11) NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `api_id_id` (`api_id`,`id`),
+  KEY `created` (`created`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
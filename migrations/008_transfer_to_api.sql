@@ -0,0 +1,12 @@
+-- Receiving api of internal transfers, so /changes finds transfers received from another api by index.
+
+ALTER TABLE `transfer_records`
+  ADD COLUMN IF NOT EXISTS `to_api_id` int(11) DEFAULT NULL AFTER `api_id`,
+  ADD KEY IF NOT EXISTS `to_api_id` (`to_api_id`);
+
+UPDATE `transfer_records`
+INNER JOIN `deposit_addresses` ON `deposit_addresses`.`coin_name`=`transfer_records`.`coin_name`
+  AND `deposit_addresses`.`address_hash`=UNHEX(MD5(`transfer_records`.`to_address`))
+  AND `deposit_addresses`.`address`=`transfer_records`.`to_address`
+SET `transfer_records`.`to_api_id`=`deposit_addresses`.`api_id`
+WHERE `transfer_records`.`to_api_id` IS NULL;
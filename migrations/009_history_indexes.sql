@@ -0,0 +1,11 @@
+-- Keyset indexes for /list_transfers and /list_withdraws (newest first per api and coin).
+
+ALTER TABLE `transfer_records`
+  ADD KEY IF NOT EXISTS `api_id_coin_name_tr_id` (`api_id`,`coin_name`,`tr_id`),
+  ADD KEY IF NOT EXISTS `to_api_id_coin_name_tr_id` (`to_api_id`,`coin_name`,`tr_id`),
+  ADD KEY IF NOT EXISTS `ref_uuid` (`ref_uuid`);
+
+ALTER TABLE `withdraws`
+  ADD KEY IF NOT EXISTS `api_id_coin_name_id` (`api_id`,`coin_name`,`id`),
+  ADD KEY IF NOT EXISTS `api_id_coin_name_from_address` (`api_id`,`coin_name`,`from_address`,`id`),
+  ADD KEY IF NOT EXISTS `ref_uuid` (`ref_uuid`);
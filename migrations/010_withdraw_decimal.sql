@@ -0,0 +1,16 @@
+-- Queued withdraw amounts and the balance they reserve as exact decimals: a FLOAT column rounds
+-- 1234.5678 to 1234.57, so the worker sent a different amount and left a residue in total_reserved.
+-- Run with coinapi and the scanners stopped.
+
+ALTER TABLE `withdraw_jobs`
+  MODIFY `amount` decimal(36,18) NOT NULL,
+  MODIFY `fee_and_tax` decimal(36,18) NOT NULL DEFAULT 0;
+
+ALTER TABLE `deposit_addresses`
+  MODIFY `total_reserved` decimal(36,18) NOT NULL DEFAULT 0;
+
+-- drop the residue left by earlier jobs: with nothing running, only queued jobs hold a reservation
+UPDATE `deposit_addresses` SET `total_reserved`=(
+  SELECT COALESCE(SUM(`amount`+`fee_and_tax`), 0) FROM `withdraw_jobs`
+  WHERE `from_deposit_id`=`deposit_addresses`.`id` AND `status` IN ('PENDING', 'SENDING')
+) WHERE `total_reserved`<>0;
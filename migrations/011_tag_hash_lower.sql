@@ -0,0 +1,5 @@
+-- Tags are unique case-insensitively (utf8mb4_general_ci), so the lookup hash is taken over LOWER(tag):
+-- with MD5(tag) a request for "Bob" missed an existing "bob" and then hit the unique key on insert.
+
+ALTER TABLE `deposit_addresses`
+  MODIFY `tag_hash` binary(16) AS (unhex(md5(lower(`tag`)))) STORED;
@@ -0,0 +1,5 @@
+-- /changes walks addresses by (created_date, id): a claimed pool address keeps its old id but gets a new
+-- created_date, so an id keyset never reported it.
+
+ALTER TABLE `deposit_addresses`
+  ADD KEY IF NOT EXISTS `api_id_created_date_id` (`api_id`,`created_date`,`id`);
@@ -0,0 +1,4 @@
+-- Webhook delivery reads due events per webhook (webhook_id, PENDING, next_attempt <= now, oldest first).
+
+ALTER TABLE `webhook_outbox`
+  ADD KEY IF NOT EXISTS `webhook_id_status_next_attempt` (`webhook_id`,`status`,`next_attempt`,`id`);
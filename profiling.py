@@ -0,0 +1,103 @@
+import cProfile
+import marshal
+import os
+import sys
+import time
+import tracemalloc
+
+# In-process profiling for the admin endpoints of coinapi.py, standard library only.
+# The sampler reads the stack of one thread (the event loop) from a helper thread, so the
+# profiled code runs unmodified; cProfile instead hooks every call of the loop thread.
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return "{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), frame.f_lineno)
+
+
+def sample_stacks(thread_id: int, seconds: float, interval: float = 0.01) -> dict:
+    # {"root;...;leaf": samples}, blocks the calling thread for seconds
+    stacks = {}
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        frame = sys._current_frames().get(thread_id)
+        names = []
+        while frame is not None:
+            names.append(frame_name(frame))
+            frame = frame.f_back
+        if len(names) > 0:
+            key = ";".join(reversed(names))
+            stacks[key] = stacks.get(key, 0) + 1
+        time.sleep(interval)
+    return stacks
+
+
+def collapsed(stacks: dict) -> str:
+    # Brendan Gregg's folded format, for flamegraph.pl or speedscope
+    return "".join(["{} {}\n".format(k, v) for k, v in sorted(stacks.items(), key=lambda i: -i[1])])
+
+
+def start_cprofile() -> cProfile.Profile:
+    # profiles the calling thread only, i.e. the event loop when called from a coroutine
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def pstats_dump(profiler: cProfile.Profile) -> bytes:
+    # same bytes as Profile.dump_stats(), load with pstats.Stats(path)
+    profiler.disable()
+    profiler.create_stats()
+    return marshal.dumps(profiler.stats)
+
+
+class MemoryTracker:
+    # tracemalloc snapshots, each diffed against the previous one
+    def __init__(self):
+        self.snapshot = None
+        self.taken = None
+
+    def start(self, frames: int = 1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.snapshot = None
+        self.taken = None
+
+    def stop(self):
+        tracemalloc.stop()
+        self.snapshot = None
+        self.taken = None
+
+    def take(self, limit: int = 20, group_by: str = "lineno"):
+        if not tracemalloc.is_tracing():
+            return None
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+        current, peak = tracemalloc.get_traced_memory()
+        result = {
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "since": self.taken,
+            "top": [
+                {"where": stat_where(i.traceback), "size": i.size, "count": i.count}
+                for i in snapshot.statistics(group_by)[:limit]
+            ],
+            "diff": None
+        }
+        if self.snapshot is not None:
+            result["diff"] = [
+                {
+                    "where": stat_where(i.traceback), "size": i.size, "size_diff": i.size_diff,
+                    "count": i.count, "count_diff": i.count_diff
+                }
+                for i in snapshot.compare_to(self.snapshot, group_by)[:limit]
+            ]
+        self.snapshot = snapshot
+        self.taken = int(time.time())
+        return result
+
+
+def stat_where(traceback) -> list:
+    return ["{}:{}".format(i.filename, i.lineno) for i in traceback]
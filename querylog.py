@@ -0,0 +1,108 @@
+import re
+import time
+from collections import deque
+from functools import lru_cache
+
+# Per-statement timing for the cursor layer of coinapi.py: statements are aggregated by
+# normalized SQL (literals and placeholders as ?, repeated IN / VALUES items folded), and
+# the slow ones are kept with the EXPLAIN plan captured for their statement. Statement
+# arguments are never stored, they can hold API keys.
+
+STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+VALUE_LITERAL = re.compile(r"(?<![\w`])-?\d+(?:\.\d+)?(?![\w`])|\bNULL\b")
+# "?, ?, ?", "UNHEX(MD5(?)), UNHEX(MD5(?))", "(?, ?), (?, ?)" -> first item, ...
+REPEATED_ITEMS = re.compile(r"(\((?:[^()]|\([^()]*(?:\([^()]*\))?[^()]*\))*\)|\w+\(\w+\(\?\)\)|\?)(?:\s*,\s*\1)+")
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(query: str) -> str:
+    sql = " ".join(query.split()).rstrip(";").strip()
+    sql = sql.replace("%s", "?")
+    sql = STRING_LITERAL.sub("?", sql)
+    sql = VALUE_LITERAL.sub("?", sql)
+    return REPEATED_ITEMS.sub(r"\1, ...", sql)
+
+
+class QueryLog:
+    def __init__(self, slow_ms: float = 200.0, keep_slow: int = 100, max_statements: int = 1000):
+        self.slow_ms = slow_ms
+        self.max_statements = max_statements
+        self.statements = {}
+        self.slow = deque(maxlen=keep_slow)
+        self.overflow = 0
+
+    def record(self, sql: str, fn: str, seconds: float, error: str = None):
+        # sql from normalize_sql(); returns True when the call was slow
+        entry = self.statements.get(sql)
+        if entry is None:
+            if len(self.statements) >= self.max_statements:
+                self.overflow += 1
+                return False
+            entry = self.statements[sql] = {
+                "sql": sql, "fn": set(), "count": 0, "errors": 0, "total": 0.0, "max": 0.0,
+                "slow": 0, "explain": None, "explain_time": 0
+            }
+        entry['fn'].add(fn)
+        entry['count'] += 1
+        entry['total'] += seconds
+        entry['max'] = max(entry['max'], seconds)
+        if error is not None:
+            entry['errors'] += 1
+        if seconds * 1000 < self.slow_ms:
+            return False
+        entry['slow'] += 1
+        self.slow.append({
+            "time": int(time.time()), "ms": round(seconds * 1000, 3), "fn": fn, "sql": sql, "error": error
+        })
+        return True
+
+    def wants_explain(self, sql: str, interval: float) -> bool:
+        # one EXPLAIN per statement per interval; reserves the slot right away
+        entry = self.statements.get(sql)
+        if entry is None or time.time() - entry['explain_time'] < interval:
+            return False
+        if not sql.upper().startswith(("SELECT", "UPDATE", "DELETE", "INSERT", "REPLACE")):
+            return False
+        entry['explain_time'] = time.time()
+        return True
+
+    def full_scans(self) -> int:
+        # statements whose last captured plan reads a whole table
+        return len([
+            i for i in self.statements.values()
+            if i['explain'] is not None and any(p.get('type') == "ALL" for p in i['explain'])
+        ])
+
+    def set_explain(self, sql: str, plan: list):
+        entry = self.statements.get(sql)
+        if entry is not None:
+            entry['explain'] = plan
+
+    def report(self, sort: str = "total", limit: int = 50) -> dict:
+        rows = []
+        for entry in self.statements.values():
+            rows.append({
+                "sql": entry['sql'],
+                "fn": sorted(entry['fn']),
+                "count": entry['count'],
+                "errors": entry['errors'],
+                "total_ms": round(entry['total'] * 1000, 3),
+                "avg_ms": round(entry['total'] * 1000 / entry['count'], 3),
+                "max_ms": round(entry['max'] * 1000, 3),
+                "slow": entry['slow'],
+                "explain": entry['explain'],
+                "explain_time": entry['explain_time'] or None
+            })
+        key = {"total": "total_ms", "max": "max_ms", "count": "count", "avg": "avg_ms", "slow": "slow"}[sort]
+        rows.sort(key=lambda i: -i[key])
+        return {
+            "slow_ms": self.slow_ms,
+            "statements": rows[:limit],
+            "untracked_statements": self.overflow,
+            "slow": list(self.slow)[::-1]
+        }
+
+    def reset(self):
+        self.statements = {}
+        self.slow.clear()
+        self.overflow = 0
@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import multiprocessing
+import time
+import traceback, sys
+
+from config import load_config
+
+# Deposit scanners and unlocker out of the API processes, so wallet scans do not
+# share an event loop with HTTP requests. Set coinapi.scanner_processes = true and run:
+#   python scanner.py             one process each for xmr, btc and unlock
+#   python scanner.py --per-coin  one process per coin, plus unlock
+# Processes only share the DB and redis with the API; a dead one is restarted.
+# With [metrics] scanner_port set, job n serves its own /metrics on scanner_port + n.
+
+
+def scanner_process(family: str, coins, metrics_port: int = None):
+    # imported here so each process gets its own pools and event loop
+    import coinapi
+    try:
+        asyncio.run(coinapi.run_scanner(family, coins, metrics_port))
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run coinapi deposit scanners in their own processes.")
+    parser.add_argument("--per-coin", action="store_true", help="one process per coin instead of per coin family")
+    parser.add_argument(
+        "--family", action="append", choices=["xmr", "btc", "unlock"],
+        help="only these (repeatable), default all"
+    )
+    args = parser.parse_args()
+
+    config = load_config()
+    families = args.family or ["xmr", "btc", "unlock"]
+    coin_lists = {"xmr": config['coinapi']['list_bcn_xmr'], "btc": config['coinapi']['list_btc']}
+    jobs = []
+    for family in families:
+        if family == "unlock":
+            jobs.append((family, None))
+        elif args.per_coin is True:
+            jobs += [(family, [i]) for i in coin_lists[family]]
+        elif len(coin_lists[family]) > 0:
+            jobs.append((family, None))
+
+    scanner_port = config.get('metrics', {}).get('scanner_port', 0)
+    context = multiprocessing.get_context("spawn")
+    processes = {}
+    try:
+        while True:
+            for n, job in enumerate(jobs):
+                process = processes.get(job_name(job))
+                if process is not None and process.is_alive():
+                    continue
+                if process is not None:
+                    print("{} exited with {}, restarting.".format(job_name(job), process.exitcode))
+                metrics_port = scanner_port + n if scanner_port > 0 else None
+                process = context.Process(
+                    target=scanner_process, args=job + (metrics_port,), name=job_name(job), daemon=True
+                )
+                process.start()
+                processes[job_name(job)] = process
+            time.sleep(5.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes.values():
+            try:
+                process.terminate()
+                process.join(timeout=10.0)
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
+
+
+def job_name(job):
+    family, coins = job
+    return family if coins is None else "{}_{}".format(family, "_".join(coins))
+
+
+if __name__ == "__main__":
+    main()
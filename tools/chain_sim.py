@@ -0,0 +1,581 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from functools import lru_cache
+
+import toml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from config import load_config
+from fake_rpc import BtcNode, XmrDaemonNode, XmrWalletNode, serve
+from loadtest import git_revision, mysql_connect, percentile, reset_db
+
+# Synthetic blockchains for benchmarking the deposit scanners of coinapi.py at scale.
+# A chain is a pure function of its settings, the seed and the wall clock: blocks are regenerated
+# on demand, so the serving process and the benchmark agree on every txid without sharing state.
+#   history   --history deposits spread over the --history-blocks before --start-height
+#   live      one block every --block-time s with --per-block deposits, plus --burst-size more
+#             every --burst-every blocks
+#   reorgs    every --reorg-every blocks, the --reorg-depth blocks below it are replaced (new txids)
+# The btc chain answers getblockchaininfo/listtransactions, the xmr chain get_block_count,
+# get_block_header_by_height and get_transfers, each after --latency (+ --jitter) seconds.
+#   python tools/chain_sim.py serve --node-port 18120 --addresses 1000 --history 10000
+#   python tools/chain_sim.py bench --seed-db --addresses 100000 --history 1000000 --duration 600 --label before
+# bench runs from the directory holding config.toml (its [mysql] db must contain "loadtest"): it
+# seeds addresses and the credited history, starts `serve` in a child process, then drives
+# BackgroundRunner's scan and unlock rounds in-process and records per-round scan time, memory
+# and deposit-to-pending / deposit-to-credit latency. Results go to --results like loadtest.py.
+
+FAMILIES = {
+    # family: (coin_name, coin type, decimal, node kinds and port offsets)
+    "btc": ("SIMBTC", "BTC", 8, {"btc": 0}),
+    "xmr": ("SIMXMR", "XMR", 12, {"xmr_daemon": 1, "xmr_wallet": 2}),
+}
+MIN_DEPOSIT = 0.0001
+SIM_EMAIL = "chainsim@localhost"
+
+
+def digest(*parts) -> str:
+    return hashlib.sha256("_".join([str(i) for i in parts]).encode()).hexdigest()
+
+
+class SyntheticChain:
+    def __init__(self, family: str, seed: int = 1, addresses: int = 1000, history: int = 0, history_blocks: int = 1000,
+                 start_height: int = 1000000, per_block: int = 1, burst_every: int = 0, burst_size: int = 0,
+                 reorg_every: int = 0, reorg_depth: int = 0, block_time: float = 10.0, genesis_time: float = None,
+                 cache_blocks: int = 20000):
+        self.family = family
+        self.seed = seed
+        self.addresses = addresses
+        self.history = history
+        self.history_blocks = max(history_blocks, 1)
+        self.start_height = start_height
+        self.per_block = per_block
+        self.burst_every = burst_every
+        self.burst_size = burst_size
+        self.reorg_every = reorg_every
+        self.reorg_depth = reorg_depth
+        self.block_time = block_time
+        self.genesis_time = genesis_time if genesis_time is not None else time.time()
+        self.decimal = FAMILIES[family][2]
+        self.block = lru_cache(maxsize=cache_blocks)(self.make_block)
+
+    def payment_id(self, n: int) -> str:
+        return digest(self.seed, self.family, "address", n)[:16]
+
+    def address(self, n: int) -> str:
+        if self.family == "btc":
+            return "simbtc1q" + digest(self.seed, self.family, "address", n)[:38]
+        return "SIMXMR" + self.payment_id(n) + digest(self.seed, "integrated", n)[:40]
+
+    def tip(self, now: float = None) -> int:
+        now = time.time() if now is None else now
+        return self.start_height + max(0, int((now - self.genesis_time) / self.block_time))
+
+    def timestamp(self, height: int) -> float:
+        # when the block was mined, negative offsets for the history
+        return self.genesis_time + (height - self.start_height) * self.block_time
+
+    def tx_count(self, height: int) -> int:
+        if height < self.start_height:
+            offset = height - (self.start_height - self.history_blocks)
+            if offset < 0:
+                return 0
+            return self.history // self.history_blocks + (1 if offset < self.history % self.history_blocks else 0)
+        if height == self.start_height:
+            return 0
+        burst = self.burst_size if self.burst_every > 0 and (height - self.start_height) % self.burst_every == 0 else 0
+        return self.per_block + burst
+
+    def generation(self, height: int, tip: int) -> int:
+        # how often the block at height was replaced by reorgs up to tip; block t of a reorg replaces [t - depth, t)
+        if self.reorg_every <= 0 or self.reorg_depth <= 0 or height <= self.start_height:
+            return 0
+        low = max(height + 1, self.start_height + self.reorg_every)
+        high = min(tip, height + self.reorg_depth)
+        if high < low:
+            return 0
+        return (high - self.start_height) // self.reorg_every - (low - self.start_height + self.reorg_every - 1) // self.reorg_every + 1
+
+    def block_hash(self, height: int, tip: int) -> str:
+        return digest(self.seed, self.family, "block", height, self.generation(height, tip))
+
+    def make_block(self, height: int, generation: int) -> tuple:
+        # ((txid, address n, atomic amount), ...)
+        rnd = random.Random(digest(self.seed, self.family, height, generation))
+        min_atomic = int(MIN_DEPOSIT * 10 ** self.decimal)
+        return tuple([
+            (digest(self.seed, self.family, "tx", height, generation, i), rnd.randrange(self.addresses), min_atomic * rnd.randint(1, 10000))
+            for i in range(self.tx_count(height))
+        ])
+
+    def txs(self, height: int, tip: int) -> tuple:
+        return self.block(height, self.generation(height, tip))
+
+    def recent(self, count: int, skip: int, tip: int) -> list:
+        # newest first: [(height, tx), ...]
+        result = []
+        height = tip
+        while len(result) < count + skip and height >= self.start_height - self.history_blocks:
+            result += [(height, i) for i in reversed(self.txs(height, tip))]
+            height -= 1
+        return result[skip:count + skip]
+
+
+class ChainNode:
+    def __init__(self, chain: SyntheticChain, latency: float = 0.0, jitter: float = 0.0):
+        super().__init__(latency, jitter, chain.block_time, chain.start_height)
+        self.chain = chain
+
+    def height(self) -> int:
+        return self.chain.tip()
+
+    def block_hash(self, height: int) -> str:
+        return self.chain.block_hash(height, self.chain.tip())
+
+
+class SimBtcNode(ChainNode, BtcNode):
+    def rpc_listtransactions(self, params):
+        # ["*", count, skip], oldest first like bitcoind
+        params = params or []
+        count = int(params[1]) if len(params) > 1 else 10
+        skip = int(params[2]) if len(params) > 2 else 0
+        tip = self.chain.tip()
+        result = []
+        for (height, (txid, n, amount)) in reversed(self.chain.recent(count, skip, tip)):
+            result.append({
+                "address": self.chain.address(n),
+                "category": "receive",
+                "amount": amount / 10 ** self.chain.decimal,
+                "confirmations": tip - height + 1,
+                "blockhash": self.chain.block_hash(height, tip),
+                "blockheight": height,
+                "txid": txid,
+                "time": int(self.chain.timestamp(height))
+            })
+        return result
+
+
+class SimXmrDaemonNode(ChainNode, XmrDaemonNode):
+    def rpc_get_block_header_by_height(self, params):
+        height = int(params['height'])
+        return {
+            "block_header": {"height": height, "hash": self.block_hash(height), "timestamp": int(self.chain.timestamp(height))},
+            "status": "OK"
+        }
+
+
+class SimXmrWalletNode(ChainNode, XmrWalletNode):
+    address_prefix = "SIMXMR"
+
+    def rpc_get_transfers(self, params):
+        # incoming only, min_height exclusive like monero-wallet-rpc; {} when there is nothing
+        params = params or {}
+        tip = self.chain.tip()
+        low, high = self.chain.start_height - self.chain.history_blocks, tip
+        if params.get('filter_by_height'):
+            low = max(low, int(params.get('min_height', 0)) + 1)
+            high = min(high, int(params.get('max_height', tip)))
+        transfers = []
+        for height in range(low, high + 1):
+            for (txid, n, amount) in self.chain.txs(height, tip):
+                transfers.append({
+                    "txid": txid,
+                    "payment_id": self.chain.payment_id(n),
+                    "amount": amount,
+                    "height": height,
+                    "timestamp": int(self.chain.timestamp(height)),
+                    "confirmations": tip - height,
+                    "type": "in"
+                })
+        if not params.get('in', True) or len(transfers) == 0:
+            return {}
+        return {"in": transfers}
+
+
+SIM_NODES = {"btc": SimBtcNode, "xmr_daemon": SimXmrDaemonNode, "xmr_wallet": SimXmrWalletNode}
+
+
+def make_chain(family: str, args, genesis_time: float = None) -> SyntheticChain:
+    return SyntheticChain(
+        family, seed=args.seed, addresses=args.addresses, history=args.history, history_blocks=args.history_blocks,
+        start_height=args.start_height, per_block=args.per_block, burst_every=args.burst_every, burst_size=args.burst_size,
+        reorg_every=args.reorg_every, reorg_depth=args.reorg_depth, block_time=args.block_time, genesis_time=genesis_time
+    )
+
+
+def node_url(args, family: str, kind: str) -> str:
+    return "http://127.0.0.1:{}".format(args.node_port + FAMILIES[family][3][kind])
+
+
+def seed(config, args, chains: dict) -> int:
+    # coin settings pointing at the simulator, one api user, --addresses per coin and the credited history
+    conn = mysql_connect(config)
+    coin_names = [FAMILIES[i][0] for i in chains]
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM `deposits` WHERE `coin_name` IN %s", (coin_names,))
+        cur.execute("DELETE FROM `deposit_addresses` WHERE `coin_name` IN %s", (coin_names,))
+        cur.execute("SELECT `id` FROM `api_users` WHERE `email`=%s", (SIM_EMAIL,))
+        for (api_id,) in cur.fetchall():
+            cur.execute("DELETE FROM `api_events` WHERE `api_id`=%s", (api_id,))
+        cur.execute("DELETE FROM `api_users` WHERE `email`=%s", (SIM_EMAIL,))
+        cur.execute("""
+            INSERT INTO `api_users` (`email`, `api_key`, `encrypt_key`, `max_address`, `allowed_coin`, `created`)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (SIM_EMAIL, "chainsim-" + digest(args.seed, "api_key")[:32], "", args.addresses * 2, ",".join(coin_names), int(time.time())))
+        api_id = cur.lastrowid
+        for family, chain in chains.items():
+            coin_name = FAMILIES[family][0]
+            print("seeding {}: {} addresses, {} deposits".format(coin_name, chain.addresses, chain.history))
+            rows = [
+                (api_id, coin_name, int(time.time()), chain.address(n), chain.payment_id(n) if family == "xmr" else None, "sim-{}".format(n))
+                for n in range(chain.addresses)
+            ]
+            for offset in range(0, len(rows), 5000):
+                cur.executemany("""
+                    INSERT INTO `deposit_addresses` (`api_id`, `coin_name`, `created_date`, `address`, `address_extra`, `tag`)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                """, rows[offset:offset + 5000])
+            cur.execute("SELECT `id` FROM `deposit_addresses` WHERE `api_id`=%s AND `coin_name`=%s ORDER BY `id`", (api_id, coin_name))
+            ids = [i[0] for i in cur.fetchall()]
+            deposits = []
+            for height in range(chain.start_height - chain.history_blocks, chain.start_height):
+                for (txid, n, amount) in chain.txs(height, chain.start_height):
+                    deposits.append((
+                        coin_name, api_id, ids[n], txid, chain.address(n), chain.payment_id(n) if family == "xmr" else None,
+                        height, amount / 10 ** chain.decimal, int(chain.timestamp(height)), "YES", args.confirmations
+                    ))
+                if len(deposits) >= 5000 or height == chain.start_height - 1:
+                    cur.executemany("""
+                        INSERT INTO `deposits` (`coin_name`, `api_id`, `depost_id`, `txid`, `address`, `extra`, `height`, `amount`, `time_insert`, `can_credit`, `confirmations`)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    """, deposits)
+                    deposits = []
+    conn.close()
+    return api_id
+
+
+def prepare(config, args, chains: dict) -> int:
+    # per run: coin settings for this simulator, and no deposits or events left from a previous run
+    conn = mysql_connect(config)
+    coin_names = [FAMILIES[i][0] for i in chains]
+    with conn.cursor() as cur:
+        cur.execute("SELECT `id` FROM `api_users` WHERE `email`=%s", (SIM_EMAIL,))
+        row = cur.fetchone()
+        if row is None:
+            conn.close()
+            sys.exit("nothing seeded yet, run bench with --seed-db")
+        api_id = row[0]
+        cur.execute("DELETE FROM `deposits` WHERE `coin_name` IN %s AND (`height` IS NULL OR `height`>=%s)", (coin_names, args.start_height))
+        cur.execute("DELETE FROM `api_events` WHERE `api_id`=%s", (api_id,))
+        cur.execute("DELETE FROM `coin_settings` WHERE `coin_name` IN %s", (coin_names,))
+        for family in chains:
+            coin_name, coin_type, decimal, nodes = FAMILIES[family]
+            if family == "btc":
+                daemon, wallet = node_url(args, family, "btc"), None
+            else:
+                daemon, wallet = node_url(args, family, "xmr_daemon"), node_url(args, family, "xmr_wallet") + "/json_rpc"
+            cur.execute("""
+                INSERT INTO `coin_settings` (`coin_name`, `type`, `decimal`, `round_places`, `daemon_address`,
+                `wallet_address`, `header`, `mixin`, `main_address`, `min_deposit`, `min_withdraw`, `max_withdraw`,
+                `min_transfer`, `max_transfer`, `fee_withdraw`, `confirmation_depth`)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (
+                coin_name, coin_type, decimal, 8, daemon, wallet, "chainsim", 3, coin_name + "main",
+                MIN_DEPOSIT, 0.001, 1000, 0.0001, 1000, 0.0001, args.confirmations
+            ))
+    conn.close()
+    return api_id
+
+
+def write_config(config, args, chains: dict, workdir: str):
+    run_config = json.loads(json.dumps(config))
+    run_config['coinapi'].update({
+        "kv_prefix": "chainsim_",
+        "list_btc": [FAMILIES[i][0] for i in chains if i == "btc"],
+        "list_bcn_xmr": [FAMILIES[i][0] for i in chains if i == "xmr"],
+        "leader_election": False,
+    })
+    # every simulator node also takes the Discord log
+    family = list(chains)[0]
+    run_config.setdefault('log', {})['discord_webhook_default'] = node_url(args, family, list(FAMILIES[family][3])[0]) + "/discord"
+    run_config['webhook'] = {"enable": False}
+    os.makedirs(workdir, exist_ok=True)
+    with open(os.path.join(workdir, "config.toml"), "w") as f:
+        toml.dump(run_config, f)
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # peak instead of current where there is no /proc (kilobytes on Linux, bytes on macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+class Bench:
+    def __init__(self, args, config, chains: dict, api_id: int):
+        self.args = args
+        self.chains = chains
+        self.api_id = api_id
+        self.conn = mysql_connect(config)
+        self.last_event = 0
+        self.rounds = []
+        # txid: {"coin", "height", "mined", "pending", "credited"}
+        self.deposits = {}
+
+    def fetch_events(self, seen: float):
+        # events written since the last call were seen by the stage that just ended at seen
+        with self.conn.cursor() as cur:
+            cur.execute(
+                "SELECT `id`, `event_type`, `payload` FROM `api_events` WHERE `api_id`=%s AND `id`>%s ORDER BY `id`",
+                (self.api_id, self.last_event)
+            )
+            for (event_id, event_type, payload) in cur.fetchall():
+                self.last_event = event_id
+                data = json.loads(payload)['data']
+                entry = self.deposits.setdefault(data['txid'], {"coin": data['coin_name'], "height": None, "pending": None, "credited": None})
+                if data.get('height') is not None:
+                    entry['height'] = data['height']
+                if event_type == "deposit_pending":
+                    entry['pending'] = seen
+                elif event_type == "deposit_credited":
+                    entry['credited'] = seen
+
+    async def run(self, coinapi):
+        runner = coinapi.runner
+        runner.coin_list = await coinapi.get_coin_setting()
+        log_worker = asyncio.create_task(runner.discord_log_worker())
+        if self.args.tracemalloc:
+            tracemalloc.start()
+        deadline = time.time() + self.args.duration
+        n = 0
+        try:
+            while time.time() < deadline:
+                record = {"round": n, "time": round(time.time(), 3)}
+                for family, chain in self.chains.items():
+                    coin_name = FAMILIES[family][0]
+                    if self.args.tracemalloc:
+                        tracemalloc.reset_peak()
+                    start = time.perf_counter()
+                    if family == "btc":
+                        await runner.update_balance_tasks_btc(coin_name, False)
+                    else:
+                        await runner.update_balance_tasks_xmr(coin_name, False)
+                    record[coin_name] = {
+                        "tip": chain.tip(),
+                        "scan_ms": round((time.perf_counter() - start) * 1000, 3),
+                        "traced_peak": tracemalloc.get_traced_memory()[1] if self.args.tracemalloc else None
+                    }
+                self.fetch_events(time.time())
+                start = time.perf_counter()
+                await runner.unlock_deposit_round()
+                record['unlock_ms'] = round((time.perf_counter() - start) * 1000, 3)
+                self.fetch_events(time.time())
+                record['rss'] = rss_bytes()
+                self.rounds.append(record)
+                print("round {:>4}  {}  unlock {:.0f} ms  rss {:.0f} MB".format(
+                    n, "  ".join(["{} {:.0f} ms".format(FAMILIES[i][0], record[FAMILIES[i][0]]['scan_ms']) for i in self.chains]),
+                    record['unlock_ms'], record['rss'] / 2 ** 20
+                ))
+                n += 1
+                await asyncio.sleep(self.args.interval)
+        finally:
+            log_worker.cancel()
+            if self.args.tracemalloc:
+                tracemalloc.stop()
+
+    def summary(self) -> dict:
+        result = {}
+        for family, chain in self.chains.items():
+            coin_name = FAMILIES[family][0]
+            tip = chain.tip()
+            scans = sorted([i[coin_name]['scan_ms'] for i in self.rounds])
+            seen = {k: v for k, v in self.deposits.items() if v['coin'] == coin_name}
+            # txid: height of every deposit in the final chain that was deep enough to be picked up
+            expected = {}
+            for height in range(chain.start_height + 1, tip - self.args.confirmations + 1):
+                for (txid, n, amount) in chain.txs(height, tip):
+                    expected[txid] = height
+            to_pending, to_credit = [], []
+            for txid, entry in seen.items():
+                height = entry['height'] if entry['height'] is not None else expected.get(txid)
+                if height is None:
+                    continue
+                if entry['pending'] is not None:
+                    to_pending.append(entry['pending'] - chain.timestamp(height))
+                if entry['credited'] is not None:
+                    to_credit.append(entry['credited'] - chain.timestamp(height))
+            to_pending.sort()
+            to_credit.sort()
+            orphaned = [
+                k for k, v in seen.items()
+                if v['height'] is not None and v['height'] > chain.start_height and k not in [i[0] for i in chain.txs(v['height'], tip)]
+            ]
+            traced = [i[coin_name]['traced_peak'] for i in self.rounds if i[coin_name]['traced_peak'] is not None]
+            result[coin_name] = {
+                "rounds": len(scans),
+                "scan_p50_ms": percentile(scans, 50),
+                "scan_p99_ms": percentile(scans, 99),
+                "scan_max_ms": scans[-1] if scans else None,
+                "traced_peak_max": max(traced) if traced else None,
+                "expected": len(expected),
+                "pending": len([i for i in seen.values() if i['pending'] is not None]),
+                "credited": len([i for i in seen.values() if i['credited'] is not None]),
+                "missed": len([i for i in expected if i not in seen]),
+                "orphaned": len(orphaned),
+                "orphaned_credited": len([i for i in orphaned if seen[i]['credited'] is not None]),
+                "pending_p50_s": round(percentile(to_pending, 50), 3) if to_pending else None,
+                "pending_p99_s": round(percentile(to_pending, 99), 3) if to_pending else None,
+                "credit_p50_s": round(percentile(to_credit, 50), 3) if to_credit else None,
+                "credit_p99_s": round(percentile(to_credit, 99), 3) if to_credit else None,
+            }
+        rss = [i['rss'] for i in self.rounds]
+        result['memory'] = {
+            "rss_first": rss[0] if rss else None,
+            "rss_last": rss[-1] if rss else None,
+            "rss_max": max(rss) if rss else None,
+            "maxrss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        }
+        return result
+
+
+def print_summary(summary: dict):
+    print("{:<8} {:>6} {:>10} {:>10} {:>10} {:>8} {:>8} {:>8} {:>7} {:>8} {:>10} {:>10}".format(
+        "coin", "rounds", "scan p50", "scan p99", "scan max", "expected", "pending", "credited", "missed", "orphaned", "credit p50", "credit p99"
+    ))
+    for coin_name, i in summary.items():
+        if coin_name == "memory":
+            continue
+        print("{:<8} {:>6} {:>10} {:>10} {:>10} {:>8} {:>8} {:>8} {:>7} {:>8} {:>10} {:>10}".format(
+            coin_name, i['rounds'], str(i['scan_p50_ms']), str(i['scan_p99_ms']), str(i['scan_max_ms']), i['expected'],
+            i['pending'], i['credited'], i['missed'], i['orphaned'], str(i['credit_p50_s']), str(i['credit_p99_s'])
+        ))
+    memory = summary['memory']
+    if memory['rss_max'] is not None:
+        print("rss {:.0f} -> {:.0f} MB, max {:.0f} MB".format(memory['rss_first'] / 2 ** 20, memory['rss_last'] / 2 ** 20, memory['rss_max'] / 2 ** 20))
+
+
+def chain_arguments(args) -> list:
+    # the same chain for the serve child process
+    result = []
+    for name in ["families", "seed", "addresses", "history", "history_blocks", "start_height", "per_block", "burst_every",
+                 "burst_size", "reorg_every", "reorg_depth", "block_time", "latency", "jitter", "node_port"]:
+        result += ["--" + name.replace("_", "-"), str(getattr(args, name))]
+    return result
+
+
+def bench(args):
+    config = load_config()
+    if "loadtest" not in config['mysql']['db']:
+        sys.exit("refusing to seed {}: the [mysql] db name must contain 'loadtest'".format(config['mysql']['db']))
+    if args.reset_db:
+        reset_db(config)
+    chains = {i: make_chain(i, args) for i in args.families.split(",")}
+    if args.seed_db or args.reset_db:
+        seed(config, args, chains)
+    api_id = prepare(config, args, chains)
+    write_config(config, args, chains, args.workdir)
+    # the seeding may have taken a while, the live chain starts now
+    genesis_time = time.time() + 2.0
+    for chain in chains.values():
+        chain.genesis_time = genesis_time
+
+    results = os.path.abspath(args.results)
+    log = open(os.path.join(args.workdir, "chain_sim.log"), "w")
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "serve", "--genesis-time", repr(genesis_time)] + chain_arguments(args),
+        stdout=log, stderr=subprocess.STDOUT
+    )
+    run = Bench(args, config, chains, api_id)
+    try:
+        time.sleep(2.0)
+        if process.poll() is not None:
+            raise RuntimeError("simulator exited with {}".format(process.returncode))
+        # coinapi reads config.toml from the working directory at import
+        os.chdir(args.workdir)
+        import coinapi
+        asyncio.run(run.run(coinapi))
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log.close()
+
+    summary = run.summary()
+    print_summary(summary)
+    os.makedirs(results, exist_ok=True)
+    path = os.path.join(results, "{}_chainsim_{}.json".format(time.strftime("%Y%m%d-%H%M%S"), args.label))
+    with open(path, "w") as f:
+        json.dump({
+            "label": args.label,
+            "time": int(time.time()),
+            "git": git_revision(),
+            "settings": vars(args),
+            "summary": summary,
+            "rounds": run.rounds
+        }, f, indent=2)
+    print("saved {}".format(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic BTC and XMR chains for benchmarking coinapi's deposit scanners.")
+    parser.add_argument("command", choices=["serve", "bench"])
+    parser.add_argument("--families", default="btc,xmr", help="comma separated: btc, xmr")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--addresses", type=int, default=100000, help="deposit addresses per coin")
+    parser.add_argument("--history", type=int, default=1000000, help="historical deposits per coin")
+    parser.add_argument("--history-blocks", type=int, default=50000)
+    parser.add_argument("--start-height", type=int, default=1000000)
+    parser.add_argument("--per-block", type=int, default=2, help="deposits in every live block")
+    parser.add_argument("--burst-every", type=int, default=20, help="blocks, 0 for no bursts")
+    parser.add_argument("--burst-size", type=int, default=500, help="extra deposits in a burst block")
+    parser.add_argument("--reorg-every", type=int, default=30, help="blocks")
+    parser.add_argument("--reorg-depth", type=int, default=0, help="blocks replaced by each reorg, 0 for none")
+    parser.add_argument("--block-time", type=float, default=10.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="node answer delay, seconds")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--node-port", type=int, default=18120, help="first of 3 ports: btc, xmr daemon, xmr wallet")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--genesis-time", type=float, help="serve: unix time of --start-height, default now")
+    # bench
+    parser.add_argument("--reset-db", action="store_true", help="load coinapi_db.sql into the loadtest database first")
+    parser.add_argument("--seed-db", action="store_true", help="(re)create the addresses and the history")
+    parser.add_argument("--confirmations", type=int, default=3, help="confirmation_depth of the simulated coins")
+    parser.add_argument("--duration", type=float, default=300.0, help="seconds of scanning")
+    parser.add_argument("--interval", type=float, default=10.0, help="sleep between rounds, as the scanners do")
+    parser.add_argument("--tracemalloc", action="store_true", help="record the traced peak of every scan (slower)")
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--workdir", default="loadtest_run")
+    parser.add_argument("--results", default="loadtest_results")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        bench(args)
+        return
+
+    nodes = []
+    for family in args.families.split(","):
+        chain = make_chain(family, args, args.genesis_time)
+        for kind in FAMILIES[family][3]:
+            nodes.append((SIM_NODES[kind](chain, args.latency, args.jitter), args.node_port + FAMILIES[family][3][kind]))
+            print("{} on {}:{}".format(kind, args.host, args.node_port + FAMILIES[family][3][kind]))
+    try:
+        asyncio.run(serve(nodes, args.host))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
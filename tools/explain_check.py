@@ -0,0 +1,80 @@
+import argparse
+import sys
+import os
+
+import pymysql
+from pymysql.cursors import DictCursor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from config import load_config
+import coinapi
+
+# EXPLAIN every hot query shape of coinapi.py and fail if one would scan a whole table.
+# Run from the directory holding config.toml, after applying migrations/:
+#   python tools/explain_check.py
+# Exit code 1 means a query lost its index.
+
+
+def limited(sql_rows, limit: int = 500):
+    # builders whose callers append the LIMIT
+    sql, data_rows = sql_rows
+    return sql + " LIMIT %s", data_rows + [limit]
+
+
+def hot_queries(coinapi):
+    # (name, sql, params) from the builders coinapi.py itself runs, so the check follows the code
+    changes = coinapi.changes_sql(1, [(0, 0), 0, 0, 0, 0], 500)
+    return [
+        ("get_api_by_key",) + tuple(coinapi.api_by_key_sql("key")),
+        ("get_balance_coin_address",) + tuple(coinapi.balance_coin_address_sql(1, "XMR", "address")),
+        ("find_address_coin_tag",) + tuple(coinapi.address_coin_tag_sql("XMR", "tag", 1)),
+        ("find_addresses_coin_tags",) + tuple(coinapi.addresses_coin_tags_sql(1, [("XMR", "tag1"), ("XMR", "tag2")])),
+        ("get_userwallet_by_extra",) + tuple(coinapi.userwallet_by_extra_sql("0123456789abcdef", "XMR", "XMR")),
+        ("get_userwallet_by_address",) + tuple(coinapi.userwallet_by_extra_sql("address", "DOGE", "BTC")),
+        ("transfer_records lock",) + tuple(coinapi.lock_addresses_sql("XMR", ["address1", "address2"])),
+        ("claim_pool_address",) + tuple(coinapi.claim_pool_address_sql(1, "XMR", "tag")),
+        ("get_txes_address_coin_api by coin",) + tuple(limited(coinapi.txes_address_coin_sql("XMR", 1))),
+        ("get_txes_address_coin_api by address",) + tuple(limited(coinapi.txes_address_coin_sql("XMR", 1, "address"))),
+        ("get_changes transfers",) + tuple(changes['transfers']),
+        ("get_changes credits",) + tuple(changes['credits']),
+        ("get_transfers_coin_api",) + tuple(coinapi.transfers_coin_sql("XMR", 1)),
+        ("get_transfers_coin_api by address",) + tuple(coinapi.transfers_coin_sql("XMR", 1, "address")),
+        ("get_withdraws_coin_api by address",) + tuple(coinapi.withdraws_coin_sql("XMR", 1, "address")),
+        ("unlock_deposit",) + tuple(coinapi.pending_deposits_sql()),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN coinapi hot queries and fail on table scans.")
+    parser.add_argument(
+        "--min-rows", type=int, default=1000,
+        help="a scan of a table with an usable index is only reported from this many estimated rows"
+    )
+    args = parser.parse_args()
+
+    config = load_config()
+    conn = pymysql.connect(
+        host=config['mysql']['host'], port=config['mysql'].get('port', 3306),
+        user=config['mysql']['user'], password=config['mysql']['password'],
+        db=config['mysql']['db'], cursorclass=DictCursor
+    )
+    failed = []
+    with conn.cursor() as cur:
+        for name, sql, params in hot_queries(coinapi):
+            cur.execute("EXPLAIN " + sql, tuple(params))
+            for row in cur.fetchall():
+                scan = row['type'] == "ALL" and (row['possible_keys'] is None or (row['rows'] or 0) >= args.min_rows)
+                print("{:<40} {:<18} {:<6} {:<32} rows={}".format(
+                    name, row['table'], row['type'] or "", row['key'] or "-", row['rows']
+                ))
+                if scan:
+                    failed.append("{}: table scan on {}".format(name, row['table']))
+    conn.close()
+    if len(failed) > 0:
+        print("\n".join(failed))
+        sys.exit(1)
+    print("OK: no hot query scans a table.")
+
+
+if __name__ == "__main__":
+    main()
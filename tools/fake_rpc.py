@@ -0,0 +1,224 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+
+from aiohttp import web
+
+# Stand-ins for the coin daemons and wallets coinapi talks to, for tools/loadtest.py and local runs.
+# Each answers after latency (+ up to jitter) seconds with just enough of the real API:
+#   btc          bitcoind JSON-RPC 1.0: getblockchaininfo, getinfo, getnewaddress, dumpprivkey,
+#                listtransactions, sendtoaddress, sendmany
+#   xmr-wallet   monero-wallet-rpc: make_integrated_address, get_transfers, transfer, store
+#   xmr-daemon   monerod /json_rpc: get_block_count, get_block_header_by_height
+#   trtl-wallet  wallet-api REST /transactions/send/advanced, make_integrated_address for /newaddress
+#   trtl-daemon  TurtleCoind /json_rpc: getblockcount, getblockheaderbyheight
+# Every server also accepts POST /discord (204), so coinapi's Discord log can point at it.
+#   python tools/fake_rpc.py --btc 18443 --xmr-wallet 18083 --xmr-daemon 18081 --latency 0.05
+
+
+class FakeNode:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, block_time: float = 60.0, start_height: int = 100000):
+        self.latency = latency
+        self.jitter = jitter
+        self.block_time = block_time
+        self.start_height = start_height
+        self.started = time.time()
+        self.random = random.Random()
+        self.calls = {}
+
+    def height(self) -> int:
+        return self.start_height + int((time.time() - self.started) / self.block_time)
+
+    def block_hash(self, height: int) -> str:
+        return hashlib.sha256("block_{}".format(height).encode()).hexdigest()
+
+    async def delay(self):
+        if self.latency > 0 or self.jitter > 0:
+            await asyncio.sleep(self.latency + self.random.random() * self.jitter)
+
+    def call(self, method: str, params):
+        # raises KeyError for an unknown method
+        handler = getattr(self, "rpc_" + method, None)
+        if handler is None:
+            raise KeyError(method)
+        self.calls[method] = self.calls.get(method, 0) + 1
+        return handler(params)
+
+    def error(self, request_id, code: int, message: str):
+        return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+
+    async def handle(self, request: web.Request):
+        await self.delay()
+        try:
+            body = json.loads(await request.text())
+        except Exception:
+            return web.json_response(self.error(None, -32700, "Parse error"), status=400)
+        request_id = body.get('id')
+        try:
+            result = self.call(body.get('method', ""), body.get('params'))
+        except KeyError:
+            return web.json_response(self.error(request_id, -32601, "Method not found"), status=404)
+        except Exception as e:
+            return web.json_response(self.error(request_id, -32603, str(e)), status=500)
+        return web.json_response({"jsonrpc": body.get('jsonrpc', "2.0"), "id": request_id, "result": result})
+
+    async def discord(self, request: web.Request):
+        await request.read()
+        return web.Response(status=204)
+
+    async def stats(self, request: web.Request):
+        return web.json_response({"height": self.height(), "calls": self.calls})
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/discord", self.discord)
+        app.router.add_get("/stats", self.stats)
+        self.add_routes(app)
+        return app
+
+    def add_routes(self, app: web.Application):
+        app.router.add_post("/{tail:.*}", self.handle)
+
+
+class BtcNode(FakeNode):
+    # params arrive as a list (JSON-RPC 1.0)
+    def rpc_getblockchaininfo(self, params):
+        height = self.height()
+        return {"chain": "regtest", "blocks": height, "headers": height, "bestblockhash": self.block_hash(height)}
+
+    def rpc_getinfo(self, params):
+        return {"blocks": self.height()}
+
+    def rpc_getblockcount(self, params):
+        return self.height()
+
+    def rpc_getnewaddress(self, params):
+        return "ltbtc1q" + os.urandom(19).hex()
+
+    def rpc_dumpprivkey(self, params):
+        return "cV" + os.urandom(25).hex()
+
+    def rpc_listtransactions(self, params):
+        return []
+
+    def rpc_sendtoaddress(self, params):
+        return os.urandom(32).hex()
+
+    def rpc_sendmany(self, params):
+        return os.urandom(32).hex()
+
+
+class XmrWalletNode(FakeNode):
+    address_prefix = "LTXMR"
+
+    def rpc_make_integrated_address(self, params):
+        payment_id = (params or {}).get('payment_id') or os.urandom(8).hex()
+        main_address = (params or {}).get('standard_address', "")
+        integrated = hashlib.sha256((main_address + payment_id).encode()).hexdigest()
+        return {"integrated_address": self.address_prefix + payment_id + integrated, "payment_id": payment_id}
+
+    def rpc_get_transfers(self, params):
+        return {"in": []}
+
+    def rpc_transfer(self, params):
+        return {"tx_hash": os.urandom(32).hex(), "tx_key": os.urandom(32).hex(), "amount": 0, "fee": 0}
+
+    def rpc_store(self, params):
+        return {}
+
+
+class XmrDaemonNode(FakeNode):
+    def rpc_get_block_count(self, params):
+        return {"count": self.height() + 1, "status": "OK"}
+
+    def rpc_get_block_header_by_height(self, params):
+        height = int(params['height'])
+        return {
+            "block_header": {"height": height, "hash": self.block_hash(height), "timestamp": int(time.time())},
+            "status": "OK"
+        }
+
+
+class TrtlWalletNode(XmrWalletNode):
+    address_prefix = "LTTRTL"
+
+    async def send_advanced(self, request: web.Request):
+        await self.delay()
+        await request.read()
+        self.calls['/transactions/send/advanced'] = self.calls.get('/transactions/send/advanced', 0) + 1
+        return web.json_response({"transactionHash": os.urandom(32).hex(), "fee": 10}, status=200)
+
+    def add_routes(self, app: web.Application):
+        app.router.add_post("/transactions/send/advanced", self.send_advanced)
+        super().add_routes(app)
+
+
+class TrtlDaemonNode(FakeNode):
+    def rpc_getblockcount(self, params):
+        return {"count": self.height() + 1, "status": "OK"}
+
+    def rpc_getblockheaderbyheight(self, params):
+        height = int(params['height'])
+        return {
+            "block_header": {"height": height, "hash": self.block_hash(height), "timestamp": int(time.time())},
+            "status": "OK"
+        }
+
+
+NODES = {
+    "btc": BtcNode,
+    "xmr_wallet": XmrWalletNode,
+    "xmr_daemon": XmrDaemonNode,
+    "trtl_wallet": TrtlWalletNode,
+    "trtl_daemon": TrtlDaemonNode
+}
+
+
+async def start_node(node: FakeNode, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(node.make_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def serve(nodes: list, host: str):
+    # nodes: list of (FakeNode, port), runs until cancelled
+    runners = [await start_node(node, host, port) for (node, port) in nodes]
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake coin daemons and wallets for coinapi load tests.")
+    for kind in NODES:
+        parser.add_argument("--" + kind.replace("_", "-"), type=int, metavar="PORT", help="serve a {} on this port".format(kind))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds, uniformly")
+    parser.add_argument("--block-time", type=float, default=60.0)
+    args = parser.parse_args()
+
+    nodes = []
+    for kind, node_class in NODES.items():
+        port = getattr(args, kind)
+        if port is not None:
+            nodes.append((node_class(args.latency, args.jitter, args.block_time), port))
+            print("{} on {}:{}".format(kind, args.host, port))
+    if len(nodes) == 0:
+        parser.error("nothing to serve, give at least one port")
+    try:
+        asyncio.run(serve(nodes, args.host))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
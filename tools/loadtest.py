@@ -0,0 +1,357 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+
+import aiohttp
+import pymysql
+import toml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from config import load_config
+
+# End-to-end load test: coinapi against a scratch MySQL database and the local redis, with
+# tools/fake_rpc.py standing in for bitcoind, monero-wallet-rpc/monerod and TRTL wallet-api.
+# Run from the directory holding config.toml; its [mysql] db must contain "loadtest", it is
+# wiped with --reset-db. Redis keys use the kv_prefix "loadtest_".
+#   python tools/loadtest.py --reset-db --concurrency 32 --duration 60 --latency 0.05 --label before
+#   python tools/loadtest.py --compare loadtest_results/<before>.json loadtest_results/<after>.json
+# A run writes its settings, git revision and per-endpoint throughput and p50/p90/p99 to --results.
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+COINS = {
+    # coin_name: (type, decimal, daemon node, wallet node)
+    "LTBTC": ("BTC", 8, "btc", None),
+    "LTXMR": ("XMR", 12, "xmr_daemon", "xmr_wallet"),
+    "LTTRTL": ("TRTL-API", 2, "trtl_daemon", "trtl_wallet"),
+}
+NODE_PORTS = {"btc": 0, "xmr_daemon": 1, "xmr_wallet": 2, "trtl_daemon": 3, "trtl_wallet": 4}
+OPERATIONS = ["balance", "list_transactions", "transfer", "newaddress", "withdraw"]
+
+
+def node_url(base_port: int, node: str) -> str:
+    return "http://127.0.0.1:{}".format(base_port + NODE_PORTS[node])
+
+
+def mysql_connect(config):
+    return pymysql.connect(
+        host=config['mysql']['host'], port=config['mysql'].get('port', 3306),
+        user=config['mysql']['user'], password=config['mysql']['password'],
+        db=config['mysql']['db'], autocommit=True
+    )
+
+
+def reset_db(config):
+    # the dump has triggers (DELIMITER), so it goes through the mysql client like a fresh install
+    env = dict(os.environ, MYSQL_PWD=config['mysql']['password'])
+    with open(os.path.join(ROOT, "coinapi_db.sql")) as f:
+        subprocess.run([
+            "mysql", "-h", config['mysql']['host'], "-P", str(config['mysql'].get('port', 3306)),
+            "-u", config['mysql']['user'], config['mysql']['db']
+        ], stdin=f, env=env, check=True)
+
+
+def seed(config, args) -> dict:
+    # one api key, coins on the fake nodes, funded addresses with credited deposits
+    rnd = random.Random(args.seed)
+    api_key = "loadtest-" + uuid.UUID(int=rnd.getrandbits(128)).hex
+    addresses = {}
+    conn = mysql_connect(config)
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM `coin_settings` WHERE `coin_name` IN %s", (list(COINS),))
+        for coin_name, (coin_type, decimal, daemon, wallet) in COINS.items():
+            cur.execute("""
+                INSERT INTO `coin_settings` (`coin_name`, `type`, `decimal`, `round_places`, `daemon_address`,
+                `wallet_address`, `header`, `mixin`, `main_address`, `min_deposit`, `min_withdraw`, `max_withdraw`,
+                `min_transfer`, `max_transfer`, `fee_withdraw`, `confirmation_depth`)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (
+                coin_name, coin_type, decimal, min(decimal, 8), node_url(args.node_port, daemon),
+                node_url(args.node_port, wallet) + ("/json_rpc" if coin_type == "XMR" else "") if wallet else None,
+                "loadtest", 3, coin_name + "main", 0.0001, 0.001, 1000, 0.0001, 1000, 0.0001, 1
+            ))
+        cur.execute("""
+            INSERT INTO `api_users` (`email`, `api_key`, `encrypt_key`, `max_address`, `allowed_coin`, `created`)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, ("loadtest@localhost", api_key, "", 10000000, ",".join(COINS), int(time.time())))
+        api_id = cur.lastrowid
+        for coin_name in COINS:
+            rows = []
+            for n in range(args.addresses):
+                address = "{}seed{}{:08d}".format(coin_name, api_id, n)
+                rows.append((api_id, coin_name, int(time.time()), address, "{:016x}".format(rnd.getrandbits(64)), "seed-{}".format(n), 1000000.0))
+            cur.executemany("""
+                INSERT INTO `deposit_addresses` (`api_id`, `coin_name`, `created_date`, `address`, `address_extra`, `tag`, `total_deposited`)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, rows)
+            cur.execute("SELECT `id`, `address` FROM `deposit_addresses` WHERE `api_id`=%s AND `coin_name`=%s", (api_id, coin_name))
+            seeded = cur.fetchall()
+            addresses[coin_name] = [i[1] for i in seeded]
+            deposits = []
+            for (deposit_id, address) in seeded:
+                for n in range(args.deposits):
+                    deposits.append((
+                        coin_name, api_id, deposit_id, "{:064x}".format(rnd.getrandbits(256)), address, 100000 + n,
+                        1000000.0 / max(args.deposits, 1), int(time.time()) - n * 60, "YES", 10
+                    ))
+            for offset in range(0, len(deposits), 5000):
+                cur.executemany("""
+                    INSERT INTO `deposits` (`coin_name`, `api_id`, `depost_id`, `txid`, `address`, `height`, `amount`, `time_insert`, `can_credit`, `confirmations`)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, deposits[offset:offset + 5000])
+    conn.close()
+    return {"api_key": api_key, "addresses": addresses}
+
+
+def write_config(config, args, workdir: str):
+    run_config = json.loads(json.dumps(config))
+    run_config['coinapi'].update({
+        "api_bind": "127.0.0.1",
+        "api_port": args.port,
+        "kv_prefix": "loadtest_",
+        "list_btc": [i for i, v in COINS.items() if v[0] == "BTC"],
+        "list_bcn_xmr": [i for i, v in COINS.items() if v[0] != "BTC"],
+        "api_workers": args.workers,
+        "leader_election": args.workers > 1,
+        "redis_lock": args.workers > 1,
+        "cache_events": args.workers > 1,
+    })
+    run_config['address_pool'] = {"coins": [], "low_water": 0, "target": 0}
+    run_config['integrated_address'] = {}
+    run_config.setdefault('log', {})['discord_webhook_default'] = node_url(args.node_port, "btc") + "/discord"
+    run_config['webhook'] = {"enable": False}
+    os.makedirs(workdir, exist_ok=True)
+    with open(os.path.join(workdir, "config.toml"), "w") as f:
+        toml.dump(run_config, f)
+
+
+def percentile(values: list, p: float) -> float:
+    # nearest rank on sorted values
+    if len(values) == 0:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(p / 100.0 * len(values)) - 1))]
+
+
+class LoadRun:
+    def __init__(self, args, api_key: str, addresses: dict):
+        self.args = args
+        self.base = "http://127.0.0.1:{}".format(args.port)
+        self.headers = {"Authorization": api_key}
+        self.addresses = addresses
+        self.samples = {i: [] for i in OPERATIONS}
+        self.errors = {}
+        weights = dict([(k, float(v)) for k, v in [i.split("=") for i in args.mix.split(",")]])
+        self.operations = [i for i in OPERATIONS if weights.get(i, 0) > 0]
+        self.weights = [weights[i] for i in self.operations]
+
+    async def request(self, session, method: str, path: str, **kwargs):
+        async with session.request(method, self.base + path, headers=self.headers, **kwargs) as response:
+            body = await response.read()
+            if response.status != 200:
+                return False, "HTTP {}".format(response.status)
+            data = json.loads(body)
+            return data.get('success') is True, data.get('message')
+
+    async def operation(self, session, rnd: random.Random, name: str):
+        coin_name = rnd.choice(list(self.addresses))
+        address = rnd.choice(self.addresses[coin_name])
+        if name == "balance":
+            return await self.request(session, "POST", "/balance", json={"coin": coin_name, "address": address})
+        elif name == "list_transactions":
+            return await self.request(session, "GET", "/list_transactions/{}/{}".format(coin_name, address), params={"limit": 50})
+        elif name == "transfer":
+            to_address = rnd.choice(self.addresses[coin_name])
+            if to_address == address:
+                return True, None
+            return await self.request(session, "POST", "/transfer", json=[{
+                "coin": coin_name, "from_address": address, "to_address": to_address, "amount": 0.001, "remark": "loadtest"
+            }])
+        elif name == "newaddress":
+            return await self.request(session, "POST", "/newaddress", json={"coin": coin_name, "tag": "lt-" + uuid.uuid4().hex})
+        elif name == "withdraw":
+            return await self.request(session, "POST", "/withdraw", json={
+                "coin": coin_name, "from_address": address, "to_address": "external" + uuid.uuid4().hex,
+                "amount": 0.01, "remark": "loadtest"
+            })
+
+    async def worker(self, session, n: int, deadline: float):
+        rnd = random.Random("{}_{}".format(self.args.seed, n))
+        while time.perf_counter() < deadline:
+            name = rnd.choices(self.operations, weights=self.weights)[0]
+            start = time.perf_counter()
+            try:
+                ok, message = await self.operation(session, rnd, name)
+            except Exception as e:
+                ok, message = False, type(e).__name__
+            self.samples[name].append((time.perf_counter() - start, ok))
+            if not ok:
+                key = "{}: {}".format(name, str(message)[:80])
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    async def run(self, duration: float):
+        connector = aiohttp.TCPConnector(limit=self.args.concurrency)
+        timeout = aiohttp.ClientTimeout(total=120)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            start = time.perf_counter()
+            await asyncio.gather(*[self.worker(session, n, start + duration) for n in range(self.args.concurrency)])
+            return time.perf_counter() - start
+
+    def summary(self, elapsed: float) -> dict:
+        result = {}
+        for name in self.operations + ["all"]:
+            samples = [j for i in self.samples.values() for j in i] if name == "all" else self.samples[name]
+            latencies = sorted([i[0] * 1000 for i in samples])
+            result[name] = {
+                "requests": len(samples),
+                "failed": len([i for i in samples if i[1] is not True]),
+                "rps": round(len(samples) / elapsed, 2),
+                "p50_ms": round(percentile(latencies, 50), 2) if latencies else None,
+                "p90_ms": round(percentile(latencies, 90), 2) if latencies else None,
+                "p99_ms": round(percentile(latencies, 99), 2) if latencies else None,
+                "max_ms": round(latencies[-1], 2) if latencies else None
+            }
+        return result
+
+
+def print_summary(summary: dict):
+    print("{:<18} {:>9} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9}".format("endpoint", "requests", "failed", "rps", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+    for name, i in summary.items():
+        print("{:<18} {:>9} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9}".format(
+            name, i['requests'], i['failed'], i['rps'], str(i['p50_ms']), str(i['p90_ms']), str(i['p99_ms']), str(i['max_ms'])
+        ))
+
+
+def compare(base_path: str, new_path: str):
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print("{} ({}) -> {} ({})".format(base['label'], base['git'][:10], new['label'], new['git'][:10]))
+    print("{:<18} {:>18} {:>22} {:>22}".format("endpoint", "rps", "p50 ms", "p99 ms"))
+
+    def change(a, b):
+        if a is None or b is None:
+            return "{} -> {}".format(a, b)
+        return "{} -> {} ({:+.1f}%)".format(a, b, (b - a) * 100.0 / a if a else 0.0)
+
+    for name, i in new['summary'].items():
+        j = base['summary'].get(name)
+        if j is None:
+            continue
+        print("{:<18} {:>18} {:>22} {:>22}".format(
+            name, change(j['rps'], i['rps']), change(j['p50_ms'], i['p50_ms']), change(j['p99_ms'], i['p99_ms'])
+        ))
+
+
+def wait_for_api(port: int, process, timeout: float = 60.0):
+    import urllib.request
+    end = time.time() + timeout
+    while time.time() < end:
+        if process.poll() is not None:
+            raise RuntimeError("coinapi exited with {}".format(process.returncode))
+        try:
+            with urllib.request.urlopen("http://127.0.0.1:{}/status".format(port), timeout=2) as response:
+                if len(json.loads(response.read()).get('data') or []) == len(COINS):
+                    return
+        except Exception:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("coinapi did not come up in {}s".format(timeout))
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except Exception:
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test coinapi end to end against fake coin nodes.")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two saved runs and exit")
+    parser.add_argument("--reset-db", action="store_true", help="load coinapi_db.sql into the loadtest database first")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds of load before measuring")
+    parser.add_argument("--mix", default="balance=40,list_transactions=20,transfer=20,newaddress=10,withdraw=10")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake node answer delay, seconds")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--addresses", type=int, default=1000, help="seeded addresses per coin")
+    parser.add_argument("--deposits", type=int, default=5, help="seeded deposits per address")
+    parser.add_argument("--workers", type=int, default=1, help="coinapi api_workers")
+    parser.add_argument("--port", type=int, default=18100, help="coinapi port")
+    parser.add_argument("--node-port", type=int, default=18110, help="first of 5 ports for the fake nodes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--workdir", default="loadtest_run")
+    parser.add_argument("--results", default="loadtest_results")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    config = load_config()
+    if "loadtest" not in config['mysql']['db']:
+        sys.exit("refusing to seed {}: the [mysql] db name must contain 'loadtest'".format(config['mysql']['db']))
+    if args.reset_db:
+        reset_db(config)
+    seeded = seed(config, args)
+    write_config(config, args, args.workdir)
+
+    processes = []
+    log = open(os.path.join(args.workdir, "coinapi.log"), "w")
+    try:
+        node_args = []
+        for node, offset in NODE_PORTS.items():
+            node_args += ["--" + node.replace("_", "-"), str(args.node_port + offset)]
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "tools", "fake_rpc.py"), "--latency", str(args.latency), "--jitter", str(args.jitter)] + node_args,
+            stdout=log, stderr=subprocess.STDOUT
+        ))
+        api = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "coinapi.py")], cwd=args.workdir, stdout=log, stderr=subprocess.STDOUT
+        )
+        processes.append(api)
+        wait_for_api(args.port, api)
+
+        if args.warmup > 0:
+            asyncio.run(LoadRun(args, seeded['api_key'], seeded['addresses']).run(args.warmup))
+        load = LoadRun(args, seeded['api_key'], seeded['addresses'])
+        elapsed = asyncio.run(load.run(args.duration))
+    finally:
+        for process in processes:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        log.close()
+
+    summary = load.summary(elapsed)
+    print_summary(summary)
+    for message, count in sorted(load.errors.items(), key=lambda i: -i[1])[:10]:
+        print("{:>7}  {}".format(count, message))
+    os.makedirs(args.results, exist_ok=True)
+    path = os.path.join(args.results, "{}_{}.json".format(time.strftime("%Y%m%d-%H%M%S"), args.label))
+    with open(path, "w") as f:
+        json.dump({
+            "label": args.label,
+            "time": int(time.time()),
+            "git": git_revision(),
+            "settings": {k: v for k, v in vars(args).items() if k not in ["compare"]},
+            "elapsed": round(elapsed, 3),
+            "summary": summary,
+            "errors": load.errors
+        }, f, indent=2)
+    print("saved {}".format(path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import argparse
+import sys
+import os
+import json
+
+import redis
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from config import load_config
+
+# Tell running coinapi processes (with coinapi.cache_events on) about a manual DB change:
+#   python tools/publish_event.py settings_changed
+#   python tools/publish_event.py key_changed --api-id 12
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish a coinapi cache event.")
+    parser.add_argument("event", choices=["settings_changed", "key_changed"])
+    parser.add_argument("--api-id", type=int, help="api_users.id, for key_changed")
+    args = parser.parse_args()
+    if args.event == "key_changed" and args.api_id is None:
+        parser.error("key_changed needs --api-id")
+
+    config = load_config()
+    r = redis.Redis(host='localhost', port=6379, db=0)
+    data = {"api_id": args.api_id} if args.event == "key_changed" else {}
+    receivers = r.publish(
+        config['coinapi']['kv_prefix'] + "events",
+        json.dumps({"type": args.event, "origin": "tools", "data": data})
+    )
+    print("{} sent to {} process(es).".format(args.event, receivers))
+
+
+if __name__ == "__main__":
+    main()
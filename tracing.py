@@ -0,0 +1,181 @@
+import contextvars
+import functools
+import os
+import random
+import time
+
+# Lightweight per-request spans. The HTTP middleware of coinapi.py starts a Trace for a
+# sampled request; span() records timings into it from anywhere below in the same task
+# (or tasks created from it), and is a no-op when no trace is active.
+
+MAX_SPANS = 1000
+
+current_trace = contextvars.ContextVar("coinapi_trace", default=None)
+current_span = contextvars.ContextVar("coinapi_span", default=None)
+
+
+def new_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+
+class Trace:
+    def __init__(self, name: str, attrs: dict = None):
+        self.trace_id = new_id(16)
+        self.span_id = new_id(8)
+        self.name = name
+        self.attrs = attrs or {}
+        self.start = time.time()
+        self.start_perf = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self.dropped = 0
+
+    def finish(self, **attrs):
+        self.duration = time.perf_counter() - self.start_perf
+        self.attrs.update(attrs)
+        return self.duration
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attrs": self.attrs,
+            "spans": self.spans,
+            "dropped_spans": self.dropped
+        }
+
+
+def start_trace(name: str, sample_rate: float = 1.0, **attrs):
+    # returns (trace, token) or (None, None) when the request is not sampled
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return None, None
+    trace = Trace(name, attrs)
+    return trace, current_trace.set(trace)
+
+
+def end_trace(token):
+    if token is not None:
+        current_trace.reset(token)
+
+
+class span:
+    # with span("rpc", coin="XMR", method="transfer"): ...
+    __slots__ = ("name", "attrs", "trace", "id", "parent", "token", "start")
+
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.trace = None
+
+    def __enter__(self):
+        self.trace = current_trace.get()
+        if self.trace is None:
+            return self
+        self.id = new_id(8)
+        self.parent = current_span.get() or self.trace.span_id
+        self.token = current_span.set(self.id)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.trace is None:
+            return False
+        current_span.reset(self.token)
+        append_span(
+            self.trace, self.id, self.parent, self.name, self.start, time.perf_counter(), self.attrs,
+            exc_type.__name__ if exc_type is not None else None
+        )
+        return False
+
+
+def append_span(trace: Trace, span_id: str, parent: str, name: str, start: float, end: float, attrs: dict, error: str = None):
+    if len(trace.spans) >= MAX_SPANS:
+        trace.dropped += 1
+        return
+    record = {
+        "id": span_id,
+        "parent": parent,
+        "name": name,
+        "offset_ms": round((start - trace.start_perf) * 1000, 3),
+        "duration_ms": round((end - start) * 1000, 3)
+    }
+    if len(attrs) > 0:
+        record["attrs"] = attrs
+    if error is not None:
+        record["error"] = error
+    trace.spans.append(record)
+
+
+def add_span(name: str, start: float, error: str = None, **attrs):
+    # for an interval already timed by the caller, from start (time.perf_counter()) to now
+    trace = current_trace.get()
+    if trace is not None:
+        append_span(
+            trace, new_id(8), current_span.get() or trace.span_id, name, start, time.perf_counter(), attrs, error
+        )
+
+
+def traced(name: str):
+    # decorator for coroutines: the whole call is one span
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if current_trace.get() is None:
+                return await func(*args, **kwargs)
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_attributes(attrs: dict):
+    return [{"key": k, "value": otlp_value(v)} for k, v in attrs.items() if v is not None]
+
+
+def to_otlp(traces: list, service_name: str = "coinapi"):
+    # OTLP/HTTP JSON body (POST to <collector>/v1/traces)
+    spans = []
+    for trace in traces:
+        start_ns = int(trace.start * 1e9)
+        spans.append({
+            "traceId": trace.trace_id,
+            "spanId": trace.span_id,
+            "name": trace.name,
+            "kind": 2,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int(trace.duration * 1e9)),
+            "attributes": otlp_attributes(trace.attrs)
+        })
+        for record in trace.spans:
+            span_start = start_ns + int(record['offset_ms'] * 1e6)
+            attrs = dict(record.get('attrs', {}))
+            if record.get('error') is not None:
+                attrs['error.type'] = record['error']
+            spans.append({
+                "traceId": trace.trace_id,
+                "spanId": record['id'],
+                "parentSpanId": record['parent'],
+                "name": record['name'],
+                "kind": 1,
+                "startTimeUnixNano": str(span_start),
+                "endTimeUnixNano": str(span_start + int(record['duration_ms'] * 1e6)),
+                "attributes": otlp_attributes(attrs)
+            })
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": otlp_attributes({"service.name": service_name})},
+            "scopeSpans": [{"scope": {"name": "coinapi"}, "spans": spans}]
+        }]
+    }